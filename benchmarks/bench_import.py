@@ -0,0 +1,98 @@
+"""Import time of the sshaolin modules, with a budget
+
+Imports each module in fresh interpreters with -X importtime (python 3.7+)
+and reports the median cumulative import time.  Bytecode is cached in a
+temporary pycache prefix and warmed up first, so the numbers are what an
+installed package costs.  Exits 1 when a module is over its budget
+(BUDGETS_MS or --budget-ms), which is how a new eager import of paramiko or
+cryptography gets caught.
+
+    $ PYTHONPATH=. python benchmarks/bench_import.py
+    $ PYTHONPATH=. python benchmarks/bench_import.py --top 10 sshaolin.client
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# milliseconds, asyncio alone is most of sshaolin.aio
+BUDGETS_MS = {
+    "sshaolin.client": 100, "sshaolin.fanout": 100,
+    "sshaolin.behaviors": 100, "sshaolin.aio": 200}
+
+
+def import_times(module, env):
+    """Returns {imported module: cumulative microseconds} for one import of
+    module in a new interpreter"""
+    proc = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    _, stderr = proc.communicate()
+    if proc.returncode:
+        raise SystemExit(stderr.decode("utf-8", "replace"))
+    times = {}
+    for line in stderr.decode("utf-8", "replace").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=sorted(BUDGETS_MS))
+    parser.add_argument(
+        "--count", type=int, default=9, help="Interpreters per module")
+    parser.add_argument(
+        "--budget-ms", type=float,
+        help="Max median import time of every module, instead of the "
+        "per module BUDGETS_MS (100 ms for modules without one)")
+    parser.add_argument(
+        "--top", type=int, default=0,
+        help="Also print the slowest imports under each module")
+    parser.add_argument("--output", help="Write the results JSON here")
+    args = parser.parse_args()
+
+    prefix = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=prefix)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    results = {}
+    over = []
+    try:
+        for module in args.modules:
+            import_times(module, env)
+            runs = [import_times(module, env) for _ in range(args.count)]
+            ms = median([run[module] for run in runs]) / 1e3
+            results[module] = ms
+            print("{0:<24} {1:>8.1f} ms".format(module, ms))
+            budget = args.budget_ms or BUDGETS_MS.get(module, 100)
+            if ms > budget:
+                over.append((module, budget))
+            if args.top:
+                slowest = sorted(
+                    runs[0].items(), key=lambda item: -item[1])[1:args.top]
+                for name, us in slowest:
+                    print("    {0:<40} {1:>8.1f} ms".format(name, us / 1e3))
+    finally:
+        shutil.rmtree(prefix)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    for module, budget in over:
+        print("OVER BUDGET {0}: {1:.1f} ms > {2:.1f} ms".format(
+            module, results[module], budget))
+    if over:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
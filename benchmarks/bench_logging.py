@@ -0,0 +1,117 @@
+"""Per call overhead of the SSHLogger decorator
+
+Wraps a method returning a canned CommandResponse and times calls with the
+logger above INFO, at INFO with full output, at INFO with head/tail
+truncation and with the previous decorator (always formatted).  Records go to
+a handler that drops them so only the sshaolin side is measured.
+
+    $ python benchmarks/bench_logging.py --output-kb 1 1024 --calls 2000
+"""
+import argparse
+import functools
+import logging
+import time
+
+from sshaolin import common
+from sshaolin.models import CommandResponse
+
+
+def previous_logger(func):
+    """The decorator SSHLogger was before it checked the log level"""
+    def log_response(obj, resp, elapsed):
+        message = (
+            u"\n{equals}\nRESPONSE\n{dash}\n"
+            u"response stdout......: {stdout}\n"
+            u"response stderr......: {stderr}\n"
+            u"response exit_status.: {exit_status}\n"
+            u"response elapsed.....: {elapsed}\n"
+            u"{dash}\n").format(
+            dash="-" * 42, equals="=" * 42, elapsed=elapsed,
+            stdout=(resp.stdout or b"").decode("UTF-8", "ignore"),
+            stderr=(resp.stderr or b"").decode("UTF-8", "ignore"),
+            exit_status=resp.exit_status)
+        obj._log.info(message)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        message = (
+            u"\n{equals}\nCALL\n{dash}\n"
+            u"{name} args..........: {args}\n"
+            u"{name} kwargs........: {kwargs}\n"
+            u"{dash}\n").format(
+            dash="-" * 42, equals="=" * 42, name=func.__name__,
+            args=args, kwargs=kwargs)
+        self._log.info(message)
+        start = time.time()
+        resp = func(self, *args, **kwargs)
+        log_response(self, resp, time.time() - start)
+        return resp
+    return wrapper
+
+
+class DropHandler(logging.Handler):
+    def emit(self, record):
+        record.getMessage()
+
+
+class Bench(common.BaseSSHClass):
+    def __init__(self, response):
+        super(Bench, self).__init__()
+        self.response = response
+
+    def bare(self, cmd):
+        return self.response
+
+    current = common.SSHLogger(bare)
+    previous = previous_logger(bare)
+
+
+def measure(method, calls):
+    start = time.time()
+    for _ in range(calls):
+        method("ls -ltr")
+    return (time.time() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--output-kb", nargs="+", type=int, default=[1, 64, 1024],
+        help="Size of the logged stdout in KB")
+    parser.add_argument(
+        "--calls", type=int, default=2000, help="Calls per measurement")
+    args = parser.parse_args()
+
+    log = Bench._log
+    log.addHandler(DropHandler())
+    log.propagate = False
+    cases = [
+        ("bare", logging.WARNING, {}, "bare"),
+        ("previous", logging.INFO, {}, "previous"),
+        ("off", logging.WARNING, {}, "current"),
+        ("info", logging.INFO, {}, "current"),
+        ("info 256/256", logging.INFO,
+         {"output_head": 256, "output_tail": 256}, "current"),
+        ("json 256/256", logging.INFO,
+         {"output_head": 256, "output_tail": 256, "structured": True},
+         "current")]
+
+    row = "{:>8}" + " {:>13}" * len(cases)
+    print("microseconds per call")
+    print(row.format("KB", *[name for name, _, _, _ in cases]))
+    for kb in args.output_kb:
+        bench = Bench(CommandResponse(
+            stdout=b"x" * (kb * 1024), stderr=b"", exit_status=0))
+        results = []
+        for _, level, settings, method in cases:
+            log.setLevel(level)
+            common.configure_logging(
+                output_head=None, output_tail=None, structured=False)
+            common.configure_logging(**settings)
+            results.append("{0:.1f}".format(
+                measure(getattr(bench, method), args.calls)))
+        print(row.format(kb, *results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Throughput of SSHShell._read_shell_response on multi-MB outputs
+
+Feeds a framed shell response through an in-memory channel and compares the
+previous reader (1024 byte reads concatenated onto bytes and rescanned with
+count() every iteration) with the current one.
+
+    $ python benchmarks/bench_shell_reader.py --sizes 1 4 16
+"""
+import argparse
+import os
+import time
+
+from sshaolin import common
+from sshaolin.client import CommandOperationTimeOut, SSHShell
+
+
+class MemoryChannel(object):
+    """Just enough of a paramiko Channel to serve a canned shell response"""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.eof_received = False
+        self.closed = False
+        # a pipe with a byte in it is always readable, like a channel with
+        # buffered data
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, b"x")
+
+    def fileno(self):
+        return self._read_fd
+
+    def recv_ready(self):
+        return bool(self.data)
+
+    def recv(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk.tobytes()
+
+    def recv_stderr_ready(self):
+        return False
+
+    def recv_stderr(self, size):
+        return b""
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def previous_read_shell_response(channel, uuid, max_time):
+    """The reader SSHShell used before it was made linear"""
+    def read_channel(read_func, buffsize=1024):
+        if not channel.recv_ready():
+            return b""
+        return read_func(buffsize)
+
+    stdout = stderr = b""
+    while max_time > time.time():
+        stdout += read_channel(channel.recv)
+        stderr += read_channel(channel.recv_stderr)
+        if stdout.count(uuid) == 2:
+            list_ = stdout.split(uuid)
+            stdout = list_[1]
+            break
+    else:
+        raise CommandOperationTimeOut("Command timed out")
+    return stdout.strip()
+
+
+def current_read_shell_response(channel, uuid, max_time):
+    shell = SSHShell.__new__(SSHShell)
+    shell.channel = channel
+    try:
+        return shell._read_shell_response(uuid, max_time).stdout
+    finally:
+        del shell.channel
+
+
+def measure(reader, size, max_seconds):
+    uuid = b"0123456789abcdef0123456789abcdef"
+    line = b"x" * 79 + b"\n"
+    body = line * (size // len(line))
+    channel = MemoryChannel(uuid + b"\n" + body + uuid + b" 0\n")
+    start = time.time()
+    try:
+        stdout = reader(channel, uuid, start + max_seconds)
+    except CommandOperationTimeOut:
+        return None
+    finally:
+        channel.close()
+    elapsed = time.time() - start
+    assert stdout == body.strip()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", nargs="+", type=float, default=[1, 4, 16],
+        help="Output sizes in MB")
+    parser.add_argument(
+        "--max-seconds", type=float, default=common.DEFAULT_TIMEOUT,
+        help="Give up on a reader after this many seconds")
+    args = parser.parse_args()
+
+    row = "{0:>8} {1:>20} {2:>20}"
+    print(row.format("MB", "previous MB/s", "current MB/s"))
+    for size in args.sizes:
+        nbytes = int(size * 1024 * 1024)
+        results = []
+        for reader in (
+                previous_read_shell_response, current_read_shell_response):
+            elapsed = measure(reader, nbytes, args.max_seconds)
+            results.append(
+                "timed out" if elapsed is None else
+                "{0:.1f}".format(size / max(elapsed, 1e-9)))
+        print(row.format(size, *results))
+
+
+if __name__ == "__main__":
+    main()
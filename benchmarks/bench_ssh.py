@@ -0,0 +1,236 @@
+"""End to end throughput and latency against an in process ssh/sftp server
+
+Starts the paramiko server from tests/server.py on 127.0.0.1 (optionally with
+added round trip latency and a bandwidth cap) and measures connection setup,
+SSHClient.execute_command (new and pooled connections), a batch of 10
+commands through SSHClient.execute_many, SSHShell.execute_command and sftp
+throughput for small and large files.
+Exec requests get a canned response so only the ssh side is measured.
+
+Results are written as JSON with --output, --baseline compares against a
+previous run and exits 1 when any case got slower than --tolerance allows.
+--profile runs every case with a transport tuning profile and
+--compare-profiles runs them once per profile and prints them side by side.
+
+    $ PYTHONPATH=. python benchmarks/bench_ssh.py --output results.json
+    $ PYTHONPATH=. python benchmarks/bench_ssh.py --latency-ms 20 \\
+        --bandwidth-mbps 100 --baseline results.json
+    $ PYTHONPATH=. python benchmarks/bench_ssh.py --compare-profiles --text \\
+        --bandwidth-mbps 100
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import paramiko
+
+from sshaolin import tuning
+from sshaolin.client import SSHClient
+from tests.server import SSHServer
+
+DEFAULT = "default"
+TEXT_LINE = (
+    b"2016-01-01 00:00:00,000: INFO: sshaolin: GET /index.html 200 "
+    b"1532 0.004\n")
+
+
+def percentile(values, percent):
+    """Nearest rank percentile"""
+    values = sorted(values)
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def measure(func, count, size=0):
+    """Calls func() count times, returns the stats of the calls
+
+    size is the bytes each call moves, for the MB/s figure
+    """
+    latencies = []
+    start = time.time()
+    for _ in range(count):
+        call_start = time.time()
+        func()
+        latencies.append(time.time() - call_start)
+    total = time.time() - start
+    result = {
+        "ops": count, "seconds": total, "ops_per_sec": count / total,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3}
+    if size:
+        result["mb_per_sec"] = size * count / total / 1e6
+    return result
+
+
+def payload(size, text=False):
+    """Random bytes, or log lines that compress well with text"""
+    if not text:
+        return os.urandom(size)
+    return (TEXT_LINE * (size // len(TEXT_LINE) + 1))[:size]
+
+
+def run(args, folder, profile=None):
+    server = SSHServer(
+        lambda command: (b"", b"", 0), latency=args.latency_ms / 1e3,
+        bandwidth=args.bandwidth_mbps and args.bandwidth_mbps * 125000)
+    kwargs = {
+        "hostname": "127.0.0.1", "port": server.port, "username": "bench",
+        "password": "bench", "timeout": 120,
+        "profile": None if profile == DEFAULT else profile}
+    client = SSHClient(**kwargs)
+    pooled = SSHClient(pooled=True, **kwargs)
+    count = args.count
+    results = {}
+    try:
+        results["connect"] = measure(
+            lambda: client._connect().close(), count)
+        results["client_execute"] = measure(
+            lambda: client.execute_command("true"), count)
+        results["client_execute_pooled"] = measure(
+            lambda: pooled.execute_command("true"), count)
+        results["client_execute_many_10"] = measure(
+            lambda: pooled.execute_many(["true"] * 10), count)
+        with client.create_shell() as shell:
+            results["shell_execute"] = measure(
+                lambda: shell.execute_command("true"), count)
+        with client.create_sftp() as sftp:
+            small = payload(args.small_kb * 1024, args.text)
+            names = iter(range(count * 2))
+            results["sftp_small_put"] = measure(
+                lambda: sftp.write_file(small, os.path.join(
+                    folder, "small{0}".format(next(names)))),
+                count, len(small))
+            results["sftp_small_get"] = measure(
+                lambda: sftp.get_file(os.path.join(folder, "small0")),
+                count, len(small))
+            large = payload(args.large_mb * 1024 * 1024, args.text)
+            path = os.path.join(folder, "large")
+            results["sftp_large_put"] = measure(
+                lambda: sftp.write_file(large, path), args.large_count,
+                len(large))
+            results["sftp_large_get"] = measure(
+                lambda: sftp.get_file(path), args.large_count, len(large))
+    finally:
+        pooled.close()
+        server.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a line per case that is slower than baseline by more than
+    tolerance (a fraction of the baseline rate)"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ["ops_per_sec", "mb_per_sec"]:
+            if key in before and result[key] < before[key] * (1 - tolerance):
+                regressions.append("{0} {1}: {2:.1f} -> {3:.1f}".format(
+                    name, key, before[key], result[key]))
+    return regressions
+
+
+def print_profiles(by_profile):
+    """One row per case and rate, one column per profile"""
+    names = list(by_profile)
+    row = "{:<36}" + " {:>15}" * len(names)
+    print(row.format("case", *names))
+    for case in sorted(by_profile[names[0]]):
+        for key in ["ops_per_sec", "mb_per_sec"]:
+            if key in by_profile[names[0]][case]:
+                print(row.format(case + " " + key, *[
+                    "{0:.1f}".format(by_profile[name][case][key])
+                    for name in names]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--count", type=int, default=200, help="Calls per case")
+    parser.add_argument(
+        "--latency-ms", type=float, default=0,
+        help="Added round trip latency")
+    parser.add_argument(
+        "--bandwidth-mbps", type=float, default=0,
+        help="Bandwidth cap each way, 0 for none")
+    parser.add_argument(
+        "--small-kb", type=int, default=4, help="Small file size")
+    parser.add_argument(
+        "--large-mb", type=int, default=32, help="Large file size")
+    parser.add_argument(
+        "--large-count", type=int, default=3, help="Large file transfers")
+    parser.add_argument(
+        "--text", action="store_true",
+        help="Transfer compressible text instead of random bytes")
+    parser.add_argument(
+        "--profile", choices=sorted(tuning.PROFILES),
+        help="Transport tuning profile for every case")
+    parser.add_argument(
+        "--compare-profiles", action="store_true",
+        help="Run the cases once per profile and compare them")
+    parser.add_argument("--output", help="Write the results JSON here")
+    parser.add_argument("--baseline", help="Results JSON to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="Slowdown allowed against the baseline (0.2 is 20%%)")
+    args = parser.parse_args()
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    profiles = [args.profile or DEFAULT]
+    if args.compare_profiles:
+        profiles = [DEFAULT] + sorted(tuning.PROFILES)
+    by_profile = {}
+    folder = tempfile.mkdtemp()
+    try:
+        for profile in profiles:
+            by_profile[profile] = run(args, folder, profile)
+    finally:
+        shutil.rmtree(folder)
+    if args.compare_profiles:
+        print_profiles(by_profile)
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump(by_profile, fp, indent=2, sort_keys=True)
+        return
+    results = by_profile[profiles[0]]
+
+    row = "{:<24} {:>10} {:>10} {:>10} {:>10}"
+    print(row.format("case", "ops/s", "p50 ms", "p99 ms", "MB/s"))
+    for name, result in sorted(results.items()):
+        print(row.format(
+            name, "{0:.1f}".format(result["ops_per_sec"]),
+            "{0:.2f}".format(result["p50_ms"]),
+            "{0:.2f}".format(result["p99_ms"]),
+            "{0:.1f}".format(result["mb_per_sec"])
+            if "mb_per_sec" in result else "-"))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "paramiko": paramiko.__version__, "time": time.time(),
+            "latency_ms": args.latency_ms,
+            "bandwidth_mbps": args.bandwidth_mbps, "count": args.count,
+            "small_kb": args.small_kb, "large_mb": args.large_mb,
+            "text": args.text, "profile": profiles[0]},
+        "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(
+                results, json.load(fp)["results"], args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -41,7 +41,9 @@ setup(
     long_description='{0}'.format(open('README.md').read()),
     author='Nathan Buckner',
     author_email='bucknerns@gmail.com',
-    install_requires=['paramiko', 'pysocks', 'six'],
+    install_requires=[
+        'paramiko', 'pysocks', 'six',
+        'selectors34; python_version < "3.4"'],
     packages=find_packages(exclude=('tests*',)),
     license=open('LICENSE').read(),
     classifiers=[
@@ -0,0 +1,348 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""asyncio versions of SSHClient, SSHShell and SFTPShell (python 3.5+ only)
+
+Channel output is read from the event loop by watching the channel's fileno()
+with loop.add_reader so no thread is held while a command runs.  paramiko has
+no non-blocking connect, channel open or SFTP request API so those short steps
+run on the loop's default executor, as do the waits that have no fd to watch
+(a full channel window, the exit status arriving after eof).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from uuid import uuid4
+import asyncio
+import functools
+import logging
+import socket
+import time
+
+from sshaolin import common
+from sshaolin.client import (
+    CommandOperationTimeOut, SFTPShell, ShellResponseReader, SSHClient,
+    SSHShell)
+from sshaolin.models import CommandResponse
+
+
+def AsyncSSHLogger(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        enabled = self._log.isEnabledFor(logging.INFO)
+        if enabled:
+            common.log_call(self, func.__name__, args, kwargs)
+            start = time.time()
+        try:
+            resp = await func(self, *args, **kwargs)
+        except Exception as e:
+            self._log.critical(e)
+            raise
+        if enabled:
+            common.log_response(self, resp, time.time() - start)
+        return resp
+    return wrapper
+
+
+def _open_exec_channel(transport, command, timeout):
+    chan = transport.open_session(timeout=timeout)
+    chan.exec_command(command)
+    return chan
+
+
+def _open_shell_channel(transport):
+    chan = transport.open_session()
+    chan.invoke_shell()
+    return chan
+
+
+class ChannelWaiter(object):
+    """Wakes a coroutine up when a paramiko channel has data, eof or closed"""
+
+    def __init__(self, channel, loop=None):
+        self.channel = channel
+        self.loop = loop or asyncio.get_event_loop()
+        self._event = asyncio.Event()
+        self._fd = channel.fileno()
+        self.loop.add_reader(self._fd, self._event.set)
+
+    async def wait(self, timeout=None):
+        await asyncio.wait_for(self._event.wait(), timeout)
+        self._event.clear()
+
+    def close(self):
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self._fd = None
+
+
+def _blocking_send(channel, data, timeout):
+    # waits for window space, reads only happen once data is ready so they
+    # don't mind the timeout changing meanwhile
+    previous = channel.gettimeout()
+    channel.settimeout(timeout)
+    try:
+        return channel.send(data)
+    finally:
+        channel.settimeout(previous)
+
+
+async def send_all(channel, data, max_time):
+    """Writes data to a channel without blocking the loop on a full window
+
+    Writes go straight out while there is window space, a full window is
+    waited for on the default executor.
+    """
+    data = memoryview(data)
+    while data:
+        chunk = data[:common.READ_SIZE]
+        if channel.send_ready():
+            data = data[channel.send(chunk):]
+            continue
+        timeout = max_time - time.time()
+        if timeout <= 0:
+            raise CommandOperationTimeOut("Timed out writing to channel")
+        try:
+            data = data[await asyncio.get_event_loop().run_in_executor(
+                None, _blocking_send, channel, chunk, timeout):]
+        except socket.timeout:
+            raise CommandOperationTimeOut("Timed out writing to channel")
+
+
+async def read_until_exit(channel, max_time, loop=None):
+    """Drains stdout/stderr of an exec channel and returns
+    (stdout, stderr, exit_status)"""
+    stdout, stderr = BytesIO(), BytesIO()
+    waiter = ChannelWaiter(channel, loop)
+    try:
+        while True:
+            # data always arrives before eof so check eof before draining
+            done = channel.eof_received or channel.closed
+            while channel.recv_ready():
+                stdout.write(channel.recv(common.READ_SIZE))
+            while channel.recv_stderr_ready():
+                stderr.write(channel.recv_stderr(common.READ_SIZE))
+            if done:
+                break
+            await waiter.wait(max_time - time.time())
+    except asyncio.TimeoutError:
+        raise CommandOperationTimeOut("Command timed out")
+    finally:
+        waiter.close()
+    # exit-status usually arrives right around eof and has no fd to watch
+    if not channel.exit_status_ready() and not (
+            await asyncio.get_event_loop().run_in_executor(
+                None, channel.status_event.wait,
+                max(max_time - time.time(), 0))):
+        raise CommandOperationTimeOut("Command timed out")
+    return stdout.getvalue(), stderr.getvalue(), channel.recv_exit_status()
+
+
+class AsyncSSHClient(common.BaseSSHClass):
+    def __init__(
+        self, hostname=None, max_sessions=common.MAX_SESSIONS,
+            **client_kwargs):
+        """Event loop driven SSHClient
+
+        Commands share one authenticated connection and each one runs on its
+        own session channel, at most max_sessions at a time (sshd's
+        MaxSessions defaults to 10).
+
+        :param int max_sessions: Max concurrent channels on the connection
+        :param client_kwargs: SSHClient kwargs
+        """
+        super(AsyncSSHClient, self).__init__()
+        self.client = SSHClient(hostname=hostname, **client_kwargs)
+        self.max_sessions = max_sessions
+        self.connection = None
+        self._connect_lock = None
+        self._sessions = None
+
+    @property
+    def timeout(self):
+        return self.client.timeout
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(func, *args, **kwargs))
+
+    async def connect(self, **connect_kwargs):
+        """Opens the shared connection if it isn't open already"""
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+            self._sessions = asyncio.Semaphore(self.max_sessions)
+        async with self._connect_lock:
+            transport = (
+                self.connection.get_transport() if self.connection else None)
+            if transport is None or not transport.is_active():
+                self.connection = await self._run(
+                    self.client._connect, **connect_kwargs)
+        return self.connection
+
+    @AsyncSSHLogger
+    async def execute_command(
+            self, command, stdin_str=b"", stdin_file=None, timeout=None):
+        timeout = timeout or self.timeout
+        max_time = time.time() + timeout
+        connection = await self.connect()
+        async with self._sessions:
+            chan = await self._run(
+                _open_exec_channel, connection.get_transport(), command,
+                timeout)
+            try:
+                stdin_str = (
+                    stdin_str if stdin_file is None else stdin_file.read())
+                stdin_str = stdin_str.encode() if isinstance(
+                    stdin_str, str) else stdin_str
+                await send_all(chan, stdin_str + b"\n\x04", max_time)
+                stdout, stderr, exit_status = await read_until_exit(
+                    chan, max_time)
+            finally:
+                chan.close()
+        return CommandResponse(
+            stdin=stdin_str, stdout=stdout, stderr=stderr,
+            exit_status=exit_status)
+
+    @AsyncSSHLogger
+    async def create_shell(self, keepalive=None, **connect_kwargs):
+        connection = await self._run(self.client._connect, **connect_kwargs)
+        chan = await self._run(_open_shell_channel, connection.get_transport())
+        return AsyncSSHShell(
+            connection, chan, connect_kwargs.get("timeout", self.timeout),
+            keepalive)
+
+    @AsyncSSHLogger
+    async def create_sftp(self, keepalive=None, **connect_kwargs):
+        connection = await self._run(self.client._connect, **connect_kwargs)
+        executor = ThreadPoolExecutor(max_workers=1)
+        sftp = await asyncio.get_event_loop().run_in_executor(
+            executor, SFTPShell, connection, keepalive)
+        return AsyncSFTPShell(sftp, executor)
+
+    def close(self):
+        if getattr(self, "connection", None) is not None:
+            self.connection.close()
+            self.connection = None
+        if hasattr(self, "client"):
+            self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+
+class AsyncSSHShell(common.BaseSSHClass):
+    def __init__(self, connection, channel, timeout, keepalive=None):
+        super(AsyncSSHShell, self).__init__()
+        self.connection = connection
+        self.channel = channel
+        self.timeout = timeout
+        self.channel.get_transport().set_keepalive(
+            keepalive or common.CHANNEL_KEEPALIVE)
+        self._lock = asyncio.Lock()
+
+    def close(self):
+        if hasattr(self, "channel"):
+            self.channel.close()
+            del self.channel
+        if hasattr(self, "connection"):
+            self.connection.close()
+            del self.connection
+
+    @AsyncSSHLogger
+    async def execute_command(
+        self, cmd, timeout_action=SSHShell.RAISE_DISCONNECT,
+            **kwargs):
+        max_time = time.time() + kwargs.get("timeout", self.timeout)
+        uuid = uuid4().hex
+        cmd = "echo {1}\n{0}\necho {1} $?\n".format(cmd.strip(), uuid).encode()
+        async with self._lock:
+            try:
+                self._clear_channel()
+                await send_all(self.channel, cmd, max_time)
+                return await self._read_shell_response(
+                    uuid.encode(), max_time)
+            except (socket.timeout, EOFError):
+                if timeout_action == SSHShell.RAISE_DISCONNECT:
+                    self.close()
+                raise
+
+    async def _read_shell_response(self, uuid, max_time):
+        reader = ShellResponseReader(uuid)
+        waiter = ChannelWaiter(self.channel)
+        try:
+            while True:
+                closed = self.channel.eof_received or self.channel.closed
+                while self.channel.recv_ready():
+                    reader.feed(self.channel.recv(common.READ_SIZE))
+                while self.channel.recv_stderr_ready():
+                    reader.feed_stderr(
+                        self.channel.recv_stderr(common.READ_SIZE))
+                if reader.done:
+                    return reader.response()
+                if closed:
+                    raise EOFError("Shell channel closed")
+                await waiter.wait(max_time - time.time())
+        except asyncio.TimeoutError:
+            raise CommandOperationTimeOut("Command timed out")
+        finally:
+            waiter.close()
+
+    def _clear_channel(self):
+        while self.channel.recv_ready():
+            self.channel.recv(common.READ_SIZE)
+        while self.channel.recv_stderr_ready():
+            self.channel.recv_stderr(common.READ_SIZE)
+
+
+class AsyncSFTPShell(common.BaseSSHClass):
+    """SFTPShell whose methods are awaitable
+
+    paramiko's SFTP client is request/response and blocking, so every call is
+    run on a single worker thread owned by this session (SFTP requests on one
+    channel are serialized anyway).
+    """
+    FUNC_NAMES = [
+        "chdir", "chmod", "chown", "exists", "get", "get_file", "getcwd",
+        "get_tree", "getfo", "listdir", "listdir_attr", "lstat", "mkdir",
+        "normalize", "put", "put_tree", "putfo", "read_into", "readlink",
+        "remove", "rename", "rmdir", "stat", "stream_from", "stream_to",
+        "symlink", "sync", "truncate", "unlink", "utime", "write_file"]
+
+    def __init__(self, sftp, executor):
+        super(AsyncSFTPShell, self).__init__()
+        self.sftp = sftp
+        self.executor = executor
+        for func_name in self.FUNC_NAMES:
+            setattr(self, func_name, self._wrap(getattr(sftp, func_name)))
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+        return wrapper
+
+    def close(self):
+        if hasattr(self, "sftp"):
+            self.sftp.close()
+            del self.sftp
+        if hasattr(self, "executor"):
+            self.executor.shutdown(wait=False)
+            del self.executor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -10,47 +10,127 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+from six.moves import queue
 import os
+import threading
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives.serialization import (
-    Encoding, PrivateFormat, PublicFormat, NoEncryption,
-    BestAvailableEncryption)
-
+from sshaolin import common
 from sshaolin.common import BaseSSHClass
 from sshaolin.models import SSHKey
 
 
+class KeyTypes(object):
+    RSA = "rsa"
+    ECDSA = "ecdsa"
+    ED25519 = "ed25519"
+
+
+# cryptography.hazmat.primitives.asymmetric.ec curve names, cryptography is
+# only imported once a key is generated
+ECDSA_CURVES = {256: "SECP256R1", 384: "SECP384R1", 521: "SECP521R1"}
+DEFAULT_KEY_SIZES = {KeyTypes.RSA: 4096, KeyTypes.ECDSA: 256}
+
+
+def _generate_ssh_keys(kwargs):
+    # module level so multiprocessing can pickle it
+    return SSHBehavior.generate_ssh_keys(**kwargs)
+
+
+def _try_generate_ssh_keys(kwargs):
+    """Returns (SSHKey, None) or (None, exception), apply_async has no error
+    callback on python 2"""
+    try:
+        return _generate_ssh_keys(kwargs), None
+    except Exception as e:
+        return None, e
+
+
 class SSHBehavior(BaseSSHClass):
     @classmethod
     def generate_ssh_keys(
-        cls, size=4096, passphrase=None, private_format=PrivateFormat.PKCS8,
-        public_format=PublicFormat.OpenSSH, private_encoding=Encoding.PEM,
-            public_encoding=Encoding.OpenSSH):
-        """Generates a public and private rsa ssh key
+        cls, size=None, passphrase=None, private_format=None,
+        public_format=None, private_encoding=None, public_encoding=None,
+            key_type=KeyTypes.RSA):
+        """Generates a public and private ssh key
 
         Returns an SSHKeyResponse objects which has both the public and private
-        key as attributes
+        key as attributes.  Ed25519 and ECDSA keys take well under a
+        millisecond, a 4096 bit RSA key takes seconds.
 
-        :param int size: RSA modulus length (must be a multiple of 256)
-                             and >= 1024
+        :param int size: RSA modulus length (must be a multiple of 256
+                         and >= 1024, 4096 by default) or ECDSA curve size
+                         (256, 384 or 521, 256 by default), ignored for
+                         Ed25519
         :param str passphrase: The pass phrase to derive the encryption key
                                 from
+        :param str key_type: A KeyTypes value
+        :param private_format: PKCS8 by default, OpenSSH for Ed25519 (the
+                               only format OpenSSH reads Ed25519 keys in)
+        :param public_format: PublicFormat.OpenSSH by default
+        :param private_encoding: Encoding.PEM by default
+        :param public_encoding: Encoding.OpenSSH by default
         """
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.asymmetric import (
+            ec, ed25519, rsa)
+        from cryptography.hazmat.primitives.serialization import (
+            Encoding, PrivateFormat, PublicFormat, NoEncryption,
+            BestAvailableEncryption)
+        public_format = public_format or PublicFormat.OpenSSH
+        public_encoding = public_encoding or Encoding.OpenSSH
         encryption = (
             BestAvailableEncryption(passphrase) if passphrase else
             NoEncryption())
-        key = rsa.generate_private_key(
-            backend=default_backend(),
-            public_exponent=65537,
-            key_size=size)
+        size = size or DEFAULT_KEY_SIZES.get(key_type)
+        if key_type == KeyTypes.RSA:
+            key = rsa.generate_private_key(
+                backend=default_backend(),
+                public_exponent=65537,
+                key_size=size)
+        elif key_type == KeyTypes.ECDSA:
+            if size not in ECDSA_CURVES:
+                raise ValueError(
+                    "ECDSA key size must be one of {0}".format(
+                        sorted(ECDSA_CURVES)))
+            key = ec.generate_private_key(
+                getattr(ec, ECDSA_CURVES[size])(), default_backend())
+        elif key_type == KeyTypes.ED25519:
+            key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            raise ValueError("Unknown key type {0}".format(key_type))
+        if private_format is None:
+            private_format = (
+                PrivateFormat.OpenSSH if key_type == KeyTypes.ED25519 else
+                PrivateFormat.PKCS8)
 
         return SSHKey(
             public_key=key.public_key().public_bytes(
                 public_encoding, public_format),
             private_key=key.private_bytes(
-                Encoding.PEM, private_format, encryption))
+                private_encoding or Encoding.PEM, private_format,
+                encryption))
+
+    @classmethod
+    def generate_ssh_keys_batch(
+            cls, count, processes=None, **generate_ssh_keys_args):
+        """Generates count keys in parallel on a process pool and returns
+        them as a list of SSHKey
+
+        :param int processes: Worker processes, the number of cores by
+                              default
+        :param generate_ssh_keys_args: Passed to generate_ssh_keys
+        """
+        if count <= 1 or processes == 1:
+            return [
+                cls.generate_ssh_keys(**generate_ssh_keys_args)
+                for _ in range(count)]
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(
+                _generate_ssh_keys, [generate_ssh_keys_args] * count)
+        finally:
+            pool.terminate()
 
     @classmethod
     def write_ssh_keys(
@@ -91,16 +171,89 @@ class SSHBehavior(BaseSSHClass):
     @classmethod
     def generate_and_write_files(
             cls, folder=None, key_name=None, **generate_ssh_keys_args):
-        """Generate and write public and private rsa keys to local files
+        """Generate and write public and private keys to local files
 
         :param str path: Path to put the file(s)
-        :param str file_name: Name of the private_key file, 'id_rsa' by default
+        :param str file_name: Name of the private_key file, 'id_<key_type>'
+                              ('id_rsa', 'id_ed25519', ...) by default
         :param int key_size: RSA modulus length (must be a multiple of 256)
                              and >= 1024
         :param str pass_phrase: The pass phrase to derive the encryption key
                                 from
+        :param str key_type: A KeyTypes value, rsa by default
         """
         keys = cls.generate_ssh_keys(**generate_ssh_keys_args)
         cls.write_ssh_keys(
             private_key=keys.private_key, public_key=keys.public_key,
-            folder=folder, key_name=key_name)
+            folder=folder, key_name=key_name or "id_{0}".format(
+                generate_ssh_keys_args.get("key_type", KeyTypes.RSA)))
+
+
+class KeyPool(BaseSSHClass):
+    def __init__(
+        self, size=common.KEY_POOL_SIZE, low_water=common.KEY_POOL_LOW_WATER,
+            processes=None, **generate_ssh_keys_args):
+        """Keeps pre-generated keys around and hands them out instantly
+
+        Keys are generated in the background on a process pool.  Whenever
+        fewer than low_water keys are left (counting the ones being
+        generated) the pool is topped back up to size.
+
+        :param int size: Number of keys to keep ready
+        :param int low_water: Refill when fewer keys than this are left
+        :param int processes: Worker processes, the number of cores by
+                              default
+        :param generate_ssh_keys_args: Passed to generate_ssh_keys (key_type,
+                                       size, passphrase, ...)
+        """
+        super(KeyPool, self).__init__()
+        self.size = size
+        self.low_water = low_water
+        self.generate_ssh_keys_args = generate_ssh_keys_args
+        self._keys = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        import multiprocessing
+        self._pool = multiprocessing.Pool(processes)
+        self.refill()
+
+    def __len__(self):
+        return self._keys.qsize()
+
+    def refill(self):
+        """Starts generating keys until size keys are ready or pending"""
+        with self._lock:
+            missing = self.size - self._keys.qsize() - self._pending
+            self._pending += max(missing, 0)
+        for _ in range(missing):
+            self._pool.apply_async(
+                _try_generate_ssh_keys, (self.generate_ssh_keys_args, ),
+                callback=self._add)
+
+    def get(self, timeout=common.DEFAULT_TIMEOUT):
+        """Returns an SSHKey, waiting up to timeout seconds if the pool is
+        empty (raises queue.Empty after that)"""
+        self._refill_if_low()
+        key = self._keys.get(timeout=timeout)
+        self._refill_if_low()
+        return key
+
+    def _refill_if_low(self):
+        with self._lock:
+            low = self._keys.qsize() + self._pending < self.low_water
+        if low:
+            self.refill()
+
+    def _add(self, result):
+        key, error = result
+        with self._lock:
+            self._pending -= 1
+        if error is not None:
+            self._log.error(error)
+        else:
+            self._keys.put(key)
+
+    def close(self):
+        if getattr(self, "_pool", None) is not None:
+            self._pool.terminate()
+            self._pool = None
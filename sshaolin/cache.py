@@ -0,0 +1,147 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from collections import namedtuple, OrderedDict
+import threading
+import time
+
+from sshaolin import common
+
+CacheKey = namedtuple(
+    "CacheKey", "hostname port username jump_hosts command stdin")
+
+
+class InFlight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False
+
+
+class ResultCache(common.BaseSSHClass):
+    def __init__(
+        self, ttl=common.RESULT_CACHE_TTL,
+            max_size=common.RESULT_CACHE_MAX_SIZE):
+        """Memoizes the responses of idempotent commands for ttl seconds
+
+        Entries are kept in least recently used order and the oldest are
+        evicted past max_size.  Concurrent calls for a key that isn't cached
+        wait for the one call already running instead of running again.
+        Errors are never cached, every waiter of a failed call gets its
+        exception.  Cached responses are shared, treat them as read only.
+
+        :param float ttl: Seconds a response is served from the cache
+        :param int max_size: Max cached responses
+        """
+        super(ResultCache, self).__init__()
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory, ttl=None):
+        """Returns the cached response for key or the one factory() returns
+
+        :param key: Hashable key, SSHClient uses a CacheKey
+        :param callable factory: Called with no args on a miss
+        :param float ttl: Overrides the cache ttl for this response
+        """
+        owner = False
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                # re-inserting makes it the most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                in_flight = self._in_flight[key] = InFlight()
+                owner = True
+        if not owner:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+        try:
+            in_flight.result = factory()
+        except Exception as e:
+            in_flight.error = e
+            raise
+        else:
+            if not in_flight.stale:
+                self._add(key, in_flight.result, ttl)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+        return in_flight.result
+
+    def invalidate(self, **fields):
+        """Drops the cached responses whose CacheKey matches every given
+        field, e.g. invalidate(hostname="foo"), or all of them with no fields
+
+        Returns the number of responses dropped.  Matching calls still
+        running are not cached when they finish.
+        """
+        def matches(key):
+            return all(
+                getattr(key, name) == value for name, value in fields.items())
+        with self._lock:
+            keys = [key for key in self._entries if matches(key)]
+            for key in keys:
+                del self._entries[key]
+            for key, in_flight in self._in_flight.items():
+                if matches(key):
+                    in_flight.stale = True
+        return len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    @property
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "coalesced": self.coalesced, "evictions": self.evictions,
+            "size": self.size}
+
+    def _add(self, key, response, ttl):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, response)
+            now = time.time()
+            # oldest first, expired ones go as long as they're at the front
+            while self._entries:
+                old_key = next(iter(self._entries))
+                full = len(self._entries) > self.max_size
+                if not full and self._entries[old_key][0] > now:
+                    break
+                del self._entries[old_key]
+                self.evictions += 1
+
+
+results = ResultCache()
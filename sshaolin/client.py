@@ -10,43 +10,43 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
-from io import BytesIO
-from socks import socket, create_connection
+from six.moves import shlex_quote
 from types import MethodType
 from uuid import uuid4
+import functools
+import posixpath
 import six
+import socket
+import sys
 import threading
 import time
 
-from paramiko import AutoAddPolicy, RSAKey
-from paramiko.client import SSHClient as ParamikoSSHClient
-from paramiko import py3compat
-
-from sshaolin import common
-from sshaolin.models import CommandResponse
-
-# this is a hack to preimport dependencies imported in a thread during connect
-# which causes a deadlock. https://github.com/paramiko/paramiko/issues/104
-py3compat.u("".encode())
-
-# dirty hack 2.0 also issue 104
-# Try / Catch to prevent users using paramiko<2.0.0 from raising an ImportError
 try:
-    from cryptography.hazmat.backends import default_backend
-    from cryptography.utils import int_from_bytes
-    int_from_bytes(b"a", "big")
-    default_backend()
-except ImportError:
-    pass
+    import selectors
+except ImportError:  # python 2
+    import selectors34 as selectors
 
+from sshaolin import common, instrumentation, tuning
+from sshaolin.cache import CacheKey, results
+from sshaolin.forward import ForwardingEngine
+from sshaolin.jump import bastions, parse_jump_host
+from sshaolin.models import CommandResponse, TreeTransferResult
+from sshaolin.pool import ConnectionPool, is_alive
+from sshaolin.reconnect import Reconnector
+from sshaolin.tail import LogTailer
+from sshaolin.transfer import (
+    TreeTransfer, fd_writer, iter_remote_chunks, release_view, write_source)
 
-class CommandOperationTimeOut(socket.timeout):
-    pass
 
-
-class ProxyTypes(object):
-    SOCKS5 = 2
-    SOCKS4 = 1
+def __getattr__(name):
+    # python 3.7+ (PEP 562), the paramiko client class is in
+    # sshaolin.connection so importing this module doesn't import paramiko.
+    # Older pythons import it at the bottom of this module.
+    if name == "ExtendedParamikoSSHClient":
+        from sshaolin.connection import ExtendedParamikoSSHClient
+        return ExtendedParamikoSSHClient
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name))
 
 
 def read_pipe(pipe, fp_out):
@@ -59,38 +59,347 @@ def read_pipe(pipe, fp_out):
     return thread
 
 
-class ExtendedParamikoSSHClient(ParamikoSSHClient):
-    def execute_command(
-        self, command, bufsize=-1, timeout=None,
-            stdin_str="", stdin_file=None, raise_exceptions=False):
-        chan = self._transport.open_session()
-        chan.settimeout(timeout)
-        start = time.time()
-        chan.exec_command(command)
-        stdin_str = stdin_str if stdin_file is None else stdin_file.read()
-        stdin = chan.makefile("wb", bufsize)
-        stdout = chan.makefile("rb", bufsize)
-        stderr = chan.makefile_stderr("rb", bufsize)
-        stdin.write(stdin_str)
-        stdin.write("\n\x04")
-        stdin.close()
-        exit_status = None
-        stdout_bytes = BytesIO()
-        stderr_bytes = BytesIO()
-        out_thread = read_pipe(stdout, stdout_bytes)
-        err_thread = read_pipe(stderr, stderr_bytes)
-        out_thread.join(timeout)
-        err_thread.join(timeout)
-        if timeout and (time.time() - start) > timeout:
-            raise CommandOperationTimeOut("Command timed out")
-        for i in range(2):
-            if chan.exit_status_ready():
-                break
-        exit_status = chan.recv_exit_status()
-        chan.close()
-        return (
-            stdin_str, stdout_bytes.getvalue(), stderr_bytes.getvalue(),
-            exit_status)
+class CommandOperationTimeOut(socket.timeout):
+    pass
+
+
+class ProxyTypes(object):
+    SOCKS5 = 2
+    SOCKS4 = 1
+
+
+STDOUT = "stdout"
+STDERR = "stderr"
+EOF = "eof"
+TIMEOUT = "timeout"
+
+
+class ChannelSelector(object):
+    def __init__(self, read_size=common.READ_SIZE, wakeup=False):
+        """Reads stdout and stderr of any number of channels from one thread
+
+        Channels are watched through their fileno() on a selector and read
+        with large recv calls, one per stream per wakeup, so each wakeup holds
+        at most read_size bytes per stream per channel.
+
+        :param bool wakeup: Allow other threads to interrupt a read with
+                            wakeup()
+        """
+        self.read_size = read_size
+        self._selector = selectors.DefaultSelector()
+        self._deadlines = {}
+        self._fds = {}
+        self._wakeup_recv = self._wakeup_send = None
+        if wakeup:
+            self._wakeup_recv, self._wakeup_send = socket.socketpair()
+            self._wakeup_recv.setblocking(False)
+            self._wakeup_send.setblocking(False)
+            self._selector.register(
+                self._wakeup_recv, selectors.EVENT_READ, None)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def register(self, chan, max_time=None):
+        """:param float max_time: time.time() deadline for this channel"""
+        # a closed paramiko channel drops its event pipe and fileno() makes
+        # a new one, so it is unregistered by the fd it was registered with
+        self._fds[chan] = chan.fileno()
+        self._selector.register(self._fds[chan], selectors.EVENT_READ, chan)
+        self._deadlines[chan] = max_time
+
+    def unregister(self, chan):
+        if self._deadlines.pop(chan, False) is not False:
+            self._selector.unregister(self._fds.pop(chan))
+
+    def wakeup(self):
+        """Makes a read blocked in another thread return, possibly with no
+        events"""
+        try:
+            self._wakeup_send.send(b"x")
+        except socket.error:
+            pass
+
+    def read(self, timeout=None):
+        """Waits up to timeout seconds (or the nearest channel deadline) and
+        returns a list of (chan, kind, data) events
+
+        kind is STDOUT or STDERR with the bytes read, or EOF/TIMEOUT (data is
+        None) after which the channel has been unregistered.
+        """
+        deadlines = [t for t in self._deadlines.values() if t is not None]
+        if deadlines:
+            wait = max(min(deadlines) - time.time(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+        events = []
+        for key, _ in self._selector.select(timeout):
+            chan = key.data
+            if chan is None:
+                self._drain_wakeup()
+                continue
+            # data always arrives before eof so check eof before reading
+            done = chan.eof_received or chan.closed
+            if chan.recv_ready():
+                events.append((chan, STDOUT, chan.recv(self.read_size)))
+            if chan.recv_stderr_ready():
+                events.append(
+                    (chan, STDERR, chan.recv_stderr(self.read_size)))
+            if done and not (chan.recv_ready() or chan.recv_stderr_ready()):
+                self.unregister(chan)
+                events.append((chan, EOF, None))
+        now = time.time()
+        for chan, deadline in list(self._deadlines.items()):
+            if deadline is not None and deadline <= now:
+                self.unregister(chan)
+                events.append((chan, TIMEOUT, None))
+        return events
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def close(self):
+        self._selector.close()
+        self._deadlines = {}
+        self._fds = {}
+        if self._wakeup_recv is not None:
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+
+def iter_channel(
+    chan, max_time=None, idle_timeout=None, read_size=common.READ_SIZE,
+        stdin_writer=None):
+    """Yields (STDOUT or STDERR, bytes) from chan as data arrives
+
+    Only the data paramiko has buffered (at most one channel window) is ever
+    held in memory.
+
+    :param float max_time: time.time() deadline for the whole command
+    :param float idle_timeout: Max seconds to wait for new data
+    :param StdinWriter stdin_writer: Writer streaming the command's stdin,
+                                     its error is raised as soon as it fails
+    """
+    selector = ChannelSelector(read_size, wakeup=stdin_writer is not None)
+    selector.register(chan, max_time)
+    if stdin_writer is not None:
+        stdin_writer.on_error = selector.wakeup
+    try:
+        while True:
+            if stdin_writer is not None and stdin_writer.error is not None:
+                raise stdin_writer.error
+            events = selector.read(idle_timeout)
+            if stdin_writer is not None and stdin_writer.error is not None:
+                raise stdin_writer.error
+            if not events:
+                raise CommandOperationTimeOut("Command idle timeout")
+            for _, kind, data in events:
+                if kind == EOF:
+                    return
+                elif kind == TIMEOUT:
+                    raise CommandOperationTimeOut("Command timed out")
+                yield kind, data
+    finally:
+        selector.close()
+
+
+def iter_lines(chunks, max_line_length=common.MAX_LINE_LENGTH):
+    """Regroups (name, bytes) chunks from iter_channel into lines
+
+    Lines longer than max_line_length are yielded in pieces so memory stays
+    bounded even for output without newlines.
+    """
+    buffers = {STDOUT: bytearray(), STDERR: bytearray()}
+    for name, data in chunks:
+        buf = buffers[name]
+        buf += data
+        start = 0
+        index = buf.find(b"\n")
+        while index >= 0:
+            yield name, bytes(buf[start:index + 1])
+            start = index + 1
+            index = buf.find(b"\n", start)
+        del buf[:start]
+        if len(buf) >= max_line_length:
+            yield name, bytes(buf)
+            del buf[:]
+    for name in (STDOUT, STDERR):
+        if buffers[name]:
+            yield name, bytes(buffers[name])
+
+
+def wait_exit_status(chan, max_time=None):
+    timeout = None if max_time is None else max(max_time - time.time(), 0)
+    if not chan.status_event.wait(timeout):
+        raise CommandOperationTimeOut("Timed out waiting for exit status")
+    return chan.recv_exit_status()
+
+
+class CommandStream(common.BaseSSHClass):
+    def __init__(
+        self, channel, max_time=None, idle_timeout=None, lines=False,
+            on_close=None, stdin_writer=None):
+        """Iterates over the output of a running command
+
+        Yields (STDOUT or STDERR, bytes) tuples, either raw chunks or lines.
+        exit_status is set once the stream has been exhausted.
+
+        :param StdinWriter stdin_writer: Writer streaming the command's
+                                         stdin, its error is raised as soon
+                                         as it fails
+        """
+        super(CommandStream, self).__init__()
+        self.channel = channel
+        self.max_time = max_time
+        self.exit_status = None
+        self.stdin_writer = stdin_writer
+        self._on_close = on_close
+        self._chunks = iter_channel(
+            channel, max_time, idle_timeout, stdin_writer=stdin_writer)
+        if lines:
+            self._chunks = iter_lines(self._chunks)
+
+    def __iter__(self):
+        try:
+            for item in self._chunks:
+                yield item
+            self.exit_status = wait_exit_status(self.channel, self.max_time)
+            if self.stdin_writer is not None:
+                self.stdin_writer.join()
+        finally:
+            self.close()
+
+    def copy_to(self, stdout_sink=None, stderr_sink=None):
+        """Writes the output to file like objects and returns the exit status
+
+        Output for a stream without a sink is discarded.
+        """
+        sinks = {STDOUT: stdout_sink, STDERR: stderr_sink}
+        for name, data in self:
+            if sinks[name] is not None:
+                sinks[name].write(data)
+        return self.exit_status
+
+    def close(self):
+        if hasattr(self, "channel"):
+            self.channel.close()
+            del self.channel
+        on_close, self._on_close = getattr(self, "_on_close", None), None
+        if on_close is not None:
+            on_close()
+
+
+class StdinWriter(common.BaseSSHClass):
+    def __init__(
+            self, channel, source, chunk_size=common.STDIN_CHUNK_SIZE):
+        """Streams source to the stdin of the command on channel from a
+        thread, then sends eof
+
+        source is a file object, a file descriptor or an iterable of bytes
+        (see write_source, regular files are memory mapped).  Each write
+        blocks while the channel window is full, so memory stays bounded and
+        the command reads its input as it arrives while the output is read
+        on the calling thread.  A command that exits or closes the channel
+        without reading everything (head, ...) just stops the writer.  Any
+        other error is kept in error and on_error() is called, the reading
+        thread raises it and closes the channel so a partial input never
+        looks complete to the command.
+        """
+        super(StdinWriter, self).__init__()
+        self.channel = channel
+        self.source = source
+        self.chunk_size = chunk_size
+        self.bytes_written = 0
+        self.error = None
+        self.on_error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        self.channel.sendall(data)
+        self.bytes_written += len(data)
+
+    def _run(self):
+        try:
+            write_source(self, self.source, self.chunk_size)
+            self.channel.shutdown_write()
+        except Exception as e:
+            if not self.channel.closed:
+                self.error = e
+                on_error = self.on_error
+                if on_error is not None:
+                    on_error()
+
+    def join(self, timeout=None):
+        """Waits for the writer and raises the error that stopped it, if
+        any"""
+        self._thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+
+
+class ShellResponseReader(object):
+    def __init__(self, uuid):
+        """Collects the output of one framed shell command
+
+        The command is wrapped in "echo uuid" lines, its output is whatever
+        is printed between the two sentinels and the exit status follows the
+        second one.  Output is appended to a bytearray and only the newly
+        received bytes are searched for the sentinels, so reading is linear in
+        the size of the output.
+        """
+        self.uuid = uuid
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.markers = []
+        self._status_end = -1
+
+    @property
+    def done(self):
+        return self._status_end >= 0
+
+    @property
+    def status(self):
+        """Raw bytes printed after the second sentinel"""
+        return bytes(self.stdout[
+            self.markers[1] + len(self.uuid):self._status_end]).strip()
+
+    @property
+    def remainder(self):
+        """Bytes received after the exit status line"""
+        return bytes(self.stdout[self._status_end + 1:])
+
+    def feed(self, data):
+        # a sentinel can straddle two reads, rescan its length minus one
+        start = max(len(self.stdout) - len(self.uuid) + 1, 0)
+        self.stdout += data
+        while len(self.markers) < 2:
+            index = self.stdout.find(self.uuid, start)
+            if index < 0:
+                return
+            self.markers.append(index)
+            start = index + len(self.uuid)
+        if not self.done:
+            self._status_end = self.stdout.find(
+                b"\n", max(start, self.markers[1] + len(self.uuid)))
+
+    def feed_stderr(self, data):
+        self.stderr += data
+
+    def response(self):
+        first, second = self.markers
+        try:
+            exit_status = int(self.status)
+        except ValueError:
+            exit_status = None
+        return CommandResponse(
+            stdin=None,
+            stdout=bytes(self.stdout[first + len(self.uuid):second]).strip(),
+            stderr=bytes(self.stderr).strip(), exit_status=exit_status)
 
 
 class SSHClient(common.BaseSSHClass):
@@ -99,8 +408,50 @@ class SSHClient(common.BaseSSHClass):
         accept_missing_host_key=True, timeout=common.DEFAULT_TIMEOUT,
         compress=True, pkey=None, look_for_keys=False, allow_agent=False,
         key_filename=None, proxy_type=None, proxy_ip=None, proxy_port=None,
-            sock=None):
+            sock=None, pooled=False, pool=None, known_hosts=None,
+            jump_hosts=None, result_cache=None, profile=None, ciphers=None,
+            digests=None, kex=None):
+        """
+        :param compress: True, False or "auto" to compress only links that
+                         have been slow (tuning.links), a profile's setting
+                         replaces it
+        :param bool pooled: Reuse authenticated connections between
+                            execute_command calls
+        :param ConnectionPool pool: Pool to use (can be shared between
+                                    clients), implies pooled
+        :param known_hosts: KnownHostsStore or known_hosts file path to check
+                            host keys against, with accept_missing_host_key
+                            unknown hosts are added to it.  Without it any
+                            host key is accepted when accept_missing_host_key
+        :param list jump_hosts: Jump hosts (bastions) to go through, in
+                                order, each an SSHClient, a dict of SSHClient
+                                kwargs or an ssh -J style [user@]host[:port].
+                                Dicts and strings use this client's
+                                credentials unless they give their own.  One
+                                connection per chain is shared by every
+                                client in the process (jump.bastions)
+        :param ResultCache result_cache: Cache for execute_command(...,
+                                         cached=True), defaults to the
+                                         process wide cache.results
+        :param profile: Transport tuning, one of tuning.PROFILES
+                        ("lan-throughput", "wan", "low-cpu") or a
+                        TransportProfile.  Every connection gets
+                        TCP_NODELAY even without one
+        :param list ciphers: Ciphers to prefer, in order, over the profile's
+        :param list digests: MACs to prefer, in order, over the profile's
+        :param list kex: Key exchanges to prefer, in order, over the
+                         profile's
+        """
         super(SSHClient, self).__init__()
+        self.known_hosts = known_hosts
+        self.jump_hosts = list(jump_hosts or [])
+        self.result_cache = result_cache
+        self.profile = profile
+        self.ciphers = ciphers
+        self.digests = digests
+        self.kex = kex
+        self._owns_pool = pool is None and bool(pooled)
+        self.pool = ConnectionPool() if self._owns_pool else pool
         self.connect_kwargs = {}
         self.accept_missing_host_key = accept_missing_host_key
         self.proxy_port = proxy_port
@@ -135,80 +486,387 @@ class SSHClient(common.BaseSSHClass):
         self, hostname=None, port=None, username=None, password=None,
         accept_missing_host_key=None, timeout=None, compress=None, pkey=None,
         look_for_keys=None, allow_agent=None, key_filename=None,
-            proxy_type=None, proxy_ip=None, proxy_port=None, sock=None):
+            proxy_type=None, proxy_ip=None, proxy_port=None, sock=None,
+            jump_hosts=None, profile=None, ciphers=None, digests=None,
+            kex=None):
+        # locals() inside the comprehension would be the comprehension's own
+        overrides = locals()
         connect_kwargs = dict(self.connect_kwargs)
         connect_kwargs.update({
-            k: locals().get(k) for k in self.connect_kwargs
-            if locals().get(k) is not None})
+            k: overrides.get(k) for k in self.connect_kwargs
+            if overrides.get(k) is not None})
         connect_kwargs["port"] = int(connect_kwargs.get("port"))
 
+        # paramiko and its crypto warm up are imported on the first connect,
+        # in this thread before any transport thread runs
+        from paramiko import AutoAddPolicy
+        from sshaolin.connection import ExtendedParamikoSSHClient
+        from sshaolin.keys import KnownHostsStore, key_cache
+
         ssh = ExtendedParamikoSSHClient()
+        ssh.profile = tuning.resolve(
+            profile or self.profile, compress, ciphers or self.ciphers,
+            digests or self.digests, kex or self.kex)
+        if ssh.profile.compress is not None:
+            connect_kwargs["compress"] = ssh.profile.compress
+        auto_compress = connect_kwargs.get("compress") == tuning.AUTO
+        known_hosts = self.known_hosts
+        if isinstance(known_hosts, six.string_types):
+            known_hosts = KnownHostsStore.from_file(known_hosts)
+        if known_hosts is not None:
+            ssh.set_known_hosts(known_hosts)
 
         if bool(self.accept_missing_host_key or accept_missing_host_key):
-            ssh.set_missing_host_key_policy(AutoAddPolicy())
+            ssh.set_missing_host_key_policy(
+                AutoAddPolicy() if known_hosts is None else
+                known_hosts.add_policy())
 
-        if connect_kwargs.get("pkey") is not None:
-            connect_kwargs["pkey"] = RSAKey.from_private_key(
-                six.BytesIO(six.u(connect_kwargs["pkey"])))
+        if isinstance(connect_kwargs.get("pkey"), (six.string_types, bytes)):
+            connect_kwargs["pkey"] = key_cache.from_string(
+                connect_kwargs["pkey"])
 
         proxy_type = proxy_type or self.proxy_type
         proxy_ip = proxy_ip or self.proxy_ip
         proxy_port = proxy_port or self.proxy_port
-        if connect_kwargs.get("sock") is not None:
-            pass
-        elif all([proxy_type, proxy_ip, proxy_port]):
-            connect_kwargs["sock"] = create_connection(
-                (connect_kwargs.get("hostname"), connect_kwargs.get("port")),
-                proxy_type, proxy_ip, int(proxy_port))
-
-        ssh.connect(**connect_kwargs)
+        jump_hosts = jump_hosts or self.jump_hosts
+        address = (connect_kwargs.get("hostname"), connect_kwargs.get("port"))
+        ssh.link = address
+        timer = instrumentation.start("connect", hostname=address[0])
+        ssh.timer = timer
+        try:
+            if connect_kwargs.get("sock") is not None:
+                pass
+            elif jump_hosts:
+                connect_kwargs["sock"] = bastions.open_channel(
+                    self._jump_clients(jump_hosts), address,
+                    connect_kwargs.get("timeout"))
+                timer.mark("jump")
+            elif all([proxy_type, proxy_ip, proxy_port]):
+                from socks import create_connection
+                connect_kwargs["sock"] = create_connection(
+                    address, proxy_type, proxy_ip, int(proxy_port))
+                timer.mark("proxy")
+            elif timer.active or auto_compress:
+                # only split tcp connect from kex when someone is listening,
+                # or to time the round trip for compress="auto"
+                started = time.time()
+                connect_kwargs["sock"] = socket.create_connection(
+                    address, connect_kwargs.get("timeout"))
+                if auto_compress:
+                    tuning.links.record_rtt(address, time.time() - started)
+                timer.mark("tcp_connect")
+            if auto_compress:
+                connect_kwargs["compress"] = tuning.links.compress(address)
+            ssh.connect(**connect_kwargs)
+        except Exception as e:
+            timer.finish(e)
+            raise
+        finally:
+            del ssh.timer
+        timer.finish()
         return ssh
 
+    def _jump_clients(self, jump_hosts):
+        """Returns an SSHClient per jump host"""
+        clients = []
+        for hop in jump_hosts:
+            if isinstance(hop, SSHClient):
+                clients.append(hop)
+                continue
+            if isinstance(hop, six.string_types):
+                hop = parse_jump_host(hop)
+            kwargs = dict(
+                self.connect_kwargs, port=22, sock=None,
+                accept_missing_host_key=self.accept_missing_host_key,
+                known_hosts=self.known_hosts, profile=self.profile,
+                ciphers=self.ciphers, digests=self.digests, kex=self.kex)
+            kwargs.update(hop)
+            clients.append(SSHClient(**kwargs))
+        return clients
+
+    def _pool_key(self, **connect_kwargs):
+        """Returns the pool key for the merged connect kwargs or None if the
+        connection can't be pooled (a caller supplied sock)"""
+        merged = dict(
+            self.connect_kwargs, proxy_type=self.proxy_type,
+            proxy_ip=self.proxy_ip, proxy_port=self.proxy_port,
+            accept_missing_host_key=self.accept_missing_host_key,
+            known_hosts=self.known_hosts, jump_hosts=self.jump_hosts,
+            profile=self.profile, ciphers=self.ciphers, digests=self.digests,
+            kex=self.kex)
+        merged.update(
+            (k, v) for k, v in connect_kwargs.items() if v is not None)
+        merged.pop("timeout", None)
+        if merged.get("sock") is not None:
+            return None
+        merged["profile"] = tuning.resolve(
+            merged["profile"], None, merged.pop("ciphers"),
+            merged.pop("digests"), merged.pop("kex"))
+        merged["jump_hosts"] = tuple(
+            hop._pool_key() for hop in self._jump_clients(
+                merged["jump_hosts"]))
+        merged["port"] = int(merged["port"])
+        return tuple(sorted(
+            (k, tuple(v) if isinstance(v, list) else v)
+            for k, v in merged.items()))
+
+    def _checkout(self, **connect_kwargs):
+        key = self._pool_key(**connect_kwargs) if self.pool else None
+        if key is None:
+            return None, self._connect(**connect_kwargs)
+        return key, self.pool.acquire(
+            key, lambda: self._connect(**connect_kwargs))
+
+    def _checkin(self, key, ssh_client, reuse=True):
+        if key is not None and reuse:
+            self.pool.release(key, ssh_client)
+        else:
+            ssh_client.close()
+
+    def _cache_key(self, command, stdin_str, **connect_kwargs):
+        merged = dict(self.connect_kwargs, jump_hosts=self.jump_hosts)
+        merged.update(
+            (k, v) for k, v in connect_kwargs.items() if v is not None)
+        return CacheKey(
+            merged["hostname"], int(merged["port"]), merged["username"],
+            tuple(hop._pool_key() for hop in self._jump_clients(
+                merged["jump_hosts"])), command, stdin_str)
+
     @common.SSHLogger
     def execute_command(
         self, command, bufsize=-1, stdin_str=b"", stdin_file=None,
-            **connect_kwargs):
-        ssh_client = self._connect(**connect_kwargs)
-        stdin, stdout, stderr, exit_status = ssh_client.execute_command(
-            timeout=connect_kwargs.get("timeout", self.timeout),
-            command=command, bufsize=bufsize, stdin_str=stdin_str,
-            stdin_file=stdin_file)
-        ssh_client.close()
-        del ssh_client
+        stdout_sink=None, stderr_sink=None, cached=False, cache_ttl=None,
+            spill_size=common.OUTPUT_SPILL_SIZE, **connect_kwargs):
+        """Runs command and returns a CommandResponse
+
+        Output written to stdout_sink/stderr_sink (file like objects) as it
+        arrives is not kept in memory, the response holds None for it.
+        stdin_file (a file object, file descriptor or iterable of bytes) is
+        streamed to the command in chunks while its output is read, so
+        piping a huge backup into a restore starts right away in bounded
+        memory, the response's stdin is None for it.
+
+        :param int spill_size: Output past this many bytes goes to a temp
+                               file instead of the heap, see
+                               CommandResponse.stream, None keeps it all
+                               in memory
+
+        :param bool cached: Serve the response of an idempotent command from
+                            the result cache, keyed by host, user, command
+                            and stdin_str (ignored with stdin_file or sinks)
+        :param float cache_ttl: Seconds to cache this response, defaults to
+                                the cache ttl
+        """
+        if cached and stdin_file is None and (
+                stdout_sink is None and stderr_sink is None):
+            cache = self.result_cache or results
+            return cache.get(
+                self._cache_key(command, stdin_str, **connect_kwargs),
+                lambda: self._execute_command(
+                    command, bufsize, stdin_str, spill_size=spill_size,
+                    **connect_kwargs),
+                cache_ttl)
+        return self._execute_command(
+            command, bufsize, stdin_str, stdin_file, stdout_sink,
+            stderr_sink, spill_size, **connect_kwargs)
+
+    def _execute_command(
+        self, command, bufsize=-1, stdin_str=b"", stdin_file=None,
+        stdout_sink=None, stderr_sink=None,
+            spill_size=common.OUTPUT_SPILL_SIZE, **connect_kwargs):
+        key, ssh_client = self._checkout(**connect_kwargs)
+        try:
+            stdin, stdout, stderr, exit_status = ssh_client.execute_command(
+                timeout=connect_kwargs.get("timeout", self.timeout),
+                command=command, bufsize=bufsize, stdin_str=stdin_str,
+                stdin_file=stdin_file, stdout_sink=stdout_sink,
+                stderr_sink=stderr_sink, spill_size=spill_size)
+        except Exception:
+            self._checkin(key, ssh_client, reuse=False)
+            raise
+        self._checkin(key, ssh_client)
         return CommandResponse(
             stdin=stdin, stdout=stdout, stderr=stderr, exit_status=exit_status)
 
     @common.SSHLogger
-    def create_shell(self, keepalive=None, **connect_kwargs):
+    def execute_many(
+        self, commands, max_sessions=common.MAX_SESSIONS, bufsize=-1,
+            spill_size=common.OUTPUT_SPILL_SIZE, **connect_kwargs):
+        """Runs independent commands concurrently on one connection and
+        returns a CommandResponse per command, in input order
+
+        Each command gets its own session channel, at most max_sessions at a
+        time (sshd's MaxSessions defaults to 10, a server that refuses
+        earlier lowers the cap), so a batch takes about as long as its
+        slowest commands instead of their sum.  A command that times out
+        gets its CommandOperationTimeOut in its place in the list.
+
+        :param list commands: Command strings or (command, stdin_str) tuples
+        :param int max_sessions: Max concurrent channels on the connection
+        """
+        key, ssh_client = self._checkout(**connect_kwargs)
+        try:
+            results = ssh_client.execute_many(
+                commands, max_sessions, bufsize,
+                connect_kwargs.get("timeout", self.timeout), spill_size)
+        except Exception:
+            self._checkin(key, ssh_client, reuse=False)
+            raise
+        self._checkin(key, ssh_client)
+        return [
+            result if isinstance(result, Exception) else CommandResponse(
+                stdin=result[0], stdout=result[1], stderr=result[2],
+                exit_status=result[3])
+            for result in results]
+
+    def close(self):
+        """Closes the connection pool if this client created it"""
+        if getattr(self, "_owns_pool", False):
+            self.pool.close()
+
+    @common.SSHLogger
+    def stream_command(
+        self, command, lines=False, bufsize=-1, stdin_str=b"",
+            stdin_file=None, **connect_kwargs):
+        """Runs command and returns a CommandStream over its output
+
+        The stream yields (STDOUT or STDERR, bytes) chunks, or lines when
+        lines is True, as they arrive; exit_status is set once it has been
+        exhausted.  Close the stream (or use it as a context manager) if it
+        isn't read to the end.  The timeout is an idle timeout for streams.
+        """
+        key, ssh_client = self._checkout(**connect_kwargs)
+        try:
+            return ssh_client.stream_command(
+                command, bufsize=bufsize, stdin_str=stdin_str,
+                stdin_file=stdin_file, lines=lines,
+                timeout=connect_kwargs.get("timeout", self.timeout),
+                on_close=lambda: self._checkin(key, ssh_client))
+        except Exception:
+            self._checkin(key, ssh_client, reuse=False)
+            raise
+
+    @common.SSHLogger
+    def create_shell(
+        self, keepalive=None, auto_reconnect=False, preamble=None,
+            **connect_kwargs):
+        """Returns an SSHShell on a new connection
+
+        :param bool auto_reconnect: Replace a dead connection (or one that
+                                    timed out with RAISE_DISCONNECT) with a
+                                    new one, see SSHShell
+        :param list preamble: Commands run on the shell now and again after
+                              every reconnect (cd, exports, ...)
+        """
         connection = self._connect(**connect_kwargs)
         return SSHShell(
             connection, connect_kwargs.get("timeout", self.timeout),
-            keepalive)
+            keepalive, self._reconnect(auto_reconnect, connect_kwargs),
+            preamble)
+
+    @common.SSHLogger
+    def create_sftp(self, keepalive=None, auto_reconnect=False,
+                    **connect_kwargs):
+        """Returns an SFTPShell on a new connection
+
+        :param bool auto_reconnect: Replace a dead connection with a new one
+                                    and chdir back, see SFTPShell
+        """
+        connection = self._connect(**connect_kwargs)
+        return SFTPShell(
+            connection, keepalive,
+            self._reconnect(auto_reconnect, connect_kwargs))
+
+    def _reconnect(self, auto_reconnect, connect_kwargs):
+        if not auto_reconnect:
+            return None
+        return functools.partial(self._connect, **connect_kwargs)
 
     @common.SSHLogger
-    def create_sftp(self, keepalive=None, **connect_kwargs):
+    def create_forwarder(self, keepalive=None, **connect_kwargs):
+        """Returns a ForwardingEngine on a new connection, all of its local,
+        remote and SOCKS forwards share that one transport"""
         connection = self._connect(**connect_kwargs)
-        return SFTPShell(connection, keepalive)
+        transport = connection.get_transport()
+        transport.set_keepalive(keepalive or common.CHANNEL_KEEPALIVE)
+        return ForwardingEngine(
+            transport, connection,
+            connect_kwargs.get("timeout", self.timeout))
 
 
 class SFTPShell(common.BaseSSHClass):
-    def __init__(self, connection=None, keepalive=None):
+    def __init__(self, connection=None, keepalive=None, reconnect=None):
+        """sftp session on connection
+
+        :param callable reconnect: Returns a new connection, turns on auto
+                                   reconnect: a dead connection is noticed
+                                   before each call and replaced, with
+                                   backoff, then the
+                                   session chdirs back to its working
+                                   directory.  A call that fails because the
+                                   connection died still raises, the next
+                                   one runs on the new connection.  stats
+                                   has the reconnect counts and the time
+                                   spent recovering
+        """
         super(SFTPShell, self).__init__()
+        self.keepalive = keepalive
+        self.reconnector = Reconnector(reconnect) if reconnect else None
+        self._open(connection)
+        self._setup_sftp_funcs()
+        self.chdir(".")
+
+    @property
+    def stats(self):
+        if self.reconnector is None:
+            return {"reconnects": 0, "failed_attempts": 0,
+                    "recovery_time": 0.0}
+        return self.reconnector.stats
+
+    def _open(self, connection):
         self.connection = connection
         self.sftp = connection.open_sftp()
         self.sftp.get_channel().get_transport().set_keepalive(
-            keepalive or common.CHANNEL_KEEPALIVE)
-        self._setup_sftp_funcs()
-        self.chdir(".")
+            self.keepalive or common.CHANNEL_KEEPALIVE)
+
+    def _ensure_alive(self):
+        """Reconnects first if auto reconnect is on and the connection or
+        the sftp channel is gone"""
+        if self.reconnector is None or not hasattr(self, "sftp"):
+            return
+        if is_alive(self.connection) and not self.sftp.sock.closed:
+            return
+        cwd = self.sftp.getcwd()
+        self.sftp.close()
+        self.connection.close()
+
+        def restore(connection):
+            self._open(connection)
+            if cwd is not None:
+                self.sftp.chdir(cwd)
+        self.reconnector.reconnect(restore)
 
     def _setup_sftp_funcs(self):
         def get_func(name):
-            func = getattr(self.sftp, func_name)
+            event_name = "sftp_" + name
+
+            def call(*args, **kwargs):
+                self._ensure_alive()
+                return getattr(self.sftp, name)(*args, **kwargs)
 
             def wrapper(self, *args, **kwargs):
-                return func(*args, **kwargs)
-            wrapper.__name__ = func_name
-            wrapper.__doc__ = func.__doc__
+                timer = instrumentation.start(event_name)
+                if not timer.active:
+                    return call(*args, **kwargs)
+                try:
+                    ret_val = call(*args, **kwargs)
+                except Exception as e:
+                    timer.finish(e)
+                    raise
+                timer.finish()
+                return ret_val
+            wrapper.__name__ = name
+            wrapper.__doc__ = getattr(self.sftp, name).__doc__
             return common.SSHLogger(wrapper)
 
         for func_name in [
@@ -232,12 +890,242 @@ class SFTPShell(common.BaseSSHClass):
         return ret_val
 
     def get_file(self, remote_path):
-        ret_val = six.BytesIO()
-        self.getfo(remote_path, ret_val)
-        return ret_val.getvalue()
+        """Returns the contents of remote_path as a bytearray
+
+        The file is read into a buffer of its size so memory peaks at the
+        file size, not the chunks and their join.
+        """
+        data = bytearray(self.stat(remote_path).st_size)
+        del data[self.read_into(remote_path, data):]
+        return data
 
     def write_file(self, data, remote_path):
-        return self.putfo(six.BytesIO(data), remote_path)
+        self.stream_from(data, remote_path)
+        return self.stat(remote_path)
+
+    @common.SSHLogger
+    def read_into(
+        self, remote_path, buffer, chunk_size=common.SFTP_CHUNK_SIZE,
+            prefetch=common.SFTP_PREFETCH_CHUNKS):
+        """Reads remote_path into a writable buffer (bytearray, mmap,
+        memoryview, ...) and returns the number of bytes read
+
+        Reading stops at the end of the file or of the buffer.
+        """
+        self._ensure_alive()
+        view = memoryview(buffer)
+        offset = 0
+        started = time.time()
+        timer = instrumentation.start("sftp_read_into", path=remote_path)
+        try:
+            with self.sftp.open(remote_path, "rb") as fp:
+                size = min(len(view), fp.stat().st_size)
+                timer.mark("open")
+                for data in iter_remote_chunks(
+                        fp, size, chunk_size, prefetch):
+                    timer.first_byte()
+                    view[offset:offset + len(data)] = data
+                    offset += len(data)
+            timer.mark("transfer")
+        except Exception as e:
+            timer.finish(e)
+            raise
+        finally:
+            release_view(view)
+        self._record_transfer(offset, started)
+        timer.count("bytes_in", offset)
+        timer.finish()
+        return offset
+
+    @common.SSHLogger
+    def stream_to(
+        self, remote_path, target, chunk_size=common.SFTP_CHUNK_SIZE,
+            prefetch=common.SFTP_PREFETCH_CHUNKS):
+        """Writes remote_path to a file object or file descriptor and returns
+        the number of bytes written
+
+        At most chunk_size * prefetch bytes are held in memory.
+        """
+        self._ensure_alive()
+        write = fd_writer(target)
+        total = 0
+        started = time.time()
+        timer = instrumentation.start("sftp_stream_to", path=remote_path)
+        try:
+            with self.sftp.open(remote_path, "rb") as fp:
+                size = fp.stat().st_size
+                timer.mark("open")
+                for data in iter_remote_chunks(
+                        fp, size, chunk_size, prefetch):
+                    timer.first_byte()
+                    write(data)
+                    total += len(data)
+            timer.mark("transfer")
+        except Exception as e:
+            timer.finish(e)
+            raise
+        self._record_transfer(total, started)
+        timer.count("bytes_in", total)
+        timer.finish()
+        return total
+
+    @common.SSHLogger
+    def stream_from(
+            self, source, remote_path, chunk_size=common.SFTP_CHUNK_SIZE):
+        """Writes source to remote_path and returns the number of bytes
+        written
+
+        source is a bytes like object (bytes, bytearray, memoryview, mmap), a
+        file object or a file descriptor, read from its current position.
+        Regular files are memory mapped and bytes like objects are sent as
+        memoryview slices without copies, writes are pipelined.
+        """
+        self._ensure_alive()
+        started = time.time()
+        timer = instrumentation.start("sftp_stream_from", path=remote_path)
+        try:
+            with self.sftp.open(remote_path, "wb") as fp:
+                fp.set_pipelined(True)
+                timer.mark("open")
+                total = write_source(fp, source, chunk_size)
+            timer.mark("transfer")
+        except Exception as e:
+            timer.finish(e)
+            raise
+        self._record_transfer(total, started)
+        timer.count("bytes_out", total)
+        timer.finish()
+        return total
+
+    def create_tailer(self, paths=(), state_file=None, **kwargs):
+        """Returns a LogTailer following remote paths on this sftp channel
+
+        Only bytes appended since the last poll are transferred, truncated
+        and rotated files are picked up from their start.  Offsets are
+        saved to the local state_file so a restart resumes where it left.
+        The tailer goes through this shell so it follows its reconnects.
+        """
+        return LogTailer(self, paths, state_file, **kwargs)
+
+    def follow(
+        self, paths, interval=common.TAIL_INTERVAL, timeout=None,
+            state_file=None, **kwargs):
+        """Yields (path, bytes) as remote paths grow, see create_tailer
+
+        :param float interval: Seconds between polls
+        :param float timeout: Stop after this many seconds, None never stops
+        """
+        return self.create_tailer(paths, state_file, **kwargs).follow(
+            interval, timeout)
+
+    @common.SSHLogger
+    def put_tree(
+        self, local_dir, remote_dir, channels=common.SFTP_CHANNELS,
+            callback=None):
+        """Recursively copies local_dir to remote_dir, returns a
+        TreeTransferResult
+
+        Files are copied concurrently on channels SFTP channels of this
+        connection.  Failures don't stop the transfer, they are collected in
+        the result's errors.
+
+        :param callable callback: Called as callback(path, size, error) when
+                                  each file is done (from a worker thread)
+        """
+        return self._tree_transfer(
+            "put_tree", local_dir, self._abspath(remote_dir), channels,
+            callback)
+
+    @common.SSHLogger
+    def get_tree(
+        self, remote_dir, local_dir, channels=common.SFTP_CHANNELS,
+            callback=None):
+        """Recursively copies remote_dir to local_dir, see put_tree"""
+        return self._tree_transfer(
+            "get_tree", self._abspath(remote_dir), local_dir, channels,
+            callback)
+
+    @common.SSHLogger
+    def sync(
+        self, local_dir, remote_dir, checksum=False, delete=False,
+            dry_run=False, channels=common.SFTP_CHANNELS, callback=None,
+            timeout=common.DEFAULT_TIMEOUT):
+        """Copies only the new and changed files of local_dir to remote_dir,
+        returns a SyncReport
+
+        Files are compared by size and mtime, or by size and sha256 with
+        checksum (hashed remotely with sha256sum).  Copied files keep their
+        local mtime.
+
+        :param bool delete: Remove remote files and directories that aren't
+                            in local_dir
+        :param bool dry_run: Only report what would be copied and deleted
+        :param float timeout: Max seconds for each sha256sum of checksum
+        """
+        remote_hashes = functools.partial(
+            self._remote_sha256, timeout=timeout) if checksum else None
+        return self._tree_transfer(
+            "sync", local_dir, self._abspath(remote_dir), channels, callback,
+            remote_hashes=remote_hashes, delete=delete, dry_run=dry_run)
+
+    def _remote_sha256(
+            self, remote_paths, batch_size=256,
+            timeout=common.DEFAULT_TIMEOUT):
+        """Returns {remote path: sha256 hex} for the files that could be
+        hashed"""
+        hashes = {}
+        for index in range(0, len(remote_paths), batch_size):
+            paths = remote_paths[index:index + batch_size]
+            try:
+                _, stdout, _, _ = self.connection.execute_command(
+                    "sha256sum -- {0}".format(
+                        " ".join(shlex_quote(path) for path in paths)),
+                    timeout=timeout)
+            except CommandOperationTimeOut:
+                raise CommandOperationTimeOut(
+                    "sha256sum of {0} remote files timed out after {1}s"
+                    .format(len(paths), timeout))
+            for line in stdout.decode("utf-8", "replace").split("\n"):
+                if len(line) > 66 and not line.startswith("\\"):
+                    hashes[line[66:]] = line[:64]
+        return hashes
+
+    def _record_transfer(self, size, started):
+        # feeds compress="auto" for the next connections to this host
+        link = getattr(self.connection, "link", None)
+        if link is not None:
+            tuning.links.record_transfer(link, size, time.time() - started)
+
+    def _abspath(self, remote_path):
+        # extra channels don't share the chdir of this one
+        self._ensure_alive()
+        return posixpath.join(self.sftp.getcwd() or "", remote_path)
+
+    def _tree_transfer(self, name, src, dst, channels, callback, **kwargs):
+        clients = [self.sftp]
+        timer = instrumentation.start("sftp_" + name, src=src, dst=dst)
+        try:
+            clients.extend(
+                self.connection.open_sftp() for _ in range(channels - 1))
+            timer.mark("channel_open")
+            result = getattr(TreeTransfer(clients, callback), name)(
+                src, dst, **kwargs)
+            timer.mark("transfer")
+        except Exception as e:
+            timer.finish(e)
+            raise
+        finally:
+            for sftp in clients[1:]:
+                sftp.close()
+        if isinstance(result, TreeTransferResult):
+            timer.count("files", len(result.files))
+            timer.count("bytes", result.bytes_transferred)
+        elif not result.dry_run:
+            timer.count("files", len(result.new) + len(result.changed))
+            timer.count("bytes", result.bytes_to_send)
+        timer.count("file_errors", len(result.errors))
+        timer.finish()
+        return result
 
     def close(self):
         if hasattr(self, "sftp"):
@@ -251,16 +1139,98 @@ class SFTPShell(common.BaseSSHClass):
 class SSHShell(common.BaseSSHClass):
     RAISE = "RAISE"
     RAISE_DISCONNECT = "RAISE_DISCONNECT"
+    SKIPPED = b"skip"
+    FRAME = (
+        "echo {out}; echo {err} >&2\n{cmd}\n"
+        "echo {out} $?; echo {err} >&2\n")
+    GUARDED_FRAME = (
+        "if [ -z \"$SSHAOLIN_HALT\" ]; then\n"
+        "echo {out}; echo {err} >&2\n{cmd}\n"
+        "SSHAOLIN_RC=$?; echo {out} $SSHAOLIN_RC; echo {err} >&2\n"
+        "[ \"$SSHAOLIN_RC\" -eq 0 ] || SSHAOLIN_HALT=1\n"
+        "else\n"
+        "echo {out}; echo {err} >&2; echo {out} {skip}; echo {err} >&2\n"
+        "fi\n")
 
-    def __init__(self, connection, timeout, keepalive=None):
+    def __init__(
+            self, connection, timeout, keepalive=None, reconnect=None,
+            preamble=None):
+        """Interactive shell on connection, state (cwd, env, ...) is kept
+        between commands
+
+        :param callable reconnect: Returns a new connection, turns on auto
+                                   reconnect: a dead connection is noticed
+                                   before each command and replaced, with
+                                   backoff, and a command failing with a
+                                   disconnect (or a timeout with
+                                   RAISE_DISCONNECT) rebuilds the shell
+                                   instead of closing it.  That command
+                                   still raises, it isn't run again.  stats
+                                   has the reconnect counts and the time
+                                   spent recovering
+        :param list preamble: Commands run now and on every new shell, see
+                              add_preamble
+        """
         super(SSHShell, self).__init__()
-        self.connection = connection
         self.timeout = timeout
+        self.keepalive = keepalive
+        self.preamble = []
+        self.reconnector = Reconnector(reconnect) if reconnect else None
+        self._open(connection)
+        if preamble:
+            self.add_preamble(*preamble)
+
+    @property
+    def stats(self):
+        if self.reconnector is None:
+            return {"reconnects": 0, "failed_attempts": 0,
+                    "recovery_time": 0.0}
+        return self.reconnector.stats
+
+    def add_preamble(self, *cmds):
+        """Runs cmds and remembers them to run again on every new shell
+        after a reconnect, returns their responses"""
+        responses = self.execute_many(cmds)
+        self.preamble.extend(cmds)
+        return responses
+
+    def _open(self, connection):
+        self.connection = connection
         self.channel = self._create_channel()
         self.channel.settimeout(common.POLLING_RATE)
         self._clear_channel()
         self.channel.get_transport().set_keepalive(
-            keepalive or common.CHANNEL_KEEPALIVE)
+            self.keepalive or common.CHANNEL_KEEPALIVE)
+        if self.preamble:
+            self._execute_many(self.preamble, False, self.timeout)
+
+    def _ensure_alive(self):
+        """Reconnects first if auto reconnect is on and the connection or
+        the shell is gone"""
+        if self.reconnector is None or not hasattr(self, "channel"):
+            return
+        channel = self.channel
+        if is_alive(self.connection) and not (
+                channel.closed or channel.eof_received):
+            return
+        self._recover()
+
+    def _recover(self):
+        self.channel.close()
+        self.connection.close()
+        self.reconnector.reconnect(self._open)
+
+    def _on_error(self, error, timeout_action):
+        if timeout_action != self.RAISE_DISCONNECT and isinstance(
+                error, socket.timeout):
+            return
+        if self.reconnector is None or not hasattr(self, "channel"):
+            if timeout_action == self.RAISE_DISCONNECT and isinstance(
+                    error, (socket.timeout, EOFError)):
+                self.close()
+        elif isinstance(error, (socket.timeout, EOFError)) or not (
+                is_alive(self.connection)):
+            self._recover()
 
     def close(self):
         if hasattr(self, "channel"):
@@ -274,20 +1244,78 @@ class SSHShell(common.BaseSSHClass):
     def execute_command(
         self, cmd, timeout_action=RAISE_DISCONNECT,
             exception_on_timeout=True, **kwargs):
+        self._ensure_alive()
         max_time = time.time() + kwargs.get("timeout", self.timeout)
         uuid = uuid4().hex
+        timer = instrumentation.start("shell_execute_command", command=cmd)
         cmd = "echo {1}\n{0}\necho {1} $?\n".format(cmd.strip(), uuid).encode()
         try:
             self._clear_channel()
             self._wait_for_active_shell(max_time)
-            self.channel.send(cmd)
-            response = self._read_shell_response(uuid.encode(), max_time)
-        except socket.timeout:
-            if timeout_action == self.RAISE_DISCONNECT:
-                self.close()
+            self.channel.sendall(cmd)
+            timer.mark("send")
+            response = self._read_shell_response(
+                uuid.encode(), max_time, timer)
+            timer.mark("response")
+        except Exception as e:
+            timer.finish(e)
+            self._on_error(e, timeout_action)
             raise
+        timer.count("bytes_out", len(cmd))
+        timer.finish()
         return response
 
+    @common.SSHLogger
+    def execute_many(
+        self, cmds, stop_on_failure=False, timeout_action=RAISE_DISCONNECT,
+            **kwargs):
+        """Sends every command at once and returns a list of CommandResponse
+
+        Each command is framed with its own stdout and stderr sentinels so the
+        responses can be split apart while the shell runs the commands one
+        after the other, keeping shell state (cwd, env, ...) between them.
+        The timeout applies to each command.  With stop_on_failure the
+        commands after the first non zero exit status are skipped and the
+        returned list ends with the failed command.
+        """
+        self._ensure_alive()
+        timer = instrumentation.start("shell_execute_many")
+        try:
+            responses = self._execute_many(
+                cmds, stop_on_failure, kwargs.get("timeout", self.timeout),
+                timer)
+        except Exception as e:
+            timer.finish(e)
+            self._on_error(e, timeout_action)
+            raise
+        timer.count("commands", len(responses))
+        timer.finish()
+        return responses
+
+    def _execute_many(
+            self, cmds, stop_on_failure, timeout,
+            timer=instrumentation.NULL_TIMER):
+        frames = [(uuid4().hex, uuid4().hex) for _ in cmds]
+        template = self.GUARDED_FRAME if stop_on_failure else self.FRAME
+        script = "".join(
+            template.format(
+                cmd=cmd.strip(), out=out, err=err,
+                skip=self.SKIPPED.decode())
+            for cmd, (out, err) in zip(cmds, frames))
+        if stop_on_failure:
+            script = "unset SSHAOLIN_HALT\n" + script
+        script = script.encode()
+        self._clear_channel()
+        self._wait_for_active_shell(time.time() + timeout)
+        self.channel.sendall(script)
+        timer.mark("send")
+        responses = self._read_shell_responses(
+            [(out.encode(), err.encode()) for out, err in frames],
+            timeout, timer)
+        timer.mark("response")
+        timer.count("bytes_out", len(script))
+        return responses
+
     def _create_channel(self):
         chan = self.connection._transport.open_session()
         chan.invoke_shell()
@@ -299,35 +1327,80 @@ class SSHShell(common.BaseSSHClass):
             if max_time < time.time():
                 raise socket.timeout("Timed out waiting for active shell")
 
-    def _read_shell_response(self, uuid, max_time):
-        stdout = stderr = b""
-        exit_status = None
-        while max_time > time.time():
-            stdout += self._read_channel(self.channel.recv)
-            stderr += self._read_channel(self.channel.recv_stderr)
-            if stdout.count(uuid) == 2:
-                list_ = stdout.split(uuid)
-                stdout = list_[1]
-                try:
-                    exit_status = int(list_[2])
-                except (ValueError, TypeError):
-                    exit_status = None
-                break
-        else:
-            raise CommandOperationTimeOut("Command timed out")
-        response = CommandResponse(
-            stdin=None, stdout=stdout.strip(), stderr=stderr.strip(),
-            exit_status=exit_status)
-        return response
+    def _read_shell_response(
+            self, uuid, max_time, timer=instrumentation.NULL_TIMER):
+        reader = ShellResponseReader(uuid)
+        selector = ChannelSelector()
+        selector.register(self.channel, max_time)
+        try:
+            while not reader.done:
+                for _, kind, data in selector.read():
+                    if data:
+                        timer.first_byte()
+                        timer.count("bytes_in", len(data))
+                    if kind == STDOUT:
+                        reader.feed(data)
+                    elif kind == STDERR:
+                        reader.feed_stderr(data)
+                    elif kind == TIMEOUT:
+                        raise CommandOperationTimeOut("Command timed out")
+                    elif not reader.done:
+                        raise EOFError("Shell channel closed")
+        finally:
+            selector.close()
+        return reader.response()
 
-    def _read_channel(self, read_func, buffsize=1024):
-        read = b""
+    def _read_shell_responses(
+            self, frames, timeout, timer=instrumentation.NULL_TIMER):
+        responses = []
+        readers = [ShellResponseReader(uuid) for uuid in frames[0]]
+        selector = ChannelSelector()
+        selector.register(self.channel)
+        max_time = time.time() + timeout
         try:
-            read += read_func(buffsize)
-        except socket.timeout:
-            pass
-        return read
+            while frames:
+                wait = max_time - time.time()
+                if wait <= 0:
+                    raise CommandOperationTimeOut("Command timed out")
+                closed = False
+                for _, kind, data in selector.read(wait):
+                    if data:
+                        timer.first_byte()
+                        timer.count("bytes_in", len(data))
+                    if kind == STDOUT:
+                        readers[0].feed(data)
+                    elif kind == STDERR:
+                        readers[1].feed(data)
+                    else:
+                        closed = True
+                while frames and readers[0].done and readers[1].done:
+                    out, err = readers
+                    if out.status != self.SKIPPED:
+                        response = out.response()
+                        response.stderr = err.response().stdout
+                        responses.append(response)
+                    frames.pop(0)
+                    max_time = time.time() + timeout
+                    if frames:
+                        readers = [
+                            ShellResponseReader(uuid) for uuid in frames[0]]
+                        readers[0].feed(out.remainder)
+                        readers[1].feed(err.remainder)
+                if frames and closed:
+                    raise EOFError("Shell channel closed")
+        finally:
+            selector.close()
+        return responses
 
     def _clear_channel(self):
-        self._read_channel(self.channel.recv)
-        self._read_channel(self.channel.recv_stderr)
+        while self.channel.recv_ready():
+            self.channel.recv(common.READ_SIZE)
+        while self.channel.recv_stderr_ready():
+            self.channel.recv_stderr(common.READ_SIZE)
+
+
+if sys.version_info < (3, 7):
+    # sets ExtendedParamikoSSHClient here when it's done importing, also when
+    # sshaolin.connection is the module being imported and this is its import
+    # of sshaolin.client
+    import sshaolin.connection  # noqa: E402,F401
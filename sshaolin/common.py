@@ -11,6 +11,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import functools
+import json
 import logging
 import time
 
@@ -18,46 +19,154 @@ from sshaolin.models import CommandResponse
 CHANNEL_KEEPALIVE = 45
 DEFAULT_TIMEOUT = 60
 POLLING_RATE = 0.01
+POOL_MAX_IDLE_TIME = 300
+POOL_MAX_SIZE = 4
+FANOUT_MAX_WORKERS = 32
+MAX_SESSIONS = 10
+SFTP_CHANNELS = 4
+KEY_POOL_SIZE = 16
+KEY_POOL_LOW_WATER = 4
+SFTP_CHUNK_SIZE = 1048576
+SFTP_PREFETCH_CHUNKS = 4
+READ_SIZE = 32768
+STDIN_CHUNK_SIZE = 262144
+OUTPUT_SPILL_SIZE = 16777216
+TAIL_INTERVAL = 1.0
+TAIL_FINGERPRINT_SIZE = 1024
+RECONNECT_MAX_ATTEMPTS = 8
+RECONNECT_BACKOFF = 0.5
+RECONNECT_MAX_BACKOFF = 30
+FORWARD_BUFFER_SIZE = 262144
+RESULT_CACHE_TTL = 30
+RESULT_CACHE_MAX_SIZE = 1024
+KEY_CACHE_MAX_SIZE = 64
+WAN_WINDOW_SIZE = 16777216
+AUTO_COMPRESS_RTT = 0.02
+AUTO_COMPRESS_BANDWIDTH = 4000000
+AUTO_MIN_SAMPLE_SIZE = 1048576
+MAX_LINE_LENGTH = 1048576
+TIMING_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
 
 logging_formatter = logging.Formatter(
     fmt="%(asctime)s: %(levelname)s: %(name)s: %(message)s")
 
 
-def SSHLogger(func):
-    DASH_WIDTH = 42
-
-    @functools.wraps(func)
-    def wrapper(self, *args, **kwargs):
+DASH_WIDTH = 42
+
+
+class LogSettings(object):
+    """Module wide SSHLogger settings, change them with configure_logging
+
+    output_head/output_tail: Bytes of stdout and stderr kept from the start
+                             and the end of logged output, None keeps all of
+                             it
+    structured: Log one JSON object per event instead of the text banners,
+                the event dict is also attached to the record as
+                record.sshaolin_event
+    """
+    output_head = None
+    output_tail = None
+    structured = False
+
+
+def configure_logging(**settings):
+    """Sets LogSettings attributes, e.g. configure_logging(output_head=1024)
+    """
+    for name, value in settings.items():
+        if not hasattr(LogSettings, name):
+            raise AttributeError("Unknown log setting {0}".format(name))
+        setattr(LogSettings, name, value)
+
+
+def truncate_output(data, head=None, tail=None):
+    """Keeps head bytes from the start and tail bytes from the end of data
+
+    Truncation happens on bytes before decoding so huge outputs are never
+    decoded in full.
+    """
+    if not data or (head is None and tail is None):
+        return data
+    head, tail = head or 0, tail or 0
+    if len(data) <= head + tail:
+        return data
+    return b"".join([
+        data[:head],
+        u"...<{0} bytes truncated>...".format(
+            len(data) - head - tail).encode("ascii"),
+        data[len(data) - tail:]])
+
+
+def decode_output(data):
+    data = truncate_output(
+        data or b"", LogSettings.output_head, LogSettings.output_tail)
+    # spilled output only turns into bytes once sliced
+    return data[:].decode("UTF-8", "ignore")
+
+
+def log_event(obj, event):
+    obj._log.info(
+        json.dumps(event, sort_keys=True, default=repr),
+        extra={"sshaolin_event": event})
+
+
+def log_call(obj, name, args, kwargs):
+    if not obj._log.isEnabledFor(logging.INFO):
+        return
+    if LogSettings.structured:
+        return log_event(obj, {
+            "event": "call", "name": name, "args": repr(args),
+            "kwargs": repr(kwargs)})
+    message = (
+        u"\n{equals}\nCALL\n{dash}\n"
+        u"{name} args..........: {args}\n"
+        u"{name} kwargs........: {kwargs}\n"
+        u"{dash}\n").format(
+        dash="-" * DASH_WIDTH, equals="=" * DASH_WIDTH, name=name,
+        args=args, kwargs=kwargs)
+    obj._log.info(message)
+
+
+def log_response(obj, resp, elapsed):
+    if not obj._log.isEnabledFor(logging.INFO):
+        return
+    if isinstance(resp, list):
+        for item in resp:
+            log_response(obj, item, elapsed)
+    elif isinstance(resp, CommandResponse):
+        event = {
+            "event": "response",
+            "stdout": decode_output(resp.output("stdout")),
+            "stderr": decode_output(resp.output("stderr")),
+            "exit_status": resp.exit_status, "elapsed": elapsed}
+        if LogSettings.structured:
+            return log_event(obj, event)
         message = (
-            u"\n{equals}\nCALL\n{dash}\n"
-            u"{name} args..........: {args}\n"
-            u"{name} kwargs........: {kwargs}\n"
+            u"\n{equals}\nRESPONSE\n{dash}\n"
+            u"response stdout......: {stdout}\n"
+            u"response stderr......: {stderr}\n"
+            u"response exit_status.: {exit_status}\n"
+            u"response elapsed.....: {elapsed}\n"
             u"{dash}\n").format(
-            dash="-" * DASH_WIDTH, equals="=" * DASH_WIDTH, name=func.__name__,
-            args=args, kwargs=kwargs)
-        self._log.info(message)
+            dash="-" * DASH_WIDTH, equals="=" * DASH_WIDTH, **event)
+        obj._log.info(message)
+
 
-        start = time.time()
+def SSHLogger(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        # nothing is formatted (or timed) unless INFO is enabled
+        enabled = self._log.isEnabledFor(logging.INFO)
+        if enabled:
+            log_call(self, func.__name__, args, kwargs)
+            start = time.time()
         try:
             resp = func(self, *args, **kwargs)
         except Exception as e:
             self._log.critical(e)
             raise
-
-        elapsed = time.time() - start
-        if isinstance(resp, CommandResponse):
-            message = (
-                u"\n{equals}\nRESPONSE\n{dash}\n"
-                u"response stdout......: {stdout}\n"
-                u"response stderr......: {stderr}\n"
-                u"response exit_status.: {exit_status}\n"
-                u"response elapsed.....: {elapsed}\n"
-                u"{dash}\n").format(
-                dash="-" * 42, equals="=" * 42, elapsed=elapsed,
-                stdout=resp.stdout.decode("UTF-8", "ignore"),
-                stderr=resp.stderr.decode("UTF-8", "ignore"),
-                exit_status=resp.exit_status)
-            self._log.info(message)
+        if enabled:
+            log_response(self, resp, time.time() - start)
         return resp
     return wrapper
 
@@ -86,16 +195,16 @@ class BaseSSHClass(object):
     @classproperty
     def _log(cls):
         # creates a separate logger for each class that are children of the
-        return logging.getLogger(cls._dotpath)
+        # base class, cached on the class itself (not inherited by children)
+        logger = cls.__dict__.get("_sshaolin_logger")
+        if logger is None:
+            logger = logging.getLogger(cls._dotpath)
+            setattr(cls, "_sshaolin_logger", logger)
+        return logger
 
     @classproperty
     def _dotpath(cls):
-        string = str(cls.__mro__[0])
-        string = string.split("'", 1)[-1]  # remove anything before first quote
-        string = string.split("'", 1)[0]  # remove anything after first quote
-        string = string.split()[0]  # remove anything after first whitespace
-        string = string.replace("<", "")  # remove <
-        return string
+        return "{0}.{1}".format(cls.__module__, cls.__name__)
 
     def __enter__(self):
         return self
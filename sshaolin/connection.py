@@ -0,0 +1,286 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""The paramiko side of SSHClient
+
+sshaolin.client imports this module on the first connect instead of at
+import time (python 3.7+, older pythons have no module __getattr__ for the
+ExtendedParamikoSSHClient re-export and import it right away), so short lived
+tools that never connect don't pay for paramiko and cryptography.  That first
+import happens in the connecting thread before paramiko starts a transport
+thread, which is what the warm up below needs.
+"""
+from collections import deque
+from six.moves import queue
+import os
+import six
+import sys
+import threading
+import time
+
+from paramiko.client import SSHClient as ParamikoSSHClient
+from paramiko.ssh_exception import SSHException
+from paramiko import py3compat
+
+from sshaolin import common, instrumentation, tuning
+from sshaolin.client import (
+    EOF, STDOUT, TIMEOUT, ChannelSelector, CommandOperationTimeOut,
+    CommandStream, StdinWriter, wait_exit_status)
+from sshaolin.keys import key_cache
+from sshaolin.output import OutputBuffer
+
+# this is a hack to preimport dependencies imported in a thread during connect
+# which causes a deadlock. https://github.com/paramiko/paramiko/issues/104
+py3compat.u("".encode())
+
+# dirty hack 2.0 also issue 104
+# Try / Catch to prevent users using paramiko<2.0.0 from raising an ImportError
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.utils import int_from_bytes
+    int_from_bytes(b"a", "big")
+    default_backend()
+except ImportError:
+    pass
+
+
+class ExtendedParamikoSSHClient(ParamikoSSHClient):
+    timer = instrumentation.NULL_TIMER
+    profile = None
+    link = None
+
+    @property
+    def _transport(self):
+        return self.__dict__.get("_transport")
+
+    @_transport.setter
+    def _transport(self, transport):
+        # paramiko's connect creates the transport and starts the key
+        # exchange right away, this is the one place to tune it in between
+        self.__dict__["_transport"] = transport
+        if transport is not None and self.profile is not None:
+            tuning.apply(self.profile, transport)
+
+    def set_known_hosts(self, store):
+        """Checks host keys against a shared KnownHostsStore instead of
+        per client HostKeys"""
+        self._system_host_keys = store
+        self._host_keys = store
+
+    def _key_from_filepath(self, filename, klass, password):
+        # keys with a certificate next to them are rare, let paramiko load
+        # those so a cached key is never mutated
+        cert_path = filename if filename.endswith("-cert.pub") else (
+            filename + "-cert.pub")
+        if os.path.isfile(cert_path):
+            return super(ExtendedParamikoSSHClient, self)._key_from_filepath(
+                filename, klass, password)
+        return key_cache.from_file(filename, klass, password)
+
+    def _auth(self, *args, **kwargs):
+        # paramiko authenticates right after the key exchange
+        self.timer.mark("kex")
+        ret_val = super(ExtendedParamikoSSHClient, self)._auth(
+            *args, **kwargs)
+        self.timer.mark("auth")
+        return ret_val
+
+    def _exec_command(self, command, bufsize, timeout, stdin_str, stdin_file):
+        """Returns the channel running command and its stdin, stdin_file is
+        streamed by a StdinWriter (returned instead of stdin_str)"""
+        return self._start_command(
+            self._transport.open_session(), command, bufsize, timeout,
+            stdin_str, stdin_file)
+
+    def _start_command(
+            self, chan, command, bufsize, timeout, stdin_str, stdin_file):
+        """Runs command on an open session channel, the channel is closed if
+        that fails"""
+        try:
+            chan.settimeout(timeout)
+            chan.exec_command(command)
+            if stdin_file is not None:
+                return chan, StdinWriter(chan, stdin_file)
+            stdin = chan.makefile("wb", bufsize)
+            stdin.write(stdin_str)
+            stdin.write("\n\x04")
+            stdin.close()
+        except Exception:
+            chan.close()
+            raise
+        return chan, stdin_str
+
+    def stream_command(
+        self, command, bufsize=-1, timeout=None, stdin_str="",
+            stdin_file=None, lines=False, on_close=None):
+        """Runs command and returns a CommandStream over its output
+
+        timeout is the max number of seconds to wait for new output, the
+        command itself can run as long as it keeps producing output.
+        """
+        chan, stdin = self._exec_command(
+            command, bufsize, timeout, stdin_str, stdin_file)
+        return CommandStream(
+            chan, idle_timeout=timeout, lines=lines, on_close=on_close,
+            stdin_writer=None if stdin_file is None else stdin)
+
+    def execute_command(
+        self, command, bufsize=-1, timeout=None,
+        stdin_str="", stdin_file=None, raise_exceptions=False,
+            stdout_sink=None, stderr_sink=None,
+            spill_size=common.OUTPUT_SPILL_SIZE):
+        """Runs command and returns (stdin, stdout, stderr, exit_status)
+
+        When stdout_sink and/or stderr_sink are given that output is written
+        to them as it arrives instead of being returned (returned as None).
+        Output past spill_size bytes is returned as a SpilledOutput.
+        stdin_file (a file object, file descriptor or iterable of bytes) is
+        streamed while the output is read and followed by eof, stdin is
+        returned as None for it.
+        """
+        max_time = None if timeout is None else time.time() + timeout
+        timer = instrumentation.start("execute_command", command=command)
+        try:
+            chan, stdin = self._exec_command(
+                command, bufsize, timeout, stdin_str, stdin_file)
+            writer, stdin_str = (
+                (None, stdin) if stdin_file is None else (stdin, None))
+            timer.mark("channel_open")
+            sinks = (stdout_sink, stderr_sink)
+            outputs = [
+                OutputBuffer(spill_size) if sink is None else sink
+                for sink in sinks]
+            exit_status = CommandStream(
+                chan, max_time=max_time, stdin_writer=writer).copy_to(
+                timer.sink(outputs[0], "bytes_in"),
+                timer.sink(outputs[1], "bytes_in"))
+            timer.mark("execution")
+        except Exception as e:
+            timer.finish(e)
+            raise
+        timer.count("bytes_out", len(stdin_str or b"") if writer is None else
+                    writer.bytes_written)
+        timer.finish()
+        stdout, stderr = [
+            output.getvalue() if sink is None else None
+            for sink, output in zip(sinks, outputs)]
+        return stdin_str, stdout, stderr, exit_status
+
+    def execute_many(
+        self, commands, max_sessions=common.MAX_SESSIONS, bufsize=-1,
+            timeout=None, spill_size=common.OUTPUT_SPILL_SIZE):
+        """Runs commands concurrently, each on its own session channel, and
+        returns (stdin, stdout, stderr, exit_status) per command in input
+        order
+
+        At most max_sessions channels are open at once, the next command
+        starts when one finishes.  Channels are opened from short lived
+        threads so their round trips overlap instead of adding up.  A server
+        refusing a channel while others are open (sshd's MaxSessions) lowers
+        the cap to what it accepted.  A command that runs past timeout
+        seconds gets a CommandOperationTimeOut in its place instead.
+
+        :param list commands: Command strings or (command, stdin_str) tuples
+        """
+        pending = deque(enumerate(
+            (command, "") if isinstance(command, six.string_types) else
+            command for command in commands))
+        results = [None] * len(pending)
+        opened = queue.Queue()
+        opening = 0
+        running = {}
+        selector = ChannelSelector()
+        timer = instrumentation.start("execute_many", commands=len(pending))
+
+        def open_channel(index, command, stdin_str):
+            # refusals happen on open, a failed exec is the command's error
+            refused = True
+            try:
+                chan = self._transport.open_session()
+                refused = False
+                ret_val = self._start_command(
+                    chan, command, bufsize, timeout, stdin_str, None)
+            except Exception as e:
+                ret_val = e
+            opened.put((index, (command, stdin_str), ret_val, refused))
+
+        try:
+            while pending or opening or running:
+                while pending and opening + len(running) < max_sessions:
+                    index, command = pending.popleft()
+                    opening += 1
+                    thread = threading.Thread(
+                        target=open_channel, args=(index,) + tuple(command))
+                    thread.daemon = True
+                    thread.start()
+                events = selector.read(
+                    common.POLLING_RATE if opening else None)
+                while opening and not opened.empty():
+                    index, command, ret_val, refused = opened.get()
+                    opening -= 1
+                    # paramiko keeps one refusal per transport, concurrent
+                    # opens that were refused can get a bare SSHException
+                    if refused and isinstance(ret_val, SSHException) and (
+                            opening or running) and (
+                            self._transport.is_active()):
+                        pending.appendleft((index, command))
+                        max_sessions = opening + len(running)
+                        timer.count("refused_sessions", 1)
+                        continue
+                    elif isinstance(ret_val, Exception):
+                        raise ret_val
+                    chan, stdin_str = ret_val
+                    max_time = (
+                        None if timeout is None else time.time() + timeout)
+                    selector.register(chan, max_time)
+                    running[chan] = (
+                        index, stdin_str, OutputBuffer(spill_size),
+                        OutputBuffer(spill_size), max_time)
+                    timer.count("bytes_out", len(stdin_str or b""))
+                for chan, kind, data in events:
+                    index, stdin_str, stdout, stderr, max_time = running[chan]
+                    if kind not in (EOF, TIMEOUT):
+                        (stdout if kind == STDOUT else stderr).write(data)
+                        timer.count("bytes_in", len(data))
+                        continue
+                    del running[chan]
+                    try:
+                        if kind == TIMEOUT:
+                            raise CommandOperationTimeOut("Command timed out")
+                        results[index] = (
+                            stdin_str, stdout.getvalue(), stderr.getvalue(),
+                            wait_exit_status(chan, max_time))
+                    except CommandOperationTimeOut as e:
+                        results[index] = e
+                    chan.close()
+        except Exception as e:
+            timer.finish(e)
+            raise
+        finally:
+            # after a raise other threads can still be opening channels, wait
+            # for each of them so no channel is left open
+            while opening:
+                ret_val = opened.get()[2]
+                opening -= 1
+                if not isinstance(ret_val, Exception):
+                    ret_val[0].close()
+            for chan in running:
+                chan.close()
+            selector.close()
+        timer.finish()
+        return results
+
+
+# the sshaolin.client re-export, sys.modules because sshaolin.client may still
+# be importing (python < 3.7 imports this module from its last line)
+sys.modules["sshaolin.client"].ExtendedParamikoSSHClient = (
+    ExtendedParamikoSSHClient)
@@ -0,0 +1,129 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from six.moves import queue
+import threading
+import time
+
+from sshaolin import common
+from sshaolin.client import CommandOperationTimeOut, SSHClient
+
+
+class FanOutExecutor(common.BaseSSHClass):
+    def __init__(self, max_workers=common.FANOUT_MAX_WORKERS, **client_kwargs):
+        """Runs the same command against many hosts on a bounded pool of
+        worker threads
+
+        :param int max_workers: Max number of hosts running at the same time
+        :param client_kwargs: SSHClient kwargs used for hosts given as a
+                              hostname string
+        """
+        super(FanOutExecutor, self).__init__()
+        self.max_workers = max_workers
+        self.client_kwargs = client_kwargs
+
+    def _get_client(self, host):
+        if hasattr(host, "execute_command"):
+            return host
+        return SSHClient(hostname=host, **self.client_kwargs)
+
+    def _run(self, host, command, host_timeout, execute_kwargs):
+        if host_timeout is not None:
+            execute_kwargs = dict(execute_kwargs, timeout=host_timeout)
+        try:
+            return self._get_client(host).execute_command(
+                command, **execute_kwargs)
+        except Exception as e:
+            return e
+
+    def execute_command(
+        self, hosts, command, host_timeout=None, timeout=None,
+            **execute_kwargs):
+        """Yields (host, CommandResponse or Exception) in completion order
+
+        Hosts that don't finish within host_timeout seconds of starting, or
+        before the overall timeout, are yielded with a CommandOperationTimeOut
+        and their late results are dropped.
+
+        :param list hosts: Hostname strings and/or SSHClient instances
+        :param str command: Command to run on every host
+        :param float host_timeout: Max seconds for a single host
+        :param float timeout: Max seconds for the whole fan-out
+        :param execute_kwargs: Passed to SSHClient.execute_command
+        """
+        hosts = list(hosts)
+        tasks = queue.Queue()
+        results = queue.Queue()
+        cancelled = threading.Event()
+        started = {}
+        for index, host in enumerate(hosts):
+            tasks.put((index, host))
+
+        def worker():
+            while not cancelled.is_set():
+                try:
+                    index, host = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                started[index] = time.time()
+                results.put((index, self._run(
+                    host, command, host_timeout, execute_kwargs)))
+
+        for _ in range(min(self.max_workers, len(hosts))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+
+        pending = set(range(len(hosts)))
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            while pending:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    for index in sorted(pending):
+                        yield hosts[index], CommandOperationTimeOut(
+                            "Fan-out timed out")
+                    return
+                expired = [] if host_timeout is None else [
+                    index for index in pending
+                    if now - started.get(index, now) >= host_timeout]
+                for index in expired:
+                    pending.discard(index)
+                    yield hosts[index], CommandOperationTimeOut(
+                        "Host timed out")
+                if not pending:
+                    return
+                try:
+                    index, result = results.get(
+                        timeout=self._next_wakeup(
+                            pending, started, host_timeout, deadline))
+                except queue.Empty:
+                    continue
+                if index in pending:
+                    pending.discard(index)
+                    yield hosts[index], result
+        finally:
+            cancelled.set()
+
+    @staticmethod
+    def _next_wakeup(pending, started, host_timeout, deadline):
+        wakeups = [] if deadline is None else [deadline]
+        if host_timeout is not None:
+            wakeups.extend(
+                started[index] + host_timeout for index in pending
+                if index in started)
+            # hosts that haven't started yet have no deadline, poll for them
+            if any(index not in started for index in pending):
+                wakeups.append(time.time() + common.POLLING_RATE * 10)
+        if not wakeups:
+            return None
+        return max(min(wakeups) - time.time(), 0)
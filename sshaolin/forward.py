@@ -0,0 +1,644 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Port forwarding over one authenticated paramiko transport
+
+A ForwardingEngine runs any number of local (-L), remote (-R) and dynamic
+SOCKS (-D) forwards on one transport.  Every tunnel is a socket paired with
+a channel, all of them are relayed by one selector thread.  Only the short
+blocking steps (opening a channel, connecting to the forward target, the
+SOCKS negotiation) run in a thread of their own.
+"""
+from collections import deque
+import abc
+import errno
+import functools
+import six
+import socket
+import struct
+import threading
+
+try:
+    import selectors
+except ImportError:  # python 2
+    import selectors34 as selectors
+
+from sshaolin import common
+
+RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+# the other end going away is how most tunnels end, not an error
+GONE_ERRNOS = (errno.ECONNRESET, errno.EPIPE)
+
+
+class SocksError(Exception):
+    pass
+
+
+class Relay(common.BaseSSHClass):
+    def __init__(
+        self, buffer_size=common.FORWARD_BUFFER_SIZE,
+            read_size=common.READ_SIZE):
+        """Moves bytes between any number of socket/channel pairs from one
+        thread
+
+        Each direction of a tunnel buffers at most buffer_size bytes, past
+        that reading from its source pauses until the destination catches
+        up.  Channels can't signal that they're writable, while data waits
+        for a channel window the selector wakes up every POLLING_RATE.
+        """
+        super(Relay, self).__init__()
+        self.buffer_size = buffer_size
+        self.read_size = read_size
+        self.tunnels = set()
+        self._waiting = set()
+        self._calls = deque()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(
+            self._wakeup_recv, selectors.EVENT_READ, None)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="relay")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self, func, *args):
+        """Runs func(*args) in the relay thread and waits for it, an
+        exception it raises is raised here and the relay keeps running"""
+        if threading.current_thread() is self._thread:
+            return func(*args)
+        if not self._thread.is_alive():
+            raise RuntimeError("Relay is closed")
+        done = threading.Event()
+        result = []
+        error = []
+
+        def call():
+            try:
+                result.append(func(*args))
+            except Exception as e:
+                error.append(e)
+            finally:
+                done.set()
+        self._calls.append(call)
+        try:
+            self._wakeup_send.send(b"x")
+        except socket.error as e:
+            if e.errno not in RETRY_ERRNOS:
+                raise
+        done.wait()
+        if error:
+            raise error[0]
+        return result[0] if result else None
+
+    def add_listener(self, sock, handler):
+        """Calls handler() in the relay thread whenever sock is readable"""
+        sock.setblocking(False)
+        self.run(
+            self._selector.register, sock, selectors.EVENT_READ,
+            lambda mask: handler())
+
+    def remove_listener(self, sock):
+        def remove():
+            self._selector.unregister(sock)
+            sock.close()
+        self.run(remove)
+
+    def add_tunnel(self, forward, sock, chan):
+        """Relays sock <-> chan until both sides are done, bytes read from
+        sock count as forward's bytes_sent, from chan as bytes_received"""
+        sock.setblocking(False)
+        for option in [socket.SO_SNDBUF, socket.SO_RCVBUF]:
+            sock.setsockopt(socket.SOL_SOCKET, option, self.buffer_size)
+        chan.settimeout(0.0)
+        self.run(Tunnel, self, forward, sock, chan)
+
+    def close(self):
+        if not getattr(self, "_running", False):
+            return
+
+        def stop():
+            for tunnel in list(self.tunnels):
+                tunnel.close()
+            self._running = False
+        self.run(stop)
+        self._thread.join()
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def _run(self):
+        while self._running:
+            timeout = common.POLLING_RATE if self._waiting else None
+            for key, mask in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        self._run_calls()
+                    except Exception as e:
+                        self._log.exception(e)
+                    continue
+                try:
+                    key.data(mask)
+                except Exception as e:
+                    self._log.exception(e)
+            for endpoint in list(self._waiting):
+                endpoint.tunnel.flush(endpoint)
+                endpoint.tunnel.update()
+
+    def _run_calls(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except socket.error as e:
+            if e.errno not in RETRY_ERRNOS:
+                raise
+        while self._calls:
+            self._calls.popleft()()
+
+
+class Endpoint(object):
+    def __init__(self, tunnel, conn, counter):
+        """One side of a tunnel, pending holds the bytes waiting to be
+        written to it and counter names the count bytes read from it add to
+        """
+        self.tunnel = tunnel
+        self.conn = conn
+        self.counter = counter
+        self.is_channel = not isinstance(conn, socket.socket)
+        self.pending = bytearray()
+        self.read_done = False
+        self.write_done = False
+        self.events = 0
+        self.peer = None
+
+
+class Tunnel(object):
+    def __init__(self, relay, forward, sock, chan):
+        """A socket/channel pair, only ever touched in the relay thread"""
+        self.relay = relay
+        self.forward = forward
+        self.closed = False
+        self.local = Endpoint(self, sock, "bytes_sent")
+        self.remote = Endpoint(self, chan, "bytes_received")
+        self.local.peer, self.remote.peer = self.remote, self.local
+        relay.tunnels.add(self)
+        forward._opened(self)
+        self.update()
+
+    def on_event(self, endpoint, mask):
+        if mask & selectors.EVENT_READ:
+            self.read(endpoint)
+        if mask & selectors.EVENT_WRITE:
+            self.flush(endpoint)
+        self.update()
+
+    def read(self, src):
+        try:
+            if src.is_channel:
+                if src.conn.recv_ready():
+                    data = src.conn.recv(self.relay.read_size)
+                elif src.conn.eof_received or src.conn.closed:
+                    data = b""
+                else:
+                    return
+            else:
+                data = src.conn.recv(self.relay.read_size)
+        except socket.error as e:
+            if e.errno in RETRY_ERRNOS:
+                return
+            return self.close(None if e.errno in GONE_ERRNOS else e)
+        if data:
+            src.peer.pending.extend(data)
+            self.forward._count(src.counter, len(data))
+        else:
+            src.read_done = True
+        self.flush(src.peer)
+
+    def flush(self, dst):
+        if self.closed:
+            return
+        try:
+            while dst.pending:
+                if dst.is_channel:
+                    if dst.conn.closed:
+                        return self.close()
+                    if not dst.conn.send_ready():
+                        break
+                    sent = dst.conn.send(
+                        bytes(dst.pending[:self.relay.read_size]))
+                else:
+                    sent = dst.conn.send(dst.pending)
+                del dst.pending[:sent]
+            if dst.peer.read_done and not dst.pending and not dst.write_done:
+                dst.write_done = True
+                if dst.is_channel:
+                    dst.conn.shutdown_write()
+                else:
+                    dst.conn.shutdown(socket.SHUT_WR)
+        except socket.error as e:
+            if e.errno not in RETRY_ERRNOS:
+                self.close(None if e.errno in GONE_ERRNOS else e)
+
+    def update(self):
+        """Re-registers both endpoints for what they can do now and closes
+        the tunnel once both directions are done"""
+        if self.closed:
+            return
+        if self.local.write_done and self.remote.write_done:
+            return self.close()
+        for endpoint in [self.local, self.remote]:
+            events = 0
+            if (not endpoint.read_done and len(
+                    endpoint.peer.pending) < self.relay.buffer_size):
+                events |= selectors.EVENT_READ
+            if endpoint.pending and not endpoint.is_channel:
+                events |= selectors.EVENT_WRITE
+            if endpoint.pending and endpoint.is_channel:
+                self.relay._waiting.add(endpoint)
+            else:
+                self.relay._waiting.discard(endpoint)
+            self._register(endpoint, events)
+
+    def close(self, error=None):
+        if self.closed:
+            return
+        self.closed = True
+        for endpoint in [self.local, self.remote]:
+            self.relay._waiting.discard(endpoint)
+            self._register(endpoint, 0)
+            endpoint.conn.close()
+        self.relay.tunnels.discard(self)
+        self.forward._closed(self, error)
+
+    def _register(self, endpoint, events):
+        selector = self.relay._selector
+        if events == endpoint.events:
+            return
+        if not events:
+            selector.unregister(endpoint.conn)
+        elif not endpoint.events:
+            selector.register(endpoint.conn, events, functools.partial(
+                self.on_event, endpoint))
+        else:
+            selector.modify(endpoint.conn, events, functools.partial(
+                self.on_event, endpoint))
+        endpoint.events = events
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Forward(common.BaseSSHClass):
+    TYPE = None
+
+    def __init__(self, engine, address, port, name=None):
+        """A forward of a ForwardingEngine
+
+        bytes_sent counts the bytes that went out over the ssh transport,
+        bytes_received the bytes that came back.
+        """
+        super(Forward, self).__init__()
+        self.engine = engine
+        self.address = address
+        self.port = port
+        self.name = name
+        self.connections = 0
+        self.active = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.tunnels = set()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {
+            "connections": self.connections, "active": self.active,
+            "errors": self.errors, "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received}
+
+    def set_name(self, name):
+        self.name = name
+
+    def close(self):
+        if getattr(self, "engine", None) is None:
+            return
+        engine = self.engine
+        self._stop(engine)
+        engine.relay.run(
+            lambda: [tunnel.close() for tunnel in list(self.tunnels)])
+        self.engine = None
+        engine._removed(self)
+
+    def _stop(self, engine):
+        """Stops new connections coming in, a plain Forward only has the
+        tunnels handed to it"""
+
+    def _count(self, name, value):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _opened(self, tunnel):
+        self.tunnels.add(tunnel)
+        self._count("connections", 1)
+        self._count("active", 1)
+
+    def _closed(self, tunnel, error=None):
+        self.tunnels.discard(tunnel)
+        self._count("active", -1)
+        if error is not None:
+            self._failed(error)
+
+    def _failed(self, error):
+        self._count("errors", 1)
+        self._log.warning("{0} {1}:{2}: {3}".format(
+            self.TYPE, self.address, self.port, error))
+
+    def _tunnel(self, sock, open_channel):
+        """Opens the channel for sock and hands the pair to the relay"""
+        engine = self.engine
+        try:
+            chan = open_channel()
+            if engine is None:
+                raise socket.error("forward closed")
+            engine.relay.add_tunnel(self, sock, chan)
+        except Exception as e:
+            sock.close()
+            self._failed(e)
+
+
+class ListeningForward(Forward):
+    def __init__(self, engine, address, port, name=None):
+        """Listens on address:port locally (port 0 picks a free port), the
+        listener is bound when the constructor returns"""
+        self.sock = None
+        family, socktype, proto, _, sockaddr = socket.getaddrinfo(
+            address, port, 0, socket.SOCK_STREAM)[0]
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(sockaddr)
+            sock.listen(socket.SOMAXCONN)
+        except socket.error:
+            sock.close()
+            raise
+        super(ListeningForward, self).__init__(
+            engine, address, sock.getsockname()[1], name)
+        self.sock = sock
+        engine.relay.add_listener(sock, self._accept)
+
+    def _accept(self):
+        try:
+            client, _ = self.sock.accept()
+        except socket.error as e:
+            if e.errno not in RETRY_ERRNOS:
+                self._failed(e)
+            return
+        client.setblocking(True)
+        client.settimeout(self.engine.timeout)
+        self.engine._spawn(self._connect, client)
+
+    @abc.abstractmethod
+    def _connect(self, client):
+        """Tunnels an accepted client socket, runs in its own thread"""
+
+    def _stop(self, engine):
+        engine.relay.remove_listener(self.sock)
+
+
+class LocalForward(ListeningForward):
+    TYPE = "PORT_FORWARD"
+
+    def __init__(
+        self, engine, address, port, forward_address, forward_port,
+            name=None):
+        """-L: connections to address:port are forwarded to
+        forward_address:forward_port as seen from the ssh server"""
+        self.forward_address = forward_address
+        self.forward_port = forward_port
+        super(LocalForward, self).__init__(engine, address, port, name)
+
+    def _connect(self, client):
+        engine = self.engine
+        self._tunnel(client, lambda: engine.transport.open_channel(
+            "direct-tcpip", (self.forward_address, self.forward_port),
+            client.getpeername()[:2], timeout=engine.timeout))
+
+
+class SocksForward(ListeningForward):
+    TYPE = "SOCKS"
+
+    def _connect(self, client):
+        """-D: negotiates SOCKS4/4a or SOCKS5 CONNECT and forwards to the
+        requested host as seen from the ssh server"""
+        engine = self.engine
+        try:
+            version, target = socks_negotiate(client)
+        except Exception as e:
+            client.close()
+            return self._failed(e)
+
+        def open_channel():
+            try:
+                chan = engine.transport.open_channel(
+                    "direct-tcpip", target, client.getpeername()[:2],
+                    timeout=engine.timeout)
+            except Exception:
+                socks_reply(client, version, False)
+                raise
+            socks_reply(client, version, True)
+            return chan
+        self._tunnel(client, open_channel)
+
+
+class RemoteForward(Forward):
+    TYPE = "REMOTE_PORT_FORWARD"
+
+    def __init__(
+        self, engine, address, port, forward_address, forward_port,
+            name=None):
+        """-R: the ssh server listens on address:port (port 0 lets the
+        server pick) and its connections are forwarded to
+        forward_address:forward_port from here, the server has accepted the
+        forward when the constructor returns"""
+        self.forward_address = forward_address
+        self.forward_port = forward_port
+        port = engine.transport.request_port_forward(
+            address, port, engine._dispatch_remote)
+        super(RemoteForward, self).__init__(engine, address, port, name)
+
+    def _connect(self, chan):
+        try:
+            sock = socket.create_connection(
+                (self.forward_address, self.forward_port),
+                self.engine.timeout)
+        except Exception as e:
+            chan.close()
+            return self._failed(e)
+        self._tunnel(sock, lambda: chan)
+
+    def _stop(self, engine):
+        # not transport.cancel_port_forward, it drops the handler of every
+        # remote forward on the transport
+        if engine.transport.is_active():
+            engine.transport.global_request(
+                "cancel-tcpip-forward", (self.address, self.port), wait=True)
+
+
+class ForwardingEngine(common.BaseSSHClass):
+    def __init__(
+        self, transport, connection=None, timeout=common.DEFAULT_TIMEOUT,
+            buffer_size=common.FORWARD_BUFFER_SIZE):
+        """Local, remote and SOCKS forwards sharing one paramiko transport
+
+        :param transport: Authenticated paramiko Transport
+        :param connection: Paramiko SSHClient closed with the engine
+        :param float timeout: Seconds allowed to open a channel, connect to
+                              a forward target or negotiate SOCKS
+        :param int buffer_size: Bytes buffered per direction per tunnel
+        """
+        super(ForwardingEngine, self).__init__()
+        self.transport = transport
+        self.connection = connection
+        self.timeout = timeout
+        self.forwards = []
+        self.relay = Relay(buffer_size)
+        self._lock = threading.Lock()
+
+    def create_forward_port(
+        self, port, forward_address, forward_port, address=None,
+            remote=False):
+        """Forwards address:port to forward_address:forward_port
+
+        Unlike ssh, address defaults to localhost for local forwards and to
+        the server's default ("" binds every interface) for remote ones.
+        Returns a LocalForward or RemoteForward once it's listening, its
+        port is the bound port when port is 0.
+        """
+        if remote:
+            forward = RemoteForward(
+                self, address or "", port, forward_address, forward_port)
+        else:
+            forward = LocalForward(
+                self, address or "localhost", port, forward_address,
+                forward_port)
+        return self._added(forward)
+
+    def create_socks_proxy(self, port=0, address=None):
+        """Returns a SocksForward listening on address:port (localhost by
+        default)"""
+        return self._added(SocksForward(self, address or "localhost", port))
+
+    def close(self):
+        for forward in list(getattr(self, "forwards", [])):
+            forward.close()
+        if hasattr(self, "relay"):
+            self.relay.close()
+            del self.relay
+        if getattr(self, "connection", None) is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _added(self, forward):
+        with self._lock:
+            self.forwards.append(forward)
+        return forward
+
+    def _removed(self, forward):
+        with self._lock:
+            if forward in self.forwards:
+                self.forwards.remove(forward)
+
+    def _dispatch_remote(self, chan, origin, server):
+        # paramiko has one handler per transport, route on the bound port
+        with self._lock:
+            forwards = [
+                forward for forward in self.forwards
+                if forward.port == server[1] and isinstance(
+                    forward, RemoteForward)]
+        if not forwards:
+            chan.close()
+            return
+        self._spawn(forwards[0]._connect, chan)
+
+    def _spawn(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise SocksError("Connection closed during SOCKS negotiation")
+        data += chunk
+    return data
+
+
+def recv_until_null(sock, limit=255):
+    data = b""
+    while True:
+        char = recv_exact(sock, 1)
+        if char == b"\x00":
+            return data
+        data += char
+        if len(data) > limit:
+            raise SocksError("SOCKS4 field too long")
+
+
+def socks_negotiate(sock):
+    """Reads a SOCKS4/4a or SOCKS5 CONNECT request from sock and returns
+    (version, (host, port)), only SOCKS5's "no authentication" is offered"""
+    version = ord(recv_exact(sock, 1))
+    if version == 4:
+        command, port = struct.unpack("!BH", recv_exact(sock, 3))
+        ip = recv_exact(sock, 4)
+        recv_until_null(sock)
+        if ip[:3] == b"\x00\x00\x00" and ip[3:] != b"\x00":
+            host = recv_until_null(sock).decode("idna")
+        else:
+            host = socket.inet_ntoa(ip)
+    elif version == 5:
+        methods = recv_exact(sock, ord(recv_exact(sock, 1)))
+        if b"\x00" not in methods:
+            sock.sendall(b"\x05\xff")
+            raise SocksError("SOCKS5 client requires authentication")
+        sock.sendall(b"\x05\x00")
+        _, command, _, address_type = struct.unpack(
+            "!BBBB", recv_exact(sock, 4))
+        if address_type == 1:
+            host = socket.inet_ntoa(recv_exact(sock, 4))
+        elif address_type == 3:
+            host = recv_exact(
+                sock, ord(recv_exact(sock, 1))).decode("idna")
+        elif address_type == 4:
+            host = socket.inet_ntop(socket.AF_INET6, recv_exact(sock, 16))
+        else:
+            socks_reply(sock, version, False, 8)
+            raise SocksError(
+                "Unknown SOCKS5 address type {0}".format(address_type))
+        port = struct.unpack("!H", recv_exact(sock, 2))[0]
+    else:
+        raise SocksError("Unknown SOCKS version {0}".format(version))
+    if command != 1:
+        socks_reply(sock, version, False, 7)
+        raise SocksError("Unsupported SOCKS command {0}".format(command))
+    return version, (host, port)
+
+
+def socks_reply(sock, version, success, code=1):
+    if version == 4:
+        sock.sendall(b"\x00" + (b"\x5a" if success else b"\x5b") + b"\x00" * 6)
+    else:
+        sock.sendall(struct.pack(
+            "!BBBB4sH", 5, 0 if success else code, 0, 1, b"\x00" * 4, 0))
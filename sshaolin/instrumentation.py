@@ -0,0 +1,198 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Per phase timings and byte counts of connections, commands and transfers
+
+Listeners are callables registered with add_listener, each finished operation
+calls them with a TimingEvent.  With no listener registered start() hands out
+a shared no-op timer so instrumented code pays one list check per operation.
+"""
+import bisect
+import threading
+import time
+
+from sshaolin import common
+from sshaolin.models import TimingEvent
+
+_listeners = ()
+_listeners_lock = threading.Lock()
+
+
+def add_listener(listener):
+    """Registers listener(TimingEvent), called from the thread that ran the
+    operation"""
+    global _listeners
+    with _listeners_lock:
+        _listeners = _listeners + (listener, )
+
+
+def remove_listener(listener):
+    global _listeners
+    with _listeners_lock:
+        _listeners = tuple(item for item in _listeners if item != listener)
+
+
+def start(name, **attributes):
+    """Returns a PhaseTimer for operation name, or NULL_TIMER when nothing
+    is listening"""
+    if not _listeners:
+        return NULL_TIMER
+    return PhaseTimer(name, attributes)
+
+
+class NullTimer(object):
+    active = False
+
+    def mark(self, phase):
+        pass
+
+    def count(self, name, value):
+        pass
+
+    def first_byte(self):
+        pass
+
+    def sink(self, sink, name):
+        return sink
+
+    def finish(self, error=None):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class PhaseTimer(object):
+    active = True
+
+    def __init__(self, name, attributes):
+        """Times consecutive phases of one operation
+
+        Every mark(phase) records the time since the previous mark (or the
+        start) under that phase name.
+        """
+        self.event = TimingEvent(name=name, attributes=attributes)
+        self.first_byte_marked = False
+        self._start = self._last = time.time()
+
+    def mark(self, phase):
+        now = time.time()
+        self.event.phases.append((phase, now - self._last))
+        self._last = now
+
+    def count(self, name, value):
+        self.event.counts[name] = self.event.counts.get(name, 0) + value
+
+    def first_byte(self):
+        """Marks the first_byte phase the first time it's called"""
+        if not self.first_byte_marked:
+            self.first_byte_marked = True
+            self.mark("first_byte")
+
+    def sink(self, sink, name):
+        """Wraps a file like sink to count the bytes written to it as name,
+        the first write marks the first_byte phase"""
+        return CountingSink(self, sink, name)
+
+    def finish(self, error=None):
+        self.event.total = time.time() - self._start
+        self.event.error = error
+        for listener in _listeners:
+            listener(self.event)
+
+
+class CountingSink(object):
+    def __init__(self, timer, sink, name):
+        self.timer = timer
+        self.sink = sink
+        self.name = name
+
+    def write(self, data):
+        self.timer.first_byte()
+        self.timer.count(self.name, len(data))
+        return self.sink.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+
+class HistogramCollector(common.BaseSSHClass):
+    def __init__(self, buckets=common.TIMING_BUCKETS):
+        """Listener that keeps a latency histogram per (event, phase) and a
+        running total per (event, count)
+
+        Register it with add_listener(collector) and export with
+        to_openmetrics().
+        """
+        super(HistogramCollector, self).__init__()
+        self.buckets = sorted(buckets)
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        phases = list(event.phases) + [("total", event.total)]
+        with self._lock:
+            for phase, seconds in phases:
+                key = (event.name, phase)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = {
+                        "buckets": [0] * (len(self.buckets) + 1),
+                        "sum": 0.0, "count": 0}
+                histogram["buckets"][
+                    bisect.bisect_left(self.buckets, seconds)] += 1
+                histogram["sum"] += seconds
+                histogram["count"] += 1
+            for name, value in event.counts.items():
+                key = (event.name, name)
+                self.counters[key] = self.counters.get(key, 0) + value
+            if event.error is not None:
+                key = (event.name, "errors")
+                self.counters[key] = self.counters.get(key, 0) + 1
+
+    def to_openmetrics(self, prefix="sshaolin"):
+        """Returns the collected metrics in the OpenMetrics text format"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        if histograms:
+            lines.append("# TYPE {0}_phase_seconds histogram".format(prefix))
+            lines.append(
+                "# UNIT {0}_phase_seconds seconds".format(prefix))
+        for (event, phase), histogram in histograms:
+            labels = 'event="{0}",phase="{1}"'.format(
+                escape(event), escape(phase))
+            cumulative = 0
+            bounds = [repr(float(b)) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram["buckets"]):
+                cumulative += count
+                lines.append("{0}_phase_seconds_bucket{{{1},le=\"{2}\"}} {3}"
+                             .format(prefix, labels, bound, cumulative))
+            lines.append("{0}_phase_seconds_count{{{1}}} {2}".format(
+                prefix, labels, histogram["count"]))
+            lines.append("{0}_phase_seconds_sum{{{1}}} {2!r}".format(
+                prefix, labels, histogram["sum"]))
+        if counters:
+            lines.append("# TYPE {0}_operation counter".format(prefix))
+        for (event, name), value in counters:
+            lines.append(
+                "{0}_operation_total{{event=\"{1}\",count=\"{2}\"}} {3}"
+                .format(prefix, escape(event), escape(name), value))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace(
+        "\"", "\\\"").replace("\n", "\\n")
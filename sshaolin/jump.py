@@ -0,0 +1,116 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import threading
+
+from sshaolin import common
+from sshaolin.pool import is_alive
+
+JUMP_ORIGIN = ("127.0.0.1", 0)
+
+
+def parse_jump_host(spec):
+    """Returns the SSHClient kwargs for an ssh -J style [user@]host[:port]
+    ([host]:port for IPv6 addresses)"""
+    kwargs = {"port": 22}
+    if "@" in spec:
+        kwargs["username"], spec = spec.rsplit("@", 1)
+    if spec.startswith("["):
+        host, _, port = spec[1:].partition("]")
+        port = port.lstrip(":")
+    elif spec.count(":") == 1:
+        host, port = spec.split(":")
+    else:
+        host, port = spec, None
+    kwargs["hostname"] = host
+    if port:
+        kwargs["port"] = int(port)
+    return kwargs
+
+
+class JumpHostCache(common.BaseSSHClass):
+    def __init__(self):
+        """One authenticated connection per jump host chain, shared by every
+        client that goes through it
+
+        A chain a -> b is cached under each of its prefixes (a and a -> b) so
+        a target behind b costs a direct-tcpip channel on the cached b
+        transport, not a handshake with a and b.  Concurrent connects to the
+        same chain wait for one handshake instead of racing.
+        """
+        super(JumpHostCache, self).__init__()
+        self.handshakes = 0
+        self._connections = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": len(self._connections),
+                "handshakes": self.handshakes}
+
+    def open_channel(self, hops, address, timeout=None):
+        """Returns a direct-tcpip channel to address (host, port) opened on
+        the last of hops, usable as the sock of a paramiko connect
+
+        :param list hops: SSHClient of every jump host, in order
+        """
+        connection = self.connect(hops, timeout)
+        return connection.get_transport().open_channel(
+            "direct-tcpip", address, JUMP_ORIGIN, timeout=timeout)
+
+    def connect(self, hops, timeout=None):
+        """Returns the cached connection to the last of hops, connecting
+        whichever hops aren't connected (or died)"""
+        key = ()
+        connection = None
+        for hop in hops:
+            key += (hop._pool_key(), )
+            connection = self._get(key, hop, connection, timeout)
+        return connection
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = getattr(
+                self, "_connections", {}), {}
+        # innermost hops first, their channels run on the outer transports
+        for key in sorted(connections, key=len, reverse=True):
+            connections[key].close()
+
+    def _get(self, key, hop, previous, timeout):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            connection = self._connections.get(key)
+            if connection is not None and is_alive(connection):
+                return connection
+            if connection is not None:
+                connection.close()
+            sock = None
+            if previous is not None:
+                sock = previous.get_transport().open_channel(
+                    "direct-tcpip", (
+                        hop.connect_kwargs["hostname"],
+                        hop.connect_kwargs["port"]),
+                    JUMP_ORIGIN, timeout=timeout)
+            connection = hop._connect(sock=sock)
+            connection.get_transport().set_keepalive(
+                common.CHANNEL_KEEPALIVE)
+            with self._lock:
+                self._connections[key] = connection
+                self.handshakes += 1
+            return connection
+
+
+bastions = JumpHostCache()
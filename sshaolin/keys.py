@@ -0,0 +1,234 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from paramiko import ECDSAKey, RSAKey, SSHException
+from paramiko.client import MissingHostKeyPolicy
+from paramiko.hostkeys import HostKeyEntry, HostKeys
+import six
+
+from sshaolin import common
+
+try:
+    from paramiko import Ed25519Key
+    KEY_CLASSES = (RSAKey, ECDSAKey, Ed25519Key)
+except ImportError:  # paramiko<2.2.0
+    KEY_CLASSES = (RSAKey, ECDSAKey)
+
+
+class KeyCache(common.BaseSSHClass):
+    def __init__(self, max_keys=common.KEY_CACHE_MAX_SIZE):
+        """Process wide cache of parsed private keys
+
+        Keys given as strings are cached by a digest of their content, key
+        files by path and parsed again (replacing the old entry) when their
+        mtime or size changes.  Failed parses are cached too (paramiko tries
+        every key class on every file it looks at).  Entries are kept in
+        least recently used order and the oldest are evicted past max_keys,
+        clear() drops them all.
+
+        :param int max_keys: Max cached keys and failed parses
+        """
+        super(KeyCache, self).__init__()
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def from_string(self, data, password=None):
+        """Returns the PKey for a private key string (RSA, ECDSA or Ed25519)
+        """
+        if isinstance(data, six.binary_type):
+            data = data.decode("utf-8")
+        key = ("string", hashlib.sha256(data.encode("utf-8")).digest(),
+               password)
+        return self._get(key, lambda: self._parse(data, password))
+
+    def from_file(self, path, klass, password=None):
+        """Returns klass.from_private_key_file(path, password), cached"""
+        stat = os.stat(path)
+        key = ("file", os.path.abspath(path), klass, password)
+        return self._get(
+            key, lambda: klass.from_private_key_file(path, password),
+            (stat.st_mtime, stat.st_size))
+
+    def clear(self):
+        """Drops every cached key"""
+        with self._lock:
+            self._keys = OrderedDict()
+
+    @property
+    def size(self):
+        with self._lock:
+            return len(self._keys)
+
+    def _get(self, key, factory, version=None):
+        with self._lock:
+            found = self._keys.pop(key, None)
+            if found is not None and found[0] == version:
+                # re-inserting makes it the most recently used
+                self._keys[key] = found
+            else:
+                found = None
+        if found is None:
+            try:
+                found = (version, factory(), None)
+            except SSHException as e:
+                found = (version, None, e)
+            with self._lock:
+                self._keys[key] = found
+                while len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+        _, pkey, error = found
+        if error is not None:
+            raise error
+        return pkey
+
+    @staticmethod
+    def _parse(data, password):
+        error = None
+        for klass in KEY_CLASSES:
+            try:
+                return klass.from_private_key(six.StringIO(data), password)
+            except (SSHException, ValueError) as e:
+                error = e
+        raise error
+
+
+class HostKeyMap(dict):
+    """{key type: PKey} the way paramiko's SSHClient.connect reads it
+    (keys()[0] has to work)"""
+
+    def keys(self):
+        return list(dict.keys(self))
+
+    def values(self):
+        return list(dict.values(self))
+
+
+class KnownHostsStore(common.BaseSSHClass):
+    _files = {}
+    _files_lock = threading.Lock()
+
+    def __init__(self):
+        """In memory known_hosts shared by any number of clients
+
+        Plain host names are indexed in a dict so a lookup costs the same
+        with 50 entries or 50k.  Hashed (|1|salt|hash) entries can only be
+        matched by hashing the name with every salt, that scan happens once
+        per name.  Lines are only turned into paramiko keys when they are
+        looked up and every lookup result is memoized until a line for that
+        name is added.
+        """
+        super(KnownHostsStore, self).__init__()
+        self._plain = {}
+        self._hashed = []
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(lines) for lines in self._plain.values()) + len(
+            self._hashed)
+
+    @classmethod
+    def from_file(cls, path):
+        """Returns the process wide store for a known_hosts file, loaded
+        once and reloaded when the file changes"""
+        path = os.path.abspath(os.path.expanduser(path))
+        mtime = os.stat(path).st_mtime
+        with cls._files_lock:
+            loaded_mtime, store = cls._files.get(path, (None, None))
+            if store is None or loaded_mtime != mtime:
+                store = cls()
+                store.load(path)
+                cls._files[path] = (mtime, store)
+        return store
+
+    def load(self, path):
+        with open(path) as fp:
+            for line in fp:
+                self.add_line(line)
+
+    def add_line(self, line):
+        """Indexes one known_hosts line (comments, markers and blank lines
+        are skipped)"""
+        line = line.strip()
+        if not line or line.startswith(("#", "@")):
+            return
+        fields = line.split(None, 1)
+        if len(fields) < 2:
+            return
+        with self._lock:
+            for name in fields[0].split(","):
+                if name.startswith("|1|"):
+                    self._hashed.append((name, line))
+                    self._lookups = {}
+                else:
+                    self._plain.setdefault(name, []).append(line)
+                    self._lookups.pop(name, None)
+
+    def add(self, hostname, key):
+        """Adds a host key, hostname as paramiko names it (host or
+        [host]:port)"""
+        self.add_line("{0} {1} {2}".format(
+            hostname, key.get_name(), key.get_base64()))
+
+    def get(self, hostname):
+        """Returns a HostKeyMap of the keys known for hostname or None"""
+        with self._lock:
+            if hostname in self._lookups:
+                return self._lookups[hostname]
+            lines = list(self._plain.get(hostname, ()))
+            hashed = list(self._hashed)
+        lines.extend(
+            line for entry_hash, line in hashed
+            if HostKeys.hash_host(hostname, entry_hash) == entry_hash)
+        keys = HostKeyMap()
+        for line in lines:
+            try:
+                entry = HostKeyEntry.from_line(line)
+            except SSHException as e:
+                self._log.warning(e)
+                continue
+            if entry is not None and entry.key is not None:
+                keys.setdefault(entry.key.get_name(), entry.key)
+        keys = keys or None
+        with self._lock:
+            self._lookups[hostname] = keys
+        return keys
+
+    def check(self, hostname, key):
+        """Returns True if key is known for hostname, False if another key
+        is and None if the host is unknown"""
+        keys = self.get(hostname)
+        if keys is None:
+            return None
+        return keys.get(key.get_name()) == key
+
+    def add_policy(self):
+        """Returns a paramiko MissingHostKeyPolicy that trusts and stores the
+        key of hosts seen for the first time"""
+        return StoreMissingHostKeyPolicy(self)
+
+
+class StoreMissingHostKeyPolicy(MissingHostKeyPolicy):
+    def __init__(self, store):
+        self.store = store
+
+    def missing_host_key(self, client, hostname, key):
+        self.store.add(hostname, key)
+
+
+key_cache = KeyCache()
@@ -14,9 +14,20 @@ import six
 
 
 class BaseModel(object):
+    # subclasses without __slots__ still get a __dict__
+    __slots__ = ()
+    # slotted models list the attributes compared and printed
+    FIELDS = None
+
+    def _fields(self):
+        if self.FIELDS is None:
+            return list(vars(self).items())
+        return [(name, getattr(self, name)) for name in self.FIELDS]
+
     def __eq__(self, obj):
         try:
-            if type(obj) == type(self) and vars(obj) == vars(self):
+            if type(obj) == type(self) and (
+                    dict(obj._fields()) == dict(self._fields())):
                 return True
         except Exception:
             pass
@@ -27,8 +38,7 @@ class BaseModel(object):
 
     def __str__(self):
         string = "<{0} object>\n".format(type(self).__name__)
-        for key in list(vars(self).keys()):
-            val = getattr(self, key)
+        for key, val in self._fields():
             if isinstance(val, six.text_type):
                 string += "{0} = {1}\n".format(key, val.encode("utf-8"))
             else:
@@ -40,13 +50,178 @@ class BaseModel(object):
 
 
 class CommandResponse(BaseModel):
+    # decoded and spilled output is cached in one dict made on first use
+    __slots__ = ("stdin", "exit_status", "_stdout", "_stderr", "_decoded")
+    FIELDS = ("stdin", "stdout", "stderr", "exit_status")
+
     def __init__(
             self, stdin=None, stdout=None, stderr=None, exit_status=None):
+        """stdout and stderr are bytes, or a SpilledOutput for output that
+        was too big to keep in memory (the properties still return bytes,
+        use output() or stream() to avoid reading it all)
+
+        Spilled output is read once, on first use of stdout or stderr, and
+        text, stderr_text and lines are decoded once, on first use.
+        """
         self.stdin = stdin
         self.stdout = stdout
         self.stderr = stderr
         self.exit_status = exit_status
 
+    def _read(self, name, value):
+        if value is None or isinstance(value, bytes):
+            return value
+        return self._cached(name, value.read)
+
+    @property
+    def stdout(self):
+        return self._read("stdout", self._stdout)
+
+    @stdout.setter
+    def stdout(self, value):
+        self._stdout = value
+        self._decoded = None
+
+    @property
+    def stderr(self):
+        return self._read("stderr", self._stderr)
+
+    @stderr.setter
+    def stderr(self, value):
+        self._stderr = value
+        self._decoded = None
+
+    @property
+    def spilled(self):
+        """Whether any of the output lives in a temp file"""
+        return not all(
+            value is None or isinstance(value, bytes)
+            for value in (self._stdout, self._stderr))
+
+    def _cached(self, name, func):
+        if self._decoded is None:
+            self._decoded = {}
+        if name not in self._decoded:
+            self._decoded[name] = func()
+        return self._decoded[name]
+
+    @staticmethod
+    def _decode(value):
+        return None if value is None else value.decode("utf-8", "replace")
+
+    @property
+    def text(self):
+        """stdout decoded as UTF-8 (undecodable bytes replaced)"""
+        return self._cached("text", lambda: self._decode(self.stdout))
+
+    @property
+    def stderr_text(self):
+        return self._cached("stderr_text", lambda: self._decode(self.stderr))
+
+    @property
+    def lines(self):
+        """text split into lines, without the line endings"""
+        return self._cached(
+            "lines", lambda: None if self.text is None else (
+                self.text.splitlines()))
+
+    def output(self, name="stdout"):
+        """Returns stdout or stderr as held, bytes or a SpilledOutput"""
+        return self._stdout if name == "stdout" else self._stderr
+
+    def stream(self, name="stdout", chunk_size=32768):
+        """Yields stdout or stderr in chunk_size bytes pieces"""
+        value = self.output(name)
+        if value is None:
+            return
+        if not isinstance(value, bytes):
+            for chunk in value.stream(chunk_size):
+                yield chunk
+            return
+        for offset in range(0, len(value), chunk_size):
+            yield value[offset:offset + chunk_size]
+
+    def close(self):
+        """Deletes the temp files of spilled output"""
+        for value in (self._stdout, self._stderr):
+            if value is not None and not isinstance(value, bytes):
+                value.close()
+
+
+class TreeTransferResult(BaseModel):
+    def __init__(
+            self, files=None, errors=None, bytes_transferred=0, elapsed=0.0):
+        """Outcome of a put_tree or get_tree
+
+        files holds the relative paths copied, errors maps the relative path
+        of every file or directory that failed to its exception.
+        """
+        self.files = files if files is not None else []
+        self.errors = errors if errors is not None else {}
+        self.bytes_transferred = bytes_transferred
+        self.elapsed = elapsed
+
+    @property
+    def files_per_second(self):
+        return len(self.files) / self.elapsed if self.elapsed else 0.0
+
+
+class SyncReport(BaseModel):
+    def __init__(
+        self, new=None, changed=None, deleted=None, unchanged=0,
+            bytes_to_send=0, dry_run=False, errors=None, elapsed=0.0):
+        """What a sync copied and deleted, or would have with dry_run
+
+        new, changed and deleted hold relative paths, errors maps the
+        relative path of every file or directory that failed to its
+        exception.
+        """
+        self.new = new if new is not None else []
+        self.changed = changed if changed is not None else []
+        self.deleted = deleted if deleted is not None else []
+        self.unchanged = unchanged
+        self.bytes_to_send = bytes_to_send
+        self.dry_run = dry_run
+        self.errors = errors if errors is not None else {}
+        self.elapsed = elapsed
+
+
+class TimingEvent(BaseModel):
+    def __init__(
+        self, name=None, phases=None, counts=None, attributes=None,
+            total=0.0, error=None):
+        """Timings of one instrumented operation
+
+        phases is an ordered list of (phase, seconds), counts maps names like
+        bytes_in/bytes_out to numbers and attributes holds whatever
+        identifies the operation (hostname, command, path, ...).
+        """
+        self.name = name
+        self.phases = phases if phases is not None else []
+        self.counts = counts if counts is not None else {}
+        self.attributes = attributes if attributes is not None else {}
+        self.total = total
+        self.error = error
+
+
+class TailState(BaseModel):
+    def __init__(
+        self, path=None, offset=0, size=None, mtime=None, fingerprint=None,
+            fingerprint_size=0):
+        """Where tailing a remote file got to
+
+        offset is the next byte to read, size and mtime are from the last
+        stat (unchanged means nothing to read) and fingerprint is the sha1
+        hex of the first fingerprint_size bytes, which tells a rotated or
+        rewritten file from the one being read since sftp has no inodes.
+        """
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+        self.fingerprint_size = fingerprint_size
+
 
 class SSHKey(BaseModel):
     def __init__(self, public_key=None, private_key=None):
@@ -0,0 +1,89 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from io import BytesIO
+import mmap
+import tempfile
+
+from sshaolin import common
+
+
+class SpilledOutput(object):
+    def __init__(self, fp, size):
+        """Command output kept in an anonymous temp file instead of the heap
+
+        len() and slicing work like on bytes, slices are read through a read
+        only mmap of the file so only what is sliced is ever in memory.
+        """
+        self._file = fp
+        self._map = None
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.mmap()[index]
+
+    def __repr__(self):
+        return "<SpilledOutput {0} bytes>".format(self.size)
+
+    def mmap(self):
+        """Returns the read only mmap of the output, valid until close"""
+        if self._map is None:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self):
+        return self[:]
+
+    def stream(self, chunk_size=common.READ_SIZE):
+        """Yields the output in chunk_size bytes pieces"""
+        for offset in range(0, self.size, chunk_size):
+            yield self[offset:offset + chunk_size]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class OutputBuffer(object):
+    def __init__(self, spill_size=common.OUTPUT_SPILL_SIZE):
+        """File like sink that keeps output in memory up to spill_size bytes
+        and moves it to an anonymous temp file past that
+
+        :param int spill_size: Bytes kept in memory, None never spills
+        """
+        self.spill_size = spill_size
+        self.size = 0
+        self._buffer = BytesIO()
+        self._file = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file is None and (
+                self.spill_size is not None and self.size > self.spill_size):
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        (self._buffer if self._file is None else self._file).write(data)
+
+    def getvalue(self):
+        """Returns the output as bytes, or as a SpilledOutput once it has
+        spilled"""
+        if self._file is None:
+            return self._buffer.getvalue()
+        self._file.flush()
+        return SpilledOutput(self._file, self.size)
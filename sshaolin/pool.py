@@ -0,0 +1,141 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import threading
+import time
+
+from sshaolin import common
+
+
+def is_alive(connection):
+    """Returns True if the connection has an active authenticated transport
+
+    :param connection: A paramiko SSHClient (or subclass)
+    """
+    transport = connection.get_transport()
+    if transport is None:
+        return False
+    return bool(transport.is_active() and transport.is_authenticated())
+
+
+class ConnectionPool(common.BaseSSHClass):
+    def __init__(
+        self, max_idle_time=common.POOL_MAX_IDLE_TIME,
+            max_size=common.POOL_MAX_SIZE):
+        """Keeps authenticated connections around for reuse
+
+        Connections are stored per key (normally the merged connect kwargs of
+        an SSHClient) and are checked out for the duration of one command.
+        Every command still opens its own session channel on the pooled
+        transport.
+
+        :param float max_idle_time: Seconds an idle connection is kept before
+                                    it is evicted
+        :param int max_size: Max idle connections kept per key
+        """
+        super(ConnectionPool, self).__init__()
+        self.max_idle_time = max_idle_time
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        """Returns an idle connection for key or creates one with factory
+
+        :param key: Hashable pool key
+        :param callable factory: Called with no args to create a connection
+        """
+        stale = []
+        connection = None
+        with self._lock:
+            entries = self._idle.get(key, [])
+            while entries:
+                last_used, candidate = entries.pop()
+                expired = time.time() - last_used > self.max_idle_time
+                if expired or not is_alive(candidate):
+                    stale.append(candidate)
+                    continue
+                connection = candidate
+                break
+            if not entries:
+                self._idle.pop(key, None)
+            self.evictions += len(stale)
+            if connection is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._close_all(stale)
+        return connection if connection is not None else factory()
+
+    def release(self, key, connection):
+        """Returns a connection to the pool, closing it if it can't be kept
+
+        :param key: Hashable pool key the connection was acquired with
+        :param connection: Connection returned by acquire
+        """
+        if is_alive(connection):
+            with self._lock:
+                entries = self._idle.setdefault(key, [])
+                if len(entries) < self.max_size:
+                    entries.append((time.time(), connection))
+                    return
+        connection.close()
+
+    def evict_idle(self):
+        """Closes every connection that has been idle past max_idle_time"""
+        stale = []
+        now = time.time()
+        with self._lock:
+            for key, entries in list(self._idle.items()):
+                keep = []
+                for last_used, connection in entries:
+                    if now - last_used > self.max_idle_time:
+                        stale.append(connection)
+                    else:
+                        keep.append((last_used, connection))
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+            self.evictions += len(stale)
+        self._close_all(stale)
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._idle.values())
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "size": self.size}
+
+    def close(self):
+        if not hasattr(self, "_idle"):
+            return
+        with self._lock:
+            connections = [
+                connection for entries in self._idle.values()
+                for _, connection in entries]
+            self._idle = {}
+        self._close_all(connections)
+
+    def _close_all(self, connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception as e:
+                self._log.warning(e)
@@ -14,13 +14,21 @@ import os
 import signal
 import subprocess
 
+from sshaolin.client import SSHClient
 from sshaolin.common import BaseSSHClass
 
 
 class SSHProxy(BaseSSHClass):
     def __init__(
         self, hostname=None, port=22, username=None, compress=True,
-            look_for_keys=False, key_filename=None):
+            look_for_keys=False, key_filename=None, native=False):
+        """
+        :param bool native: Run the forwards in process over one paramiko
+                            transport per server instead of an ssh process
+                            per forward.  Native forwards bind to localhost
+                            unless given an address and are listening when
+                            they are returned.
+        """
         super(SSHProxy, self).__init__()
         self.hostname = hostname
         self.port = port
@@ -28,6 +36,29 @@ class SSHProxy(BaseSSHClass):
         self.compress = compress
         self.look_for_keys = look_for_keys
         self.key_filename = key_filename
+        self.native = native
+        self._forwarders = {}
+
+    def _get_forwarder(
+        self, hostname=None, port=None, username=None, compress=None,
+            look_for_keys=None, key_filename=None):
+        """Returns the ForwardingEngine for these settings, connecting the
+        first time they are used"""
+        kwargs = {
+            "hostname": hostname or self.hostname,
+            "port": port or self.port,
+            "username": username or self.username,
+            "compress": compress if compress is not None else self.compress,
+            "look_for_keys": (
+                look_for_keys if look_for_keys is not None
+                else self.look_for_keys),
+            "key_filename": key_filename or self.key_filename}
+        key = tuple(sorted(kwargs.items()))
+        forwarder = self._forwarders.get(key)
+        if forwarder is None:
+            forwarder = self._forwarders[key] = SSHClient(
+                **kwargs).create_forwarder()
+        return forwarder
 
     def _get_args(
         self, hostname=None, port=None, username=None, compress=None,
@@ -62,8 +93,12 @@ class SSHProxy(BaseSSHClass):
         """
         Warning: This can be a security issue for long running tunnels because
         bind_address does not work like ssh, instead it default to binding
-        on every interface.  SSH defaults to binding to localhost.
+        on every interface.  SSH defaults to binding to localhost.  Native
+        forwards bind to localhost like ssh.
         """
+        if self.native:
+            return self._get_forwarder(**connect_kwargs).create_forward_port(
+                port, forward_address, forward_port, address, remote)
         args = self._get_args(**connect_kwargs)
         remote_flag = "R" if remote else "L"
         args.append("-{0}{1}:{2}:{3}:{4}".format(
@@ -75,11 +110,21 @@ class SSHProxy(BaseSSHClass):
         return PortForward(proc.pid, address=address, port=port)
 
     def create_socks_proxy(self, port, address=None, **connect_kwargs):
+        if self.native:
+            return self._get_forwarder(**connect_kwargs).create_socks_proxy(
+                port, address)
         args = self._get_args(**connect_kwargs)
         args.append("-D{0}:{1}".format(address or "0.0.0.0", port))
         proc = subprocess.Popen(args, preexec_fn=os.setsid)
         return SocksProxy(proc.pid, port=port or "localhost", address=address)
 
+    def close_forwarders(self):
+        """Closes the native forwarders and every forward on them (like ssh
+        processes they outlive the SSHProxy unless closed)"""
+        forwarders, self._forwarders = getattr(self, "_forwarders", {}), {}
+        for forwarder in forwarders.values():
+            forwarder.close()
+
 
 class PortForward(BaseSSHClass):
     TYPE = "PORT_FORWARD"
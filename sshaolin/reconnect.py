@@ -0,0 +1,80 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import random
+import time
+
+from sshaolin import common
+
+
+class Reconnector(common.BaseSSHClass):
+    def __init__(
+        self, connect, max_attempts=common.RECONNECT_MAX_ATTEMPTS,
+        backoff=common.RECONNECT_BACKOFF,
+            max_backoff=common.RECONNECT_MAX_BACKOFF):
+        """Makes new connections for a shell whose connection died
+
+        Failed attempts are retried after backoff * 2 ** attempt seconds
+        (capped at max_backoff, with jitter) up to max_attempts times.
+
+        :param callable connect: Returns a new connected paramiko client
+        """
+        super(Reconnector, self).__init__()
+        self.connect = connect
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.recovery_time = 0.0
+        self.last_error = None
+
+    @property
+    def stats(self):
+        return {
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failed_attempts,
+            "recovery_time": self.recovery_time}
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.random() * delay / 2
+
+    def reconnect(self, restore):
+        """Connects and calls restore(connection) until both work, returns
+        the connection
+
+        An attempt whose restore raises counts as failed and its connection
+        is closed.  The last error is raised after max_attempts.
+        """
+        started = time.time()
+        try:
+            for attempt in range(self.max_attempts):
+                connection = None
+                try:
+                    connection = self.connect()
+                    restore(connection)
+                except Exception as e:
+                    self.failed_attempts += 1
+                    self.last_error = e
+                    self._log.warning(
+                        "reconnect attempt %d failed: %r", attempt + 1, e)
+                    if connection is not None:
+                        connection.close()
+                    if attempt + 1 < self.max_attempts:
+                        time.sleep(self.delay(attempt))
+                    continue
+                self.reconnects += 1
+                return connection
+            raise self.last_error
+        finally:
+            self.recovery_time += time.time() - started
@@ -0,0 +1,209 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import errno
+import hashlib
+import json
+import os
+import time
+
+from sshaolin import common
+from sshaolin.models import TailState
+from sshaolin.transfer import iter_remote_chunks
+
+
+def fingerprint(prefix):
+    return hashlib.sha1(prefix).hexdigest()
+
+
+def replace_file(src, dst):
+    # os.replace is python 3 only, rename only overwrites on posix
+    getattr(os, "replace", os.rename)(src, dst)
+
+
+class LogTailer(common.BaseSSHClass):
+    def __init__(
+        self, sftp, paths=(), state_file=None, from_start=False, lines=False,
+        rotated_suffix=".1", chunk_size=common.SFTP_CHUNK_SIZE,
+            prefetch=common.SFTP_PREFETCH_CHUNKS):
+        """Follows remote files over one sftp channel, like tail -F
+
+        Each poll stats every file and only reads the bytes appended since
+        the last one, so a quiet file costs one stat.  A file that shrank or
+        whose first bytes changed was truncated or rotated, what was left of
+        the old file is read from path + rotated_suffix (when it is there)
+        before reading the new one from its start.
+
+        :param sftp: SFTPClient (or SFTPShell) every file is read on
+        :param str state_file: Local JSON file the offsets are loaded from
+                               and saved to, so a restart resumes
+        :param bool from_start: Read files that aren't in the state from
+                                their start instead of their current end
+        :param bool lines: Only yield whole lines, a partial last line waits
+                           for the rest of it
+        :param str rotated_suffix: Name of the rotated file relative to the
+                                   current one, None to not look for it
+        """
+        super(LogTailer, self).__init__()
+        self.sftp = sftp
+        self.state_file = state_file
+        self.from_start = from_start
+        self.lines = lines
+        self.rotated_suffix = rotated_suffix
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.states = self._load()
+        for path in paths:
+            self.add(path)
+
+    @property
+    def offsets(self):
+        return dict(
+            (path, state.offset) for path, state in self.states.items())
+
+    def add(self, path):
+        """Starts following path, files already in the state resume"""
+        if path in self.states:
+            return
+        state = self.states[path] = TailState(path)
+        attr = self._stat(path)
+        if attr is None or self.from_start:
+            return
+        with self.sftp.open(path, "rb") as fp:
+            self._update_fingerprint(state, self._read_prefix(fp, attr))
+        state.offset, state.size, state.mtime = (
+            attr.st_size, attr.st_size, attr.st_mtime)
+
+    def remove(self, path):
+        self.states.pop(path, None)
+
+    def poll(self):
+        """Yields (path, bytes) for everything appended since the last poll
+
+        A file's offset moves past a chunk once the next one is asked for,
+        so a chunk the caller didn't get to is read again.
+        """
+        for path in list(self.states):
+            for data in self._poll_file(self.states[path]):
+                yield path, data
+
+    def follow(self, interval=common.TAIL_INTERVAL, timeout=None):
+        """Polls every interval seconds, yielding (path, bytes), and saves
+        the state after each poll
+
+        :param float timeout: Stop after this many seconds, None never stops
+        """
+        max_time = None if timeout is None else time.time() + timeout
+        while True:
+            for item in self.poll():
+                yield item
+            self.save()
+            if max_time is not None and time.time() + interval > max_time:
+                return
+            time.sleep(interval)
+
+    def save(self):
+        """Writes the state to state_file (atomically) if there is one"""
+        if self.state_file is None:
+            return
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(
+                dict((path, vars(state)) for path, state in
+                     self.states.items()), fp, sort_keys=True)
+        replace_file(tmp_path, self.state_file)
+
+    def _load(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as fp:
+            return dict(
+                (path, TailState(**state))
+                for path, state in json.load(fp).items())
+
+    def _stat(self, path):
+        try:
+            return self.sftp.stat(path)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def _read_prefix(self, fp, attr):
+        size = min(attr.st_size, common.TAIL_FINGERPRINT_SIZE)
+        return b"".join(fp.readv([(0, size)])) if size else b""
+
+    @staticmethod
+    def _matches(state, prefix):
+        return len(prefix) >= state.fingerprint_size and (
+            not state.fingerprint_size or fingerprint(
+                prefix[:state.fingerprint_size]) == state.fingerprint)
+
+    @staticmethod
+    def _update_fingerprint(state, prefix):
+        if len(prefix) > state.fingerprint_size:
+            state.fingerprint = fingerprint(prefix)
+            state.fingerprint_size = len(prefix)
+
+    def _poll_file(self, state):
+        attr = self._stat(state.path)
+        if attr is None:
+            # rotated away and not created again yet
+            if state.fingerprint_size:
+                for data in self._drain_rotated(state):
+                    yield data
+                self.states[state.path] = TailState(state.path)
+            return
+        if (attr.st_size, attr.st_mtime) == (state.size, state.mtime):
+            return
+        with self.sftp.open(state.path, "rb") as fp:
+            prefix = self._read_prefix(fp, attr)
+            if attr.st_size < state.offset or not self._matches(
+                    state, prefix):
+                for data in self._drain_rotated(state):
+                    yield data
+                state = self.states[state.path] = TailState(state.path)
+            self._update_fingerprint(state, prefix)
+            for data in self._read(fp, state, attr.st_size, self.lines):
+                yield data
+        state.size, state.mtime = attr.st_size, attr.st_mtime
+
+    def _drain_rotated(self, state):
+        """Yields the rest of the file state was reading if it was rotated
+        to path + rotated_suffix"""
+        if not self.rotated_suffix:
+            return
+        path = state.path + self.rotated_suffix
+        attr = self._stat(path)
+        if attr is None or attr.st_size <= state.offset:
+            return
+        with self.sftp.open(path, "rb") as fp:
+            if not self._matches(state, self._read_prefix(fp, attr)):
+                return
+            # the rotated file is done, its partial last line is all of it
+            for data in self._read(fp, state, attr.st_size, False):
+                yield data
+
+    def _read(self, fp, state, size, lines):
+        partial = b""
+        for data in iter_remote_chunks(
+                fp, size, self.chunk_size, self.prefetch, state.offset):
+            if lines:
+                data = partial + data
+                end = data.rfind(b"\n") + 1
+                if not end and len(data) < common.MAX_LINE_LENGTH:
+                    partial = data
+                    continue
+                data, partial = (data, b"") if not end else (
+                    data[:end], data[end:])
+            yield data
+            state.offset += len(data)
@@ -0,0 +1,419 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from six.moves import queue
+import errno
+import hashlib
+import io
+import mmap
+import os
+import posixpath
+import stat
+import threading
+import time
+
+from sshaolin import common
+from sshaolin.models import SyncReport, TreeTransferResult
+
+
+def remote_makedir(sftp, path):
+    """Creates a remote directory, an existing directory is not an error"""
+    try:
+        sftp.mkdir(path)
+    except IOError:
+        try:
+            is_dir = stat.S_ISDIR(sftp.stat(path).st_mode)
+        except IOError:
+            is_dir = False
+        if not is_dir:
+            raise
+
+
+def walk_local(local_dir):
+    """Returns (dirs, files) of local_dir with "/" separated relative paths
+    and files as {rel: os.stat_result}, the root is the "" dir"""
+    dirs, files = [""], {}
+    for root, dirnames, filenames in os.walk(local_dir):
+        rel_root = os.path.relpath(root, local_dir).replace(os.sep, "/")
+        rel_root = "" if rel_root == os.curdir else rel_root
+        dirs.extend(posixpath.join(rel_root, name) for name in dirnames)
+        for name in filenames:
+            files[posixpath.join(rel_root, name)] = os.stat(
+                os.path.join(root, name))
+    return dirs, files
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(common.READ_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_remote_chunks(
+    fp, size, chunk_size=common.SFTP_CHUNK_SIZE,
+        prefetch=common.SFTP_PREFETCH_CHUNKS, offset=0):
+    """Yields bytes offset to size of an open paramiko SFTPFile in chunks
+
+    Reads are pipelined prefetch chunks (window) at a time so at most
+    chunk_size * prefetch bytes are buffered however big the file is.
+    """
+    window = chunk_size * prefetch
+    for start in range(offset, size, window):
+        end = min(start + window, size)
+        for data in fp.readv([
+                (chunk_start, min(chunk_size, end - chunk_start))
+                for chunk_start in range(start, end, chunk_size)]):
+            if not data:
+                return
+            yield data
+
+
+def release_view(view):
+    # memoryview.release is python 3 only, python 2 frees it when collected
+    release = getattr(view, "release", None)
+    if release is not None:
+        release()
+
+
+def is_bytes_like(obj):
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        return False
+    release_view(view)
+    return True
+
+
+def fd_writer(target):
+    """Returns a write function for a file object or a file descriptor"""
+    if not isinstance(target, int):
+        return target.write
+
+    def write(data):
+        view = memoryview(data)
+        while len(view):
+            view = view[os.write(target, view):]
+    return write
+
+
+def map_source(source):
+    """Returns a read only mmap of the rest of a regular file (file object
+    or descriptor) and its start offset, or (None, None)"""
+    try:
+        fd = source if isinstance(source, int) else source.fileno()
+        offset = os.lseek(fd, 0, os.SEEK_CUR)
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            return None, None
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ), offset
+    except (
+            AttributeError, EnvironmentError, ValueError,
+            io.UnsupportedOperation):
+        return None, None
+
+
+def write_source(fp, source, chunk_size=common.SFTP_CHUNK_SIZE):
+    """Writes source to an open paramiko SFTPFile (or anything with a
+    write method), returns the byte count
+
+    source is a bytes like object, a file object, a file descriptor or an
+    iterable of bytes.  Bytes like objects and regular files (memory mapped)
+    are written as memoryview slices, other files through one reused
+    chunk_size buffer and iterables a chunk at a time.
+    """
+    if isinstance(source, int) or hasattr(source, "read"):
+        mapped, offset = map_source(source)
+        if mapped is None:
+            return write_stream(fp, source, chunk_size)
+        try:
+            return write_view(fp, mapped, offset, chunk_size)
+        finally:
+            mapped.close()
+    if not is_bytes_like(source):
+        return write_iter(fp, source)
+    return write_view(fp, source, 0, chunk_size)
+
+
+def write_iter(fp, chunks):
+    total = 0
+    for data in chunks:
+        fp.write(data)
+        total += len(data)
+    return total
+
+
+def write_view(fp, data, offset, chunk_size):
+    view = memoryview(data)
+    try:
+        for start in range(offset, len(view), chunk_size):
+            fp.write(view[start:start + chunk_size])
+        return max(len(view) - offset, 0)
+    finally:
+        release_view(view)
+
+
+def write_stream(fp, source, chunk_size):
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    total = 0
+    while True:
+        if isinstance(source, int):
+            data = os.read(source, chunk_size)
+            count = len(data)
+        elif hasattr(source, "readinto"):
+            count = source.readinto(buf)
+            data = view[:count]
+        else:
+            data = source.read(chunk_size)
+            count = len(data)
+        if not count:
+            return total
+        fp.write(data)
+        total += count
+
+
+def depth(path):
+    return path.count("/") if path else -1
+
+
+def remote_join(remote_dir, rel):
+    return posixpath.join(remote_dir, rel) if rel else remote_dir
+
+
+def local_join(local_dir, rel):
+    return os.path.join(local_dir, *rel.split("/")) if rel else local_dir
+
+
+class TreeTransfer(common.BaseSSHClass):
+    def __init__(self, sftp_clients, callback=None):
+        """Copies directory trees with one worker thread per SFTP client
+
+        Synchronous requests on one paramiko SFTP client can't be shared
+        between threads so every worker gets its own client (normally an SFTP
+        channel on the same transport).  Within a file paramiko pipelines the
+        writes of put and prefetches the reads of get, directories are created
+        or listed a whole level at a time across the workers.
+
+        :param list sftp_clients: paramiko SFTPClient instances
+        :param callable callback: Called as callback(path, size, error) from
+                                  a worker thread when a file is done, path is
+                                  relative to the tree root and error is None
+                                  on success
+        """
+        super(TreeTransfer, self).__init__()
+        self.sftp_clients = list(sftp_clients)
+        self.callback = callback
+
+    def put_tree(self, local_dir, remote_dir):
+        """Copies local_dir to remote_dir and returns a TreeTransferResult"""
+        start = time.time()
+        dirs, files = walk_local(local_dir)
+        result = TreeTransferResult()
+        self._put(local_dir, remote_dir, dirs, files, result)
+        result.elapsed = time.time() - start
+        return result
+
+    def get_tree(self, remote_dir, local_dir):
+        """Copies remote_dir to local_dir and returns a TreeTransferResult"""
+        start = time.time()
+        result = TreeTransferResult()
+        dirs, files = self._walk_remote(remote_dir, result.errors)
+        for rel in dirs:
+            local_path = local_join(local_dir, rel)
+            if not os.path.isdir(local_path):
+                os.makedirs(local_path)
+
+        def get(sftp, rel):
+            sftp.get(
+                remote_join(remote_dir, rel), local_join(local_dir, rel))
+        self._transfer(
+            get, [(rel, attr.st_size) for rel, attr in files.items()],
+            result)
+        result.elapsed = time.time() - start
+        return result
+
+    def sync(
+        self, local_dir, remote_dir, remote_hashes=None, delete=False,
+            dry_run=False):
+        """Copies the new and changed files of local_dir to remote_dir and
+        returns a SyncReport
+
+        A file has changed when its size or mtime (whole seconds) differ,
+        copied files get the local mtime so the next sync can skip them.
+
+        :param callable remote_hashes: Called with a list of remote paths,
+                                       returns {remote path: sha256 hex}.
+                                       When given files of the same size are
+                                       compared by content instead of mtime
+        :param bool delete: Remove remote files and directories that aren't
+                            in local_dir
+        :param bool dry_run: Only report what would be copied and deleted
+        """
+        start = time.time()
+        report = SyncReport(dry_run=dry_run)
+        dirs, files = walk_local(local_dir)
+        remote_dirs, remote_files = self._walk_remote(
+            remote_dir, report.errors)
+        missing = report.errors.get("")
+        if getattr(missing, "errno", None) == errno.ENOENT:
+            del report.errors[""]
+        same_size = [
+            rel for rel, attr in files.items()
+            if getattr(remote_files.get(rel), "st_size", None) == attr.st_size]
+        if remote_hashes is None:
+            unchanged = set(
+                rel for rel in same_size
+                if int(files[rel].st_mtime) == remote_files[rel].st_mtime)
+        else:
+            paths = dict(
+                (rel, remote_join(remote_dir, rel)) for rel in same_size)
+            hashes = remote_hashes(list(paths.values()))
+            unchanged = set(
+                rel for rel, path in paths.items()
+                if hashes.get(path) == file_sha256(local_join(local_dir, rel)))
+        for rel in sorted(files):
+            if rel not in remote_files:
+                report.new.append(rel)
+            elif rel not in unchanged:
+                report.changed.append(rel)
+        report.unchanged = len(unchanged)
+        report.bytes_to_send = sum(
+            files[rel].st_size for rel in report.new + report.changed)
+        if delete:
+            report.deleted = sorted(
+                set(remote_files) - set(files)) + sorted(
+                set(remote_dirs) - set(dirs), key=depth, reverse=True)
+        if not dry_run:
+            self._delete(remote_dir, report.deleted, remote_dirs, report)
+            result = TreeTransferResult()
+            self._put(
+                local_dir, remote_dir,
+                [rel for rel in dirs if rel not in remote_dirs],
+                dict((rel, files[rel]) for rel in report.new + report.changed),
+                result, preserve_times=True)
+            report.errors.update(result.errors)
+        report.elapsed = time.time() - start
+        return report
+
+    def _put(
+        self, local_dir, remote_dir, dirs, files, result,
+            preserve_times=False):
+        """Creates dirs then copies files ({rel: os.stat_result})"""
+        for level in self._levels(dirs):
+            _, errors = self._run(
+                lambda sftp, rel: remote_makedir(
+                    sftp, remote_join(remote_dir, rel)), level)
+            result.errors.update(errors)
+
+        def put(sftp, rel):
+            remote_path = remote_join(remote_dir, rel)
+            sftp.put(local_join(local_dir, rel), remote_path, confirm=False)
+            if preserve_times:
+                sftp.utime(
+                    remote_path, (files[rel].st_atime, files[rel].st_mtime))
+        self._transfer(
+            put, [(rel, attr.st_size) for rel, attr in files.items()],
+            result)
+
+    def _delete(self, remote_dir, paths, remote_dirs, report):
+        """Removes remote files, then directories deepest first"""
+        remote_dirs = set(remote_dirs)
+        _, errors = self._run(
+            lambda sftp, rel: sftp.remove(remote_join(remote_dir, rel)),
+            [rel for rel in paths if rel not in remote_dirs])
+        report.errors.update(errors)
+        dirs = [rel for rel in paths if rel in remote_dirs]
+        for level in reversed(self._levels(dirs)):
+            _, errors = self._run(
+                lambda sftp, rel: sftp.rmdir(remote_join(remote_dir, rel)),
+                level)
+            report.errors.update(errors)
+
+    def _walk_remote(self, remote_dir, errors):
+        """Lists remote_dir a level at a time, returns (dirs, files) with
+        files as {rel: SFTPAttributes}"""
+        dirs, files, level = [], {}, [""]
+        while level:
+            listings, level_errors = self._run(
+                lambda sftp, rel: sftp.listdir_attr(
+                    remote_join(remote_dir, rel)), level)
+            errors.update(level_errors)
+            level = []
+            for rel, attrs in listings.items():
+                dirs.append(rel)
+                for attr in attrs:
+                    path = posixpath.join(rel, attr.filename)
+                    if stat.S_ISDIR(attr.st_mode):
+                        level.append(path)
+                    else:
+                        files[path] = attr
+        return dirs, files
+
+    @staticmethod
+    def _levels(dirs):
+        levels = {}
+        for path in dirs:
+            levels.setdefault(depth(path), []).append(path)
+        return [levels[key] for key in sorted(levels)]
+
+    def _transfer(self, func, files, result):
+        sizes = dict(files)
+        lock = threading.Lock()
+
+        def on_done(rel, error):
+            with lock:
+                if error is None:
+                    result.files.append(rel)
+                    result.bytes_transferred += sizes[rel]
+                else:
+                    result.errors[rel] = error
+            if self.callback is not None:
+                self.callback(rel, sizes[rel], error)
+
+        # largest first so a big file doesn't start last and run alone
+        self._run(
+            func, [rel for rel, _ in sorted(files, key=lambda f: -f[1])],
+            on_done)
+
+    def _run(self, func, items, on_done=None):
+        """Calls func(sftp, item) for every item on the worker threads and
+        returns ({item: return value}, {item: exception})"""
+        tasks = queue.Queue()
+        for item in items:
+            tasks.put(item)
+        results, errors = {}, {}
+
+        def worker(sftp):
+            while True:
+                try:
+                    item = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                error = None
+                try:
+                    results[item] = func(sftp, item)
+                except Exception as e:
+                    self._log.error(e)
+                    error = errors[item] = e
+                if on_done is not None:
+                    on_done(item, error)
+
+        threads = [
+            threading.Thread(target=worker, args=(sftp,))
+            for sftp in self.sftp_clients[:max(len(items), 1)]]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
@@ -0,0 +1,167 @@
+# Copyright 2016 Nathan Buckner
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from collections import namedtuple
+import socket
+import threading
+
+from sshaolin import common
+
+AUTO = "auto"
+
+TransportProfile = namedtuple(
+    "TransportProfile", "compress ciphers digests kex window_size nodelay")
+
+# paramiko has no AES-GCM or ChaCha20, AES-CTR runs on AES-NI through
+# openssl and is the fastest cipher it offers
+FAST_CIPHERS = ("aes128-ctr", "aes256-ctr")
+FAST_DIGESTS = ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256")
+FAST_KEX = ("curve25519-sha256@libssh.org", "ecdh-sha2-nistp256")
+
+DEFAULT_PROFILE = TransportProfile(
+    compress=None, ciphers=(), digests=(), kex=(), window_size=None,
+    nodelay=True)
+
+PROFILES = {
+    # zlib is slower than the network, don't compress
+    "lan-throughput": TransportProfile(
+        compress=False, ciphers=FAST_CIPHERS, digests=FAST_DIGESTS,
+        kex=FAST_KEX, window_size=None, nodelay=True),
+    # compress and keep a bigger window in flight for the long round trips
+    "wan": TransportProfile(
+        compress=True, ciphers=FAST_CIPHERS, digests=FAST_DIGESTS,
+        kex=FAST_KEX, window_size=common.WAN_WINDOW_SIZE, nodelay=True),
+    # the cheapest of everything, elliptic curve kex instead of big DH groups
+    "low-cpu": TransportProfile(
+        compress=False, ciphers=("aes128-ctr",),
+        digests=("hmac-sha1", "hmac-sha2-256"),
+        kex=("ecdh-sha2-nistp256", "curve25519-sha256@libssh.org"),
+        window_size=None, nodelay=True)}
+
+
+def resolve(profile=None, compress=None, ciphers=None, digests=None,
+            kex=None):
+    """Returns the TransportProfile for a profile name (or a profile) with
+    any explicitly given setting replacing the profile's
+
+    :param profile: A PROFILES name, a TransportProfile or None
+    :param compress: True, False or AUTO
+    :param list ciphers: Cipher names, most preferred first
+    :param list digests: MAC names, most preferred first
+    :param list kex: Key exchange names, most preferred first
+    """
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    elif not isinstance(profile, TransportProfile):
+        if profile not in PROFILES:
+            raise ValueError(
+                "Unknown transport profile {0}, expected one of {1}".format(
+                    profile, ", ".join(sorted(PROFILES))))
+        profile = PROFILES[profile]
+    overrides = {
+        "compress": compress, "ciphers": ciphers, "digests": digests,
+        "kex": kex}
+    return profile._replace(**dict(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in overrides.items() if v is not None))
+
+
+def prefer(available, preferred):
+    """Returns available reordered with preferred first
+
+    Names this paramiko doesn't know are skipped and the rest of available
+    is kept after them, so a server without any of them still negotiates.
+    """
+    first = [name for name in preferred if name in available]
+    return tuple(first + [name for name in available if name not in first])
+
+
+def set_nodelay(sock):
+    """Turns off Nagle on a TCP socket, anything else (a jump host channel,
+    a unix socket) is left alone"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, socket.error, OSError):
+        return False
+    return True
+
+
+def apply(profile, transport):
+    """Sets the algorithm preferences, window size and TCP_NODELAY of
+    profile on a paramiko Transport that hasn't started negotiating yet
+
+    Compression is set by paramiko's connect from its compress argument.
+    """
+    options = transport.get_security_options()
+    for name in ("ciphers", "digests", "kex"):
+        preferred = getattr(profile, name)
+        if preferred:
+            setattr(options, name, prefer(getattr(options, name), preferred))
+    if profile.window_size:
+        transport.default_window_size = profile.window_size
+    if profile.nodelay:
+        set_nodelay(transport.sock)
+
+
+class LinkEstimator(common.BaseSSHClass):
+    def __init__(self, weight=0.5):
+        """Remembers how fast each (hostname, port) has been, for
+        compress="auto"
+
+        Round trip times come from the TCP connect and throughput from sftp
+        transfers of at least AUTO_MIN_SAMPLE_SIZE bytes, both as moving
+        averages where the newest sample counts for weight.
+        """
+        super(LinkEstimator, self).__init__()
+        self.weight = weight
+        self._rtt = {}
+        self._throughput = {}
+        self._lock = threading.Lock()
+
+    def _update(self, samples, link, value):
+        with self._lock:
+            old = samples.get(link)
+            samples[link] = value if old is None else (
+                self.weight * value + (1 - self.weight) * old)
+
+    def record_rtt(self, link, seconds):
+        self._update(self._rtt, link, seconds)
+
+    def record_transfer(self, link, size, seconds):
+        if size >= common.AUTO_MIN_SAMPLE_SIZE and seconds > 0:
+            self._update(self._throughput, link, size / float(seconds))
+
+    def get(self, link):
+        """Returns (rtt seconds, bytes per second), None where unknown"""
+        with self._lock:
+            return self._rtt.get(link), self._throughput.get(link)
+
+    def compress(self, link):
+        """Whether a new connection to link should be compressed
+
+        Measured throughput decides when there is any: compress below
+        AUTO_COMPRESS_BANDWIDTH bytes per second, where zlib is faster than
+        the link.  Otherwise links slower than AUTO_COMPRESS_RTT to connect
+        to are assumed to be WAN links and compressed.
+        """
+        rtt, throughput = self.get(link)
+        if throughput is not None:
+            return throughput < common.AUTO_COMPRESS_BANDWIDTH
+        return rtt is not None and rtt > common.AUTO_COMPRESS_RTT
+
+    def clear(self):
+        with self._lock:
+            self._rtt.clear()
+            self._throughput.clear()
+
+
+links = LinkEstimator()
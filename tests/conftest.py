@@ -0,0 +1,4 @@
+import sys
+
+# sshaolin.aio and its tests are async/await code, a SyntaxError before 3.5
+collect_ignore = [] if sys.version_info >= (3, 5) else ["test_aio.py"]
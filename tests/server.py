@@ -0,0 +1,408 @@
+"""In process paramiko ssh server for tests and benchmarks that can't rely on
+a local sshd
+
+Accepts any password, runs exec requests through a handler (the local shell
+by default), runs shell requests on a local bash, serves sftp on the local
+filesystem and opens direct-tcpip channels to wherever they point.  Latency
+and bandwidth can be added to every connection to stand in for a real
+network.
+"""
+import collections
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import paramiko
+
+_host_key = []
+
+
+def host_key():
+    if not _host_key:
+        _host_key.append(paramiko.RSAKey.generate(1024))
+    return _host_key[0]
+
+
+def run_command(command):
+    proc = subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    return stdout, stderr, proc.returncode
+
+
+def pump(src, dst):
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            dst.sendall(data)
+    except (socket.error, EOFError):
+        pass
+    finally:
+        dst.close()
+        src.close()
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class ShapedSocket(object):
+    def __init__(self, sock, latency=0.0, bandwidth=None):
+        """Server side socket that delays what it sends by latency seconds
+        (so a round trip costs at least latency) and paces both directions
+        to bandwidth bytes per second"""
+        self.sock = sock
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._queue = collections.deque()
+        self._ready = threading.Condition()
+        self._closed = False
+        self._recv_at = time.time()
+        start(self._send_loop)
+
+    def _pace(self, started, size):
+        # returns when size bytes at bandwidth would be done since started
+        if not self.bandwidth:
+            return started
+        done = max(started, time.time()) + float(size) / self.bandwidth
+        delay = done - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return done
+
+    def _send_loop(self):
+        sent_at = time.time()
+        while True:
+            with self._ready:
+                while not self._queue and not self._closed:
+                    self._ready.wait()
+                if not self._queue:
+                    return
+                due, data = self._queue.popleft()
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            sent_at = self._pace(sent_at, len(data))
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                return
+
+    def send(self, data):
+        with self._ready:
+            self._queue.append((time.time() + self.latency, bytes(data)))
+            self._ready.notify()
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        self._recv_at = self._pace(self._recv_at, len(data))
+        return data
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self.sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class LocalSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return LocalSFTPServer.set_attrs(self.filename, attr)
+
+
+class LocalSFTPServer(paramiko.SFTPServerInterface):
+    """sftp on the local filesystem, paths are used as given"""
+
+    @staticmethod
+    def set_attrs(path, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(path, attr)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.abspath(path)
+
+    def list_folder(self, path):
+        try:
+            attrs = []
+            for name in os.listdir(path):
+                attr = paramiko.SFTPAttributes.from_stat(
+                    os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                attrs.append(attr)
+            return attrs
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        fp = os.fdopen(fd, mode)
+        handle = LocalSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = fp
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        return self.set_attrs(path, attr)
+
+    def symlink(self, target_path, path):
+        return self._call(os.symlink, target_path, path)
+
+    def readlink(self, path):
+        try:
+            return os.readlink(path)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class Server(paramiko.ServerInterface):
+    def __init__(
+            self, handler, max_sessions=None, pipe_stdin=False,
+            rejected_commands=()):
+        self.handler = handler
+        self.pipe_stdin = pipe_stdin
+        self.rejected_commands = rejected_commands
+        self.max_sessions = max_sessions
+        self.sessions = set()
+        self.peak_sessions = 0
+        self.destinations = {}
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            if self.max_sessions and len(self.sessions) >= self.max_sessions:
+                return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+            self.sessions.add(chanid)
+            self.peak_sessions = max(self.peak_sessions, len(self.sessions))
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        if command.decode("utf-8") in self.rejected_commands:
+            return False
+        if self.pipe_stdin:
+            start(self.run, channel, ["bash", "-c", command])
+        else:
+            start(self.execute, channel, command)
+        return True
+
+    def check_channel_shell_request(self, channel):
+        start(self.shell, channel)
+        return True
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def execute(self, channel, command):
+        # the client only writes stdin (ending in ^D) once it has the exec
+        # reply, closing before that reply is sent would fail its exec
+        stdin = b""
+        while not stdin.endswith(b"\x04"):
+            data = channel.recv(65536)
+            if not data:
+                break
+            stdin += data
+        stdout, stderr, exit_status = self.handler(command.decode("utf-8"))
+        try:
+            channel.sendall(stdout)
+            channel.sendall_stderr(stderr)
+            channel.send_exit_status(exit_status)
+        except (socket.error, EOFError):
+            # the client stopped reading (head, a closed stream, ...)
+            pass
+        finally:
+            self.sessions.discard(channel.get_id())
+            channel.close()
+
+    def shell(self, channel):
+        self.run(channel, ["bash"])
+
+    def run(self, channel, args):
+        proc = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, bufsize=0)
+
+        def feed():
+            try:
+                while True:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+            except (socket.error, EOFError, IOError):
+                pass
+            proc.stdin.close()
+
+        def drain(src, send):
+            for data in iter(lambda: os.read(src.fileno(), 65536), b""):
+                try:
+                    send(data)
+                except (socket.error, EOFError):
+                    # keep reading so the process doesn't block on a full
+                    # pipe once the client is gone
+                    send = len
+        start(feed)
+        threads = [
+            start(drain, proc.stdout, channel.sendall),
+            start(drain, proc.stderr, channel.sendall_stderr)]
+        for thread in threads:
+            thread.join()
+        try:
+            channel.send_exit_status(proc.wait())
+        except (socket.error, EOFError):
+            pass
+        finally:
+            self.sessions.discard(channel.get_id())
+            channel.close()
+
+
+class SSHServer(object):
+    def __init__(
+            self, handler=run_command, latency=0.0, bandwidth=None,
+            max_sessions=None, pipe_stdin=False, rejected_commands=()):
+        """Listens on 127.0.0.1:port, handshakes counts the connections
+
+        :param float latency: Seconds added to every round trip
+        :param float bandwidth: Bytes per second each way per connection
+        :param int max_sessions: Refuse session channels past this many open
+                                 at once on a connection, like sshd's
+                                 MaxSessions
+        :param bool pipe_stdin: Run exec requests on a local bash with stdin
+                                and output streamed like sshd does, instead
+                                of through handler
+        :param rejected_commands: Exec requests for these fail
+        """
+        self.handler = handler
+        self.max_sessions = max_sessions
+        self.pipe_stdin = pipe_stdin
+        self.rejected_commands = rejected_commands
+        self.servers = []
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.handshakes = 0
+        self.transports = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+        start(self._accept)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.handshakes += 1
+            # like sshd, small packets are sent right away
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            start(self._serve, sock)
+
+    def _serve(self, sock):
+        if self.latency or self.bandwidth:
+            sock = ShapedSocket(sock, self.latency, self.bandwidth)
+        server = Server(
+            self.handler, self.max_sessions, self.pipe_stdin,
+            self.rejected_commands)
+        self.servers.append(server)
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(host_key())
+        # like sshd, compression is up to the client
+        transport.use_compression(True)
+        transport.set_subsystem_handler(
+            "sftp", paramiko.SFTPServer, LocalSFTPServer)
+        self.transports.append(transport)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError):
+            return
+        sessions = []
+        while transport.is_active():
+            chan = transport.accept(0.1)
+            if chan is None:
+                continue
+            if chan.get_id() not in server.destinations:
+                # paramiko only holds channels weakly, a dropped session
+                # channel is closed before its exec request gets here
+                sessions = [c for c in sessions if not c.closed] + [chan]
+                continue
+            target = socket.create_connection(
+                server.destinations.pop(chan.get_id()))
+            start(pump, chan, target)
+            start(pump, target, chan)
+
+    def close(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sshaolin.aio import AsyncSSHClient
+from sshaolin.client import CommandOperationTimeOut
+from tests.server import SSHServer, run_command
+
+
+def handler(command):
+    if command.startswith("sleep "):
+        time.sleep(float(command.split()[1]))
+        return b"slept", b"", 0
+    return run_command(command)
+
+
+class TestAsyncSSHClient(unittest.TestCase):
+    def setUp(self):
+        self.server = SSHServer(handler)
+        self.addCleanup(self.server.close)
+
+    def client(self, **kwargs):
+        return AsyncSSHClient(
+            "127.0.0.1", port=self.server.port, username="user",
+            password="password", timeout=10, **kwargs)
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_gather(self):
+        async def main():
+            async with self.client() as client:
+                started = time.time()
+                responses = await asyncio.gather(*[
+                    client.execute_command("sleep 0.5") for _ in range(5)] + [
+                    client.execute_command("echo last")])
+                return responses, time.time() - started
+        responses, elapsed = self.run_async(main())
+        self.assertEqual(
+            [resp.stdout for resp in responses],
+            [b"slept"] * 5 + [b"last\n"])
+        self.assertLess(elapsed, 2)
+        self.assertEqual(self.server.handshakes, 1)
+
+    def test_session_cap(self):
+        async def main():
+            async with self.client(max_sessions=2) as client:
+                await asyncio.gather(*[
+                    client.execute_command("sleep 0.2") for _ in range(6)])
+        self.run_async(main())
+        self.assertEqual(self.server.servers[-1].peak_sessions, 2)
+
+    def test_timeout(self):
+        async def main():
+            async with self.client() as client:
+                await client.execute_command("sleep 2", timeout=0.5)
+        self.assertRaises(
+            CommandOperationTimeOut, self.run_async, main())
+
+    def test_stdin_larger_than_the_window(self):
+        # slow enough that the window fills up and send_all has to wait
+        self.server = SSHServer(handler, latency=0.02, bandwidth=20e6)
+        self.addCleanup(self.server.close)
+        data = b"x" * (5 * 1024 * 1024)
+
+        async def main():
+            async with self.client() as client:
+                return await client.execute_command("true", stdin_str=data)
+        resp = self.run_async(main())
+        self.assertEqual((len(resp.stdin), resp.exit_status), (len(data), 0))
+
+    def test_shell_state(self):
+        async def main():
+            async with self.client() as client:
+                shell = await client.create_shell()
+                try:
+                    await shell.execute_command("export SSHAOLIN_TEST=kept")
+                    return await shell.execute_command("echo $SSHAOLIN_TEST")
+                finally:
+                    shell.close()
+        resp = self.run_async(main())
+        self.assertEqual((resp.stdout, resp.exit_status), (b"kept", 0))
+
+    def test_sftp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "file")
+
+        async def main():
+            async with self.client() as client:
+                async with await client.create_sftp() as sftp:
+                    await sftp.write_file(b"data", path)
+                    return await sftp.get_file(path)
+        self.assertEqual(self.run_async(main()), b"data")
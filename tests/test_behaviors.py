@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import (
+    load_ssh_public_key)
+
+from sshaolin.behaviors import KeyPool, KeyTypes, SSHBehavior
+
+
+class TestKeyTypes(unittest.TestCase):
+    def test_fast_key_types(self):
+        for key_type, size, prefix in [
+                (KeyTypes.ED25519, None, b"ssh-ed25519 "),
+                (KeyTypes.ECDSA, 384, b"ecdsa-sha2-nistp384 ")]:
+            keys = SSHBehavior.generate_ssh_keys(key_type=key_type, size=size)
+            self.assertTrue(keys.public_key.startswith(prefix))
+            load_ssh_public_key(keys.public_key, default_backend())
+            self.assertIn(b"PRIVATE KEY", keys.private_key)
+
+    def test_bad_ecdsa_size(self):
+        self.assertRaises(
+            ValueError, SSHBehavior.generate_ssh_keys,
+            key_type=KeyTypes.ECDSA, size=4096)
+
+    def test_default_key_name(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        SSHBehavior.generate_and_write_files(
+            folder=folder, key_type=KeyTypes.ED25519)
+        self.assertEqual(
+            sorted(os.listdir(folder)), ["id_ed25519", "id_ed25519.pub"])
+
+
+class TestKeyGeneration(unittest.TestCase):
+    def test_batch(self):
+        keys = SSHBehavior.generate_ssh_keys_batch(
+            3, processes=2, key_type=KeyTypes.ED25519)
+        self.assertEqual(len(set(key.public_key for key in keys)), 3)
+
+    def test_pool_refills(self):
+        pool = KeyPool(
+            size=3, low_water=2, processes=2, key_type=KeyTypes.ED25519)
+        self.addCleanup(pool.close)
+        keys = [pool.get(timeout=10) for _ in range(5)]
+        self.assertEqual(len(set(key.public_key for key in keys)), 5)
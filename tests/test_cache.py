@@ -0,0 +1,100 @@
+import threading
+import time
+import unittest
+
+from sshaolin.cache import CacheKey, ResultCache
+from sshaolin.client import SSHClient
+from tests.server import SSHServer
+
+
+def key(hostname="foo", command="uname -a"):
+    return CacheKey(hostname, 22, "user", (), command, b"")
+
+
+class TestResultCache(unittest.TestCase):
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05)
+        self.assertEqual(cache.get(key(), lambda: 1), 1)
+        self.assertEqual(cache.get(key(), lambda: 2), 1)
+        self.assertEqual(cache.get(key(), lambda: 3, ttl=0), 1)
+        time.sleep(0.06)
+        self.assertEqual(cache.get(key(), lambda: 4), 4)
+        self.assertEqual(cache.stats["hits"], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResultCache(max_size=2)
+        for command in ["a", "b"]:
+            cache.get(key(command=command), lambda: command)
+        cache.get(key(command="a"), lambda: None)
+        cache.get(key(command="c"), lambda: "c")
+        self.assertEqual(cache.get(key(command="a"), lambda: "new"), "a")
+        self.assertEqual(cache.get(key(command="b"), lambda: "new"), "new")
+        self.assertEqual(cache.stats["evictions"], 2)
+
+    def test_concurrent_calls_are_coalesced(self):
+        cache = ResultCache()
+        calls = []
+        release = threading.Event()
+
+        def factory():
+            calls.append(1)
+            release.wait()
+            return "response"
+        got = []
+        threads = [
+            threading.Thread(target=lambda: got.append(
+                cache.get(key(), factory)))
+            for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        while cache.stats["coalesced"] < 9:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), got), (1, ["response"] * 10))
+
+    def test_errors_are_not_cached(self):
+        cache = ResultCache()
+
+        def fail():
+            raise ValueError("down")
+        self.assertRaises(ValueError, cache.get, key(), fail)
+        self.assertEqual(cache.get(key(), lambda: "up"), "up")
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        for hostname in ["foo", "bar"]:
+            for command in ["a", "b"]:
+                cache.get(key(hostname, command), lambda: command)
+        self.assertEqual(cache.invalidate(hostname="foo", command="a"), 1)
+        self.assertEqual(cache.invalidate(hostname="bar"), 2)
+        self.assertEqual(cache.size, 1)
+
+        def factory():
+            cache.invalidate(hostname="foo")
+            return "stale"
+        cache.get(key(command="c"), factory)
+        self.assertEqual(cache.get(key(command="c"), lambda: "new"), "new")
+
+
+class TestCachedCommands(unittest.TestCase):
+    def test_only_cached_calls_use_the_cache(self):
+        calls = []
+
+        def handler(command):
+            calls.append(command)
+            return command.encode(), b"", 0
+        server = SSHServer(handler)
+        self.addCleanup(server.close)
+        cache = ResultCache()
+        client = SSHClient(
+            "127.0.0.1", server.port, "user", password="password",
+            result_cache=cache)
+        for _ in range(3):
+            resp = client.execute_command("df -P", cached=True)
+            self.assertEqual(resp.stdout, b"df -P")
+        client.execute_command("df -P", cached=True, stdin_str=b"other")
+        client.execute_command("df -P")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(cache.invalidate(hostname="127.0.0.1"), 2)
@@ -0,0 +1,72 @@
+import socket
+import time
+import unittest
+
+from paramiko.ssh_exception import SSHException
+
+from sshaolin.client import SSHClient
+from tests.server import SSHServer
+
+
+def handler(command):
+    if command.startswith("sleep "):
+        time.sleep(float(command.split()[1]))
+    return command.encode(), b"err", len(command)
+
+
+class TestExecuteMany(unittest.TestCase):
+    def client(self, **server_kwargs):
+        server = SSHServer(handler, **server_kwargs)
+        self.addCleanup(server.close)
+        return server, SSHClient(
+            "127.0.0.1", server.port, "user", password="password",
+            timeout=10)
+
+    def test_input_order(self):
+        _, client = self.client()
+        commands = ["sleep 0.{0}".format(9 - index) for index in range(10)]
+        responses = client.execute_many(commands + [("cat", "stdin")])
+        self.assertEqual(
+            [resp.stdout for resp in responses],
+            [command.encode() for command in commands + ["cat"]])
+        self.assertEqual(responses[-1].stdin, "stdin")
+        self.assertEqual(responses[0].stderr, b"err")
+        self.assertEqual(responses[0].exit_status, len(commands[0]))
+
+    def test_concurrent(self):
+        server, client = self.client()
+        started = time.time()
+        client.execute_many(["sleep 0.5"] * 8, max_sessions=8)
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(server.servers[-1].peak_sessions, 8)
+        self.assertEqual(server.handshakes, 1)
+
+    def test_cap(self):
+        server, client = self.client()
+        client.execute_many(["sleep 0.1"] * 6, max_sessions=2)
+        self.assertEqual(server.servers[-1].peak_sessions, 2)
+
+    def test_server_max_sessions(self):
+        server, client = self.client(max_sessions=3)
+        responses = client.execute_many(["sleep 0.1"] * 8)
+        self.assertEqual([resp.exit_status for resp in responses], [9] * 8)
+        self.assertEqual(server.servers[-1].peak_sessions, 3)
+
+    def test_timeout_in_place(self):
+        _, client = self.client()
+        responses = client.execute_many(["sleep 2", "fast"], timeout=0.5)
+        self.assertIsInstance(responses[0], socket.timeout)
+        self.assertEqual(responses[1].stdout, b"fast")
+
+    def test_failed_exec_closes_every_channel(self):
+        _, client = self.client(rejected_commands=["rejected"])
+        connection = client._connect()
+        self.addCleanup(connection.close)
+        commands = ["sleep 2"] * 4 + ["rejected"] + ["sleep 2"] * 4
+        started = time.time()
+        self.assertRaises(
+            SSHException, connection.execute_many, commands, max_sessions=9)
+        # a failed exec isn't a refusal, it doesn't wait for the others
+        self.assertLess(time.time() - started, 1.5)
+        channels = connection.get_transport()._channels.values()
+        self.assertEqual([chan for chan in channels if not chan.closed], [])
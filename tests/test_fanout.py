@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from sshaolin.client import CommandOperationTimeOut
+from sshaolin.fanout import FanOutExecutor
+from sshaolin.models import CommandResponse
+
+
+class SleepClient(object):
+    def __init__(self, seconds, error=None):
+        self.seconds = seconds
+        self.error = error
+
+    def execute_command(self, command, **kwargs):
+        time.sleep(self.seconds)
+        if self.error:
+            raise self.error
+        return CommandResponse(stdout=command.encode(), exit_status=0)
+
+
+class TestFanOutExecutor(unittest.TestCase):
+    def test_completion_order_and_concurrency(self):
+        slow, fast = SleepClient(0.3), SleepClient(0.01)
+        start = time.time()
+        results = list(FanOutExecutor().execute_command([slow, fast], "ls"))
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual([host for host, _ in results], [fast, slow])
+        self.assertEqual(results[0][1].stdout, b"ls")
+
+    def test_exceptions_are_yielded(self):
+        error = ValueError("boom")
+        host = SleepClient(0, error)
+        results = list(FanOutExecutor().execute_command([host], "ls"))
+        self.assertEqual(results, [(host, error)])
+
+    def test_worker_limit(self):
+        hosts = [SleepClient(0.1) for _ in range(4)]
+        start = time.time()
+        list(FanOutExecutor(max_workers=2).execute_command(hosts, "ls"))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_deadlines(self):
+        slow, fast = SleepClient(5), SleepClient(0)
+        executor = FanOutExecutor()
+        for kwargs in [{"host_timeout": 0.1}, {"timeout": 0.1}]:
+            start = time.time()
+            results = dict(
+                executor.execute_command([slow, fast], "ls", **kwargs))
+            self.assertLess(time.time() - start, 1)
+            self.assertIsInstance(results[slow], CommandOperationTimeOut)
+            self.assertIsInstance(results[fast], CommandResponse)
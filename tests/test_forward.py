@@ -0,0 +1,176 @@
+import os
+import socket
+import threading
+import unittest
+
+import paramiko
+from six.moves import socketserver
+import socks
+
+from sshaolin.forward import (
+    Forward, ForwardingEngine, ListeningForward, Relay)
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            self.request.sendall(data)
+
+
+class EchoServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ForwardingServer(paramiko.ServerInterface):
+    """Server side of an in process transport that allows every forward"""
+
+    def __init__(self):
+        self.destinations = {}
+        self.cancelled = []
+
+    def get_allowed_auths(self, username):
+        return "none"
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_port_forward_request(self, address, port):
+        return port or 40000
+
+    def cancel_port_forward_request(self, address, port):
+        self.cancelled.append((address, port))
+
+
+class TestForwardingEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.host_key = paramiko.RSAKey.generate(1024)
+
+    def setUp(self):
+        self.echo = EchoServer(("127.0.0.1", 0), EchoHandler)
+        threading.Thread(target=self.echo.serve_forever).start()
+        self.addCleanup(self.echo.server_close)
+        self.addCleanup(self.echo.shutdown)
+
+        client_sock, server_sock = socket.socketpair()
+        self.server = ForwardingServer()
+        self.server_transport = paramiko.Transport(server_sock)
+        self.server_transport.add_server_key(self.host_key)
+        server_thread = threading.Thread(
+            target=self.server_transport.start_server,
+            kwargs={"server": self.server})
+        server_thread.start()
+        self.addCleanup(self.server_transport.close)
+        transport = paramiko.Transport(client_sock)
+        transport.start_client()
+        transport.auth_none("user")
+        server_thread.join()
+        self.addCleanup(transport.close)
+
+        # the server side opens the direct-tcpip targets with a relay too
+        self.server_relay = Relay()
+        self.addCleanup(self.server_relay.close)
+        threading.Thread(target=self.serve_channels).start()
+        self.engine = ForwardingEngine(transport, timeout=5)
+        self.addCleanup(self.engine.close)
+
+    def serve_channels(self):
+        forward = Forward(None, "server", 0)
+        while self.server_transport.is_active():
+            chan = self.server_transport.accept(0.1)
+            if chan is not None:
+                sock = socket.create_connection(
+                    self.server.destinations[chan.get_id()])
+                self.server_relay.add_tunnel(forward, sock, chan)
+
+    def echo_through(self, sock, data):
+        sender = threading.Thread(target=sock.sendall, args=(data, ))
+        sender.start()
+        received = b""
+        while len(received) < len(data):
+            chunk = sock.recv(65536)
+            self.assertTrue(chunk)
+            received += chunk
+        sender.join()
+        sock.close()
+        return received
+
+    def test_local_forward(self):
+        forward = self.engine.create_forward_port(
+            0, "127.0.0.1", self.echo.server_address[1])
+        self.assertEqual(forward.address, "localhost")
+        self.assertNotEqual(forward.port, 0)
+        data = os.urandom(1024 * 1024)
+        socks_ = [
+            socket.create_connection(("localhost", forward.port))
+            for _ in range(4)]
+        threads = [
+            threading.Thread(target=self.echo_through, args=(sock, data))
+            for sock in socks_]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sock = socket.create_connection(("localhost", forward.port))
+        self.assertEqual(self.echo_through(sock, data), data)
+        forward.close()
+        stats = forward.stats
+        self.assertEqual(stats["connections"], 5)
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(stats["bytes_sent"], 5 * len(data))
+        self.assertEqual(stats["bytes_received"], 5 * len(data))
+        self.assertEqual(self.engine.forwards, [])
+        self.assertRaises(
+            socket.error, socket.create_connection,
+            ("localhost", forward.port))
+
+    def test_socks_proxy(self):
+        forward = self.engine.create_socks_proxy()
+        for version in [socks.SOCKS4, socks.SOCKS5]:
+            sock = socks.socksocket()
+            sock.set_proxy(version, "localhost", forward.port)
+            sock.connect(self.echo.server_address)
+            self.assertEqual(self.echo_through(sock, b"hello"), b"hello")
+        self.assertEqual(forward.stats["connections"], 2)
+
+    def test_remote_forward(self):
+        forward = self.engine.create_forward_port(
+            0, "127.0.0.1", self.echo.server_address[1], remote=True)
+        self.assertEqual(forward.port, 40000)
+        chan = self.server_transport.open_forwarded_tcpip_channel(
+            ("10.0.0.1", 5555), ("", 40000))
+        chan.sendall(b"hello")
+        self.assertEqual(chan.recv(5), b"hello")
+        chan.close()
+        forward.close()
+        self.assertEqual(self.server.cancelled, [("", 40000)])
+
+    def test_forward_defaults(self):
+        self.assertRaises(
+            TypeError, ListeningForward, self.engine, "127.0.0.1", 0)
+        forward = Forward(self.engine, "plain", 0)
+        forward.close()
+        self.assertIsNone(forward.engine)
+
+
+class TestRelay(unittest.TestCase):
+    def test_errors_reach_the_caller(self):
+        relay = Relay()
+        self.addCleanup(relay.close)
+
+        def fail():
+            raise ValueError("bad call")
+        self.assertRaises(ValueError, relay.run, fail)
+        sock = socket.socket()
+        sock.close()
+        self.assertRaises(
+            (ValueError, OSError), relay.add_listener, sock, lambda: None)
+        self.assertEqual(relay.run(lambda: "still running"), "still running")
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import unittest
+
+HEAVY = ("paramiko", "cryptography", "socks")
+
+
+class TestLazyImports(unittest.TestCase):
+    def imported(self, code):
+        """Returns the HEAVY modules imported after running code"""
+        output = subprocess.check_output([
+            sys.executable, "-c", code + "\nimport sys\nprint(' '.join("
+            "m for m in {0!r} if m in sys.modules))".format(HEAVY)])
+        return output.decode().split()
+
+    def test_nothing_heavy_until_used(self):
+        self.assertEqual(self.imported(
+            "import sshaolin.client, sshaolin.fanout, sshaolin.behaviors\n"
+            "sshaolin.client.SSHClient('localhost')"), [])
+
+    def test_paramiko_client_class_is_still_there(self):
+        self.assertIn("paramiko", self.imported(
+            "from sshaolin.client import ExtendedParamikoSSHClient\n"
+            "from sshaolin.client import read_pipe"))
+
+    def test_connection_imported_first(self):
+        self.assertIn("paramiko", self.imported(
+            "import sshaolin.connection\n"
+            "from sshaolin.client import ExtendedParamikoSSHClient\n"
+            "assert ExtendedParamikoSSHClient is "
+            "sshaolin.connection.ExtendedParamikoSSHClient"))
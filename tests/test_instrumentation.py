@@ -0,0 +1,144 @@
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import unittest
+
+from sshaolin import instrumentation
+from sshaolin.client import SSHClient
+from sshaolin.jump import bastions
+from tests.server import SSHServer
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        instrumentation.add_listener(self.events.append)
+        self.addCleanup(
+            instrumentation.remove_listener, self.events.append)
+
+    def test_null_timer_without_listeners(self):
+        instrumentation.remove_listener(self.events.append)
+        self.assertIs(
+            instrumentation.start("connect"), instrumentation.NULL_TIMER)
+        sink = BytesIO()
+        self.assertIs(instrumentation.NULL_TIMER.sink(sink, "in"), sink)
+
+    def test_phases_and_counts(self):
+        timer = instrumentation.start("execute_command", command="ls")
+        timer.mark("channel_open")
+        sink = timer.sink(BytesIO(), "bytes_in")
+        sink.write(b"abc")
+        sink.write(b"de")
+        timer.mark("execution")
+        timer.finish()
+        event, = self.events
+        self.assertEqual(
+            [phase for phase, _ in event.phases],
+            ["channel_open", "first_byte", "execution"])
+        self.assertEqual(event.counts, {"bytes_in": 5})
+        self.assertEqual(event.attributes, {"command": "ls"})
+        self.assertEqual(sink.getvalue(), b"abcde")
+
+    def test_histogram_openmetrics(self):
+        collector = instrumentation.HistogramCollector(buckets=[0.1, 1])
+        instrumentation.add_listener(collector)
+        self.addCleanup(instrumentation.remove_listener, collector)
+        timer = instrumentation.start("connect")
+        timer.mark("auth")
+        timer.count("bytes_out", 7)
+        timer.finish(ValueError("boom"))
+        text = collector.to_openmetrics()
+        self.assertIn("# TYPE sshaolin_phase_seconds histogram", text)
+        self.assertIn(
+            'sshaolin_phase_seconds_bucket{event="connect",phase="auth",'
+            'le="+Inf"} 1', text)
+        self.assertIn(
+            'sshaolin_phase_seconds_count{event="connect",phase="total"} 1',
+            text)
+        self.assertIn(
+            'sshaolin_operation_total{event="connect",count="bytes_out"} 7',
+            text)
+        self.assertIn(
+            'sshaolin_operation_total{event="connect",count="errors"} 1',
+            text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+
+class TestInstrumentedPaths(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer(lambda command: (b"output", b"err", 0))
+        cls.bastion = SSHServer()
+
+    @classmethod
+    def tearDownClass(cls):
+        bastions.close()
+        cls.server.close()
+        cls.bastion.close()
+
+    def setUp(self):
+        self.events = []
+        instrumentation.add_listener(self.events.append)
+        self.addCleanup(
+            instrumentation.remove_listener, self.events.append)
+        self.client = SSHClient(
+            "127.0.0.1", self.server.port, "user", password="password",
+            timeout=10)
+
+    def summary(self):
+        return [
+            (event.name, [phase for phase, _ in event.phases], event.counts,
+             event.error) for event in self.events]
+
+    def test_execute_command(self):
+        self.client.execute_command("run", stdin_str=b"abc")
+        self.assertEqual(self.summary(), [
+            ("connect", ["tcp_connect", "kex", "auth"], {}, None),
+            ("execute_command", ["channel_open", "first_byte", "execution"],
+             {"bytes_in": 9, "bytes_out": 3}, None)])
+
+    def test_jump_connect(self):
+        client = SSHClient(
+            "127.0.0.1", self.server.port, "user", password="password",
+            timeout=10,
+            jump_hosts=["127.0.0.1:{0}".format(self.bastion.port)])
+        client._connect().close()
+        # the bastion connect is reported on its own
+        self.assertEqual(self.summary()[-1], (
+            "connect", ["jump", "kex", "auth"], {}, None))
+
+    def test_shell(self):
+        with self.client.create_shell() as shell:
+            del self.events[:]
+            shell.execute_command("echo one")
+            shell.execute_many(["echo two", "echo three"])
+        (name, phases, counts, error), (many_name, many_phases,
+                                        many_counts, _) = self.summary()
+        self.assertEqual(
+            (name, phases, error),
+            ("shell_execute_command", ["send", "first_byte", "response"],
+             None))
+        self.assertEqual(
+            (many_name, many_phases, many_counts["commands"]),
+            ("shell_execute_many", ["send", "first_byte", "response"], 2))
+        for counts in [counts, many_counts]:
+            self.assertGreater(counts["bytes_in"], 0)
+            self.assertGreater(counts["bytes_out"], 0)
+
+    def test_sftp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "file")
+        with self.client.create_sftp() as sftp:
+            del self.events[:]
+            sftp.write_file(b"data", path)
+            sftp.listdir(folder)
+            self.assertRaises(IOError, sftp.stat, path + ".missing")
+        summary = self.summary()
+        self.assertEqual(
+            [(name, phases, counts) for name, phases, counts, _ in summary],
+            [("sftp_stream_from", ["open", "transfer"], {"bytes_out": 4}),
+             ("sftp_stat", [], {}), ("sftp_listdir", [], {}),
+             ("sftp_stat", [], {})])
+        self.assertIsInstance(summary[-1][3], IOError)
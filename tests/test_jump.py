@@ -0,0 +1,65 @@
+import unittest
+
+from sshaolin.client import SSHClient
+from sshaolin.jump import JumpHostCache, bastions, parse_jump_host
+from tests.server import SSHServer
+
+
+class TestParseJumpHost(unittest.TestCase):
+    def test_specs(self):
+        for spec, expected in [
+                ("bastion", {"hostname": "bastion", "port": 22}),
+                ("me@bastion:2222", {
+                    "hostname": "bastion", "port": 2222, "username": "me"}),
+                ("[::1]:2200", {"hostname": "::1", "port": 2200}),
+                ("::1", {"hostname": "::1", "port": 22})]:
+            self.assertEqual(parse_jump_host(spec), expected)
+
+
+class TestJumpHosts(unittest.TestCase):
+    def setUp(self):
+        self.servers = {}
+        for name in ["bastion", "inner", "target1", "target2"]:
+            self.servers[name] = SSHServer(
+                lambda command, name=name: (name.encode(), b"", 0))
+            self.addCleanup(self.servers[name].close)
+        self.addCleanup(bastions.close)
+
+    def client(self, target, jump_hosts):
+        return SSHClient(
+            hostname="127.0.0.1", port=self.servers[target].port,
+            username="user", password="password", jump_hosts=jump_hosts,
+            timeout=10)
+
+    def spec(self, name):
+        return "127.0.0.1:{0}".format(self.servers[name].port)
+
+    def test_targets_share_one_bastion_handshake(self):
+        for target in ["target1", "target2", "target1"]:
+            resp = self.client(target, [self.spec("bastion")]).execute_command(
+                "hostname")
+            self.assertEqual(resp.stdout, target.encode())
+        self.assertEqual(self.servers["bastion"].handshakes, 1)
+        self.assertEqual(self.servers["target1"].handshakes, 2)
+        self.assertEqual(bastions.stats["connections"], 1)
+
+    def test_chain(self):
+        jump_hosts = [
+            self.spec("bastion"),
+            {"hostname": "127.0.0.1", "port": self.servers["inner"].port}]
+        for _ in range(2):
+            resp = self.client("target2", jump_hosts).execute_command("ls")
+            self.assertEqual(resp.stdout, b"target2")
+        self.assertEqual(self.servers["bastion"].handshakes, 1)
+        self.assertEqual(self.servers["inner"].handshakes, 1)
+        self.assertEqual(bastions.stats["connections"], 2)
+
+    def test_dead_bastion_is_replaced(self):
+        cache = JumpHostCache()
+        self.addCleanup(cache.close)
+        hop = self.client("bastion", [])
+        first = cache.connect([hop])
+        self.assertIs(cache.connect([hop]), first)
+        first.close()
+        self.assertIsNot(cache.connect([hop]), first)
+        self.assertEqual(self.servers["bastion"].handshakes, 2)
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from paramiko import Ed25519Key
+from paramiko.hostkeys import HostKeyEntry, HostKeys
+
+from sshaolin.behaviors import KeyTypes, SSHBehavior
+from sshaolin.keys import KeyCache, KnownHostsStore
+
+
+def ed25519_keys():
+    keys = SSHBehavior.generate_ssh_keys(key_type=KeyTypes.ED25519)
+    return keys.private_key.decode(), keys.public_key.decode()
+
+
+class TestKeyCache(unittest.TestCase):
+    def test_strings_are_parsed_once(self):
+        private_key, _ = ed25519_keys()
+        cache = KeyCache()
+        key = cache.from_string(private_key)
+        self.assertIsInstance(key, Ed25519Key)
+        self.assertIs(cache.from_string(private_key.encode()), key)
+
+    def test_files_are_parsed_again_when_changed(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "id_ed25519")
+        cache = KeyCache()
+        with open(path, "w") as fp:
+            fp.write(ed25519_keys()[0])
+        key = cache.from_file(path, Ed25519Key)
+        self.assertIs(cache.from_file(path, Ed25519Key), key)
+        with open(path, "w") as fp:
+            fp.write(ed25519_keys()[0])
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertNotEqual(cache.from_file(path, Ed25519Key), key)
+        # the edited file replaced its old entry
+        self.assertEqual(cache.size, 1)
+
+    def test_least_recently_used_are_evicted(self):
+        private_keys = [ed25519_keys()[0] for _ in range(3)]
+        cache = KeyCache(max_keys=2)
+        first = cache.from_string(private_keys[0])
+        second = cache.from_string(private_keys[1])
+        self.assertIs(cache.from_string(private_keys[0]), first)
+        cache.from_string(private_keys[2])
+        self.assertEqual(cache.size, 2)
+        self.assertIs(cache.from_string(private_keys[0]), first)
+        self.assertIsNot(cache.from_string(private_keys[1]), second)
+
+    def test_clear(self):
+        private_key, _ = ed25519_keys()
+        cache = KeyCache()
+        key = cache.from_string(private_key)
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+        self.assertIsNot(cache.from_string(private_key), key)
+
+
+class TestKnownHostsStore(unittest.TestCase):
+    def setUp(self):
+        self.public_key = ed25519_keys()[1]
+        self.store = KnownHostsStore()
+
+    def server_key(self, public_key):
+        return HostKeyEntry.from_line("x " + public_key).key
+
+    def test_plain_and_hashed_lookups(self):
+        key = self.server_key(self.public_key)
+        other = self.server_key(ed25519_keys()[1])
+        self.store.add_line("# comment")
+        self.store.add_line("plain,[plain]:2222 " + self.public_key)
+        self.store.add_line(
+            HostKeys.hash_host("hashed") + " " + self.public_key)
+        for name in ["plain", "[plain]:2222", "hashed"]:
+            self.assertEqual(self.store.get(name).keys(), ["ssh-ed25519"])
+            self.assertTrue(self.store.check(name, key))
+            self.assertFalse(self.store.check(name, other))
+        self.assertIsNone(self.store.check("unknown", key))
+
+    def test_add_policy_trusts_first_key(self):
+        key = self.server_key(self.public_key)
+        self.store.add_policy().missing_host_key(None, "new", key)
+        self.assertTrue(self.store.check("new", key))
+
+    def test_lookup_time_does_not_grow_with_entries(self):
+        for index in range(50000):
+            self.store.add_line(
+                "host{0} {1}".format(index, self.public_key))
+        start = time.time()
+        for index in range(0, 50000, 50):
+            self.store.get("host{0}".format(index))
+        self.assertLess(time.time() - start, 1)
@@ -0,0 +1,64 @@
+import json
+import logging
+import unittest
+
+from sshaolin import common
+from sshaolin.models import CommandResponse
+
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class Logged(common.BaseSSHClass):
+    @common.SSHLogger
+    def run(self, stdout):
+        return CommandResponse(stdout=stdout, stderr=b"", exit_status=0)
+
+
+class TestSSHLogger(unittest.TestCase):
+    def setUp(self):
+        self.handler = Recorder()
+        self.log = Logged._log
+        self.log.addHandler(self.handler)
+        self.log.setLevel(logging.INFO)
+        self.addCleanup(self.log.removeHandler, self.handler)
+        self.addCleanup(self.log.setLevel, logging.NOTSET)
+        self.addCleanup(
+            common.configure_logging, output_head=None, output_tail=None,
+            structured=False)
+
+    def test_logger_is_cached_per_class(self):
+        self.assertIs(Logged._log, Logged._log)
+        self.assertEqual(Logged._log.name, "tests.test_logging.Logged")
+
+    def test_nothing_is_formatted_above_info(self):
+        self.log.setLevel(logging.WARNING)
+        stdout = type("Output", (bytes,), {
+            "decode": lambda *args: self.fail("output decoded")})(b"x")
+        self.assertEqual(Logged().run(stdout).stdout, b"x")
+        self.assertEqual(self.handler.records, [])
+
+    def test_output_truncation(self):
+        common.configure_logging(output_head=2, output_tail=3)
+        Logged().run(b"0123456789")
+        self.assertIn(
+            u"01...<5 bytes truncated>...789",
+            self.handler.records[-1].getMessage())
+
+    def test_structured_events(self):
+        common.configure_logging(structured=True)
+        Logged().run(b"out")
+        call, response = self.handler.records
+        self.assertEqual(json.loads(call.getMessage())["name"], "run")
+        self.assertEqual(response.sshaolin_event["stdout"], u"out")
+        self.assertEqual(response.sshaolin_event["exit_status"], 0)
+
+    def test_unknown_setting(self):
+        self.assertRaises(
+            AttributeError, common.configure_logging, output_middle=1)
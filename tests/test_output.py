@@ -0,0 +1,61 @@
+import unittest
+
+from sshaolin.client import SSHClient
+from sshaolin.models import CommandResponse
+from sshaolin.output import OutputBuffer
+from tests.server import SSHServer
+
+
+class TestCommandResponse(unittest.TestCase):
+    def test_slotted(self):
+        resp = CommandResponse(stdout=b"a", exit_status=0)
+        self.assertFalse(hasattr(resp, "__dict__"))
+        self.assertEqual(resp, CommandResponse(stdout=b"a", exit_status=0))
+        self.assertNotEqual(resp, CommandResponse(stdout=b"b", exit_status=0))
+        self.assertIn("stdout = b'a'", str(resp))
+
+    def test_lazy_decoding(self):
+        resp = CommandResponse(stdout=b"caf\xc3\xa9\nbar\n\xff", stderr=None)
+        self.assertEqual(resp.text, u"caf\xe9\nbar\n�")
+        self.assertIs(resp.text, resp.text)
+        self.assertEqual(resp.lines, [u"caf\xe9", u"bar", u"�"])
+        self.assertIsNone(resp.stderr_text)
+        resp.stdout = b"new"
+        self.assertEqual(resp.lines, [u"new"])
+
+
+class TestSpilling(unittest.TestCase):
+    def test_output_buffer(self):
+        small = OutputBuffer(spill_size=8)
+        small.write(b"12345678")
+        self.assertEqual(small.getvalue(), b"12345678")
+        big = OutputBuffer(spill_size=8)
+        for data in [b"12345", b"67890", b"abc"]:
+            big.write(data)
+        spilled = big.getvalue()
+        self.assertEqual(
+            (len(spilled), spilled[2:6], spilled.read()),
+            (13, b"3456", b"1234567890abc"))
+        self.assertEqual(list(spilled.stream(5)), [
+            b"12345", b"67890", b"abc"])
+        spilled.close()
+
+    def test_large_output_spills(self):
+        data = b"x" * 100000 + b"\n"
+        server = SSHServer(lambda command: (data, b"err", 0))
+        self.addCleanup(server.close)
+        client = SSHClient(
+            "127.0.0.1", server.port, "user", password="password")
+        resp = client.execute_command("big", spill_size=65536)
+        self.addCleanup(resp.close)
+        self.assertTrue(resp.spilled)
+        self.assertEqual(len(resp.output()), len(data))
+        self.assertEqual(resp.output("stderr"), b"err")
+        self.assertEqual(b"".join(resp.stream(chunk_size=4096)), data)
+        self.assertEqual(resp.stdout, data)
+        # read from the temp file once
+        self.assertIs(resp.stdout, resp.stdout)
+        self.assertEqual(resp.lines, [u"x" * 100000])
+        resp = client.execute_command("big")
+        self.assertFalse(resp.spilled)
+        self.assertEqual(resp.stdout, data)
@@ -0,0 +1,97 @@
+import time
+import unittest
+
+import mock
+
+from sshaolin.client import SSHClient
+from sshaolin.pool import ConnectionPool, is_alive
+from tests.server import SSHServer
+
+
+def fake_connection(alive=True):
+    connection = mock.Mock()
+    transport = connection.get_transport.return_value
+    transport.is_active.return_value = alive
+    transport.is_authenticated.return_value = alive
+    return connection
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuse_counts_hits_and_misses(self):
+        pool = ConnectionPool()
+        connection = fake_connection()
+        self.assertIs(pool.acquire("key", lambda: connection), connection)
+        pool.release("key", connection)
+        self.assertIs(pool.acquire("key", fake_connection), connection)
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+
+    def test_dead_connection_is_not_reused(self):
+        pool = ConnectionPool()
+        dead = fake_connection()
+        pool.release("key", dead)
+        dead.get_transport.return_value.is_active.return_value = False
+        new = fake_connection()
+        self.assertIs(pool.acquire("key", lambda: new), new)
+        dead.close.assert_called_once_with()
+        self.assertEqual(pool.evictions, 1)
+
+    def test_idle_eviction(self):
+        pool = ConnectionPool(max_idle_time=0)
+        connection = fake_connection()
+        pool.release("key", connection)
+        time.sleep(0.01)
+        pool.evict_idle()
+        connection.close.assert_called_once_with()
+        self.assertEqual(pool.size, 0)
+
+    def test_size_cap(self):
+        pool = ConnectionPool(max_size=1)
+        first, second = fake_connection(), fake_connection()
+        pool.release("key", first)
+        pool.release("key", second)
+        second.close.assert_called_once_with()
+        self.assertEqual(pool.size, 1)
+
+    def test_close(self):
+        pool = ConnectionPool()
+        connection = fake_connection()
+        pool.release("key", connection)
+        pool.close()
+        connection.close.assert_called_once_with()
+        self.assertEqual(pool.size, 0)
+
+
+class TestPooledClient(unittest.TestCase):
+    def setUp(self):
+        self.server = SSHServer()
+        self.addCleanup(self.server.close)
+        self.client = SSHClient(
+            "127.0.0.1", self.server.port, "user", password="password",
+            timeout=10, pooled=True)
+        self.addCleanup(self.client.close)
+
+    def idle_connections(self):
+        return [
+            connection for entries in self.client.pool._idle.values()
+            for _, connection in entries]
+
+    def test_one_handshake(self):
+        for index in range(5):
+            resp = self.client.execute_command("echo {0}".format(index))
+            self.assertEqual(resp.stdout, "{0}\n".format(index).encode())
+        self.assertEqual(self.server.handshakes, 1)
+        pool = self.client.pool
+        self.assertEqual((pool.hits, pool.misses, pool.size), (4, 1, 1))
+
+    def test_connection_closed_by_server_is_replaced(self):
+        self.client.execute_command("true")
+        connection, = self.idle_connections()
+        self.server.transports[-1].close()
+        max_time = time.time() + 5
+        while is_alive(connection) and time.time() < max_time:
+            time.sleep(0.01)
+        resp = self.client.execute_command("echo again")
+        self.assertEqual(resp.stdout, b"again\n")
+        self.assertEqual(self.server.handshakes, 2)
+        self.assertEqual(self.client.pool.evictions, 1)
+        self.assertIsNot(self.idle_connections()[0], connection)
@@ -0,0 +1,96 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from sshaolin.client import SSHClient
+from sshaolin.reconnect import Reconnector
+from tests.server import SSHServer
+
+
+class TestReconnector(unittest.TestCase):
+    def test_retries_with_backoff(self):
+        calls = []
+
+        def connect():
+            calls.append(None)
+            if len(calls) < 3:
+                raise IOError("refused")
+            return "connection"
+
+        reconnector = Reconnector(connect, backoff=0)
+        self.assertEqual(
+            reconnector.reconnect(lambda conn: None), "connection")
+        self.assertEqual(
+            (reconnector.reconnects, reconnector.failed_attempts), (1, 2))
+
+    def test_gives_up(self):
+        def connect():
+            raise IOError("refused")
+
+        reconnector = Reconnector(connect, max_attempts=2, backoff=0)
+        self.assertRaises(IOError, reconnector.reconnect, lambda conn: None)
+        self.assertEqual(reconnector.stats["failed_attempts"], 2)
+
+    def test_delay(self):
+        reconnector = Reconnector(None, backoff=1, max_backoff=4)
+        self.assertTrue(0.5 <= reconnector.delay(0) <= 1)
+        self.assertTrue(2 <= reconnector.delay(10) <= 4)
+
+
+class TestAutoReconnect(unittest.TestCase):
+    def setUp(self):
+        self.server = SSHServer()
+        self.addCleanup(self.server.close)
+        self.client = SSHClient(
+            "127.0.0.1", self.server.port, "user", password="password",
+            timeout=10)
+
+    def kill(self, connection):
+        self.server.transports[-1].close()
+        transport = connection.get_transport()
+        max_time = time.time() + 5
+        while transport.is_active() and time.time() < max_time:
+            time.sleep(0.01)
+
+    def test_shell_restores_preamble(self):
+        shell = self.client.create_shell(
+            auto_reconnect=True, preamble=["export SSHAOLIN_TEST=kept"])
+        self.addCleanup(shell.close)
+        shell.add_preamble("cd /tmp")
+        self.kill(shell.connection)
+        resp = shell.execute_command("echo $SSHAOLIN_TEST; pwd")
+        self.assertEqual(resp.stdout.split(), [b"kept", b"/tmp"])
+        self.assertEqual(shell.stats["reconnects"], 1)
+
+    def test_shell_rebuilt_after_timeout(self):
+        shell = self.client.create_shell(
+            auto_reconnect=True, preamble=["cd /tmp"])
+        self.addCleanup(shell.close)
+        self.assertRaises(
+            socket.timeout, shell.execute_command, "sleep 5", timeout=0.5)
+        self.assertEqual(shell.execute_command("pwd").stdout, b"/tmp")
+        self.assertEqual(shell.stats["reconnects"], 1)
+
+    def test_shell_without_reconnect_closes(self):
+        shell = self.client.create_shell()
+        self.addCleanup(shell.close)
+        self.kill(shell.connection)
+        self.assertRaises(Exception, shell.execute_command, "true")
+        self.assertEqual(shell.stats["reconnects"], 0)
+
+    def test_sftp_restores_cwd(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with open(os.path.join(folder, "file"), "wb") as fp:
+            fp.write(b"data")
+        sftp = self.client.create_sftp(auto_reconnect=True)
+        self.addCleanup(sftp.close)
+        sftp.chdir(folder)
+        self.kill(sftp.connection)
+        self.assertEqual(sftp.listdir(), ["file"])
+        self.assertEqual(sftp.getcwd(), folder)
+        self.assertEqual(sftp.get_file("file"), b"data")
+        self.assertEqual(sftp.stats["reconnects"], 1)
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sshaolin.client import CommandOperationTimeOut, SSHClient
+from tests.server import SSHServer, run_command
+
+
+def slow_sha256sum(command):
+    if command.startswith("sha256sum "):
+        time.sleep(2)
+    return run_command(command)
+
+
+class TestInProcessServer(unittest.TestCase):
+    """The localhost tests against tests/server.py instead of sshd"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer(latency=0.005, bandwidth=50e6)
+        cls.client = SSHClient(
+            "127.0.0.1", cls.server.port, "user", password="password",
+            timeout=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def test_run_command(self):
+        resp = self.client.execute_command("echo out; echo err >&2; exit 3")
+        self.assertEqual(
+            (resp.stdout, resp.stderr, resp.exit_status),
+            (b"out\n", b"err\n", 3))
+
+    def test_shell_keeps_state(self):
+        with self.client.create_shell() as shell:
+            shell.execute_command("export SSHAOLIN_TEST=kept")
+            resp = shell.execute_command("echo $SSHAOLIN_TEST")
+        self.assertEqual(resp.stdout.strip(), b"kept")
+        self.assertEqual(resp.exit_status, 0)
+
+    def test_shell_execute_many(self):
+        with self.client.create_shell() as shell:
+            responses = shell.execute_many([
+                "echo out; echo err >&2", "cd /tmp", "pwd",
+                "echo only err >&2; false", "echo after"])
+        self.assertEqual(
+            [(resp.stdout, resp.stderr, resp.exit_status)
+             for resp in responses],
+            [(b"out", b"err", 0), (b"", b"", 0), (b"/tmp", b"", 0),
+             (b"", b"only err", 1), (b"after", b"", 0)])
+
+    def test_shell_execute_many_stop_on_failure(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        marker = os.path.join(folder, "marker")
+        with self.client.create_shell() as shell:
+            responses = shell.execute_many(
+                ["echo first", "echo failing; exit_code() { return 4; }; "
+                 "exit_code", "touch " + marker, "echo never"],
+                stop_on_failure=True)
+            # the shell is still usable after the skipped commands
+            resp = shell.execute_command("echo next")
+        self.assertEqual(
+            [(resp.stdout, resp.exit_status) for resp in responses],
+            [(b"first", 0), (b"failing", 4)])
+        self.assertFalse(os.path.exists(marker))
+        self.assertEqual(resp.stdout, b"next")
+
+    def test_sftp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        data = os.urandom(3 * 1024 * 1024 + 7)
+        path = os.path.join(folder, "file")
+        with self.client.create_sftp() as sftp:
+            sftp.write_file(data, path)
+            self.assertEqual(sftp.listdir(folder), ["file"])
+            contents = sftp.get_file(path)
+            self.assertEqual(contents, data)
+            self.assertIsInstance(contents, bytearray)
+
+    def test_sync_checksum(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        local, remote = [os.path.join(folder, name) for name in "lr"]
+        for path, data in [(local, b"new"), (remote, b"old")]:
+            os.mkdir(path)
+            with open(os.path.join(path, "file"), "wb") as fp:
+                fp.write(data)
+        with self.client.create_sftp() as sftp:
+            report = sftp.sync(local, remote, checksum=True)
+            self.assertEqual(report.changed, ["file"])
+            self.assertEqual(
+                sftp.sync(local, remote, checksum=True).unchanged, 1)
+
+        server = SSHServer(slow_sha256sum)
+        self.addCleanup(server.close)
+        client = SSHClient(
+            "127.0.0.1", server.port, "user", password="password", timeout=30)
+        with client.create_sftp() as sftp:
+            with self.assertRaises(CommandOperationTimeOut) as caught:
+                sftp.sync(local, remote, checksum=True, timeout=0.5)
+        self.assertIn("sha256sum", str(caught.exception))
@@ -0,0 +1,70 @@
+import hashlib
+import itertools
+import os
+import tempfile
+import time
+import unittest
+
+from sshaolin.client import SSHClient
+from tests.server import SSHServer
+
+
+class TestStreamedStdin(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer(pipe_stdin=True)
+        cls.client = SSHClient(
+            "127.0.0.1", cls.server.port, "user", password="password",
+            timeout=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def test_file(self):
+        data = os.urandom(5 * 1024 * 1024 + 3)
+        with tempfile.TemporaryFile() as fp:
+            fp.write(data)
+            fp.seek(0)
+            resp = self.client.execute_command("sha256sum", stdin_file=fp)
+        self.assertEqual(
+            resp.stdout.split()[0], hashlib.sha256(data).hexdigest().encode())
+        self.assertIsNone(resp.stdin)
+
+    def test_file_descriptor(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b"through a pipe")
+        os.close(write_fd)
+        try:
+            resp = self.client.execute_command("cat", stdin_file=read_fd)
+        finally:
+            os.close(read_fd)
+        self.assertEqual(resp.stdout, b"through a pipe")
+
+    def test_iterator(self):
+        chunks = (b"line %d\n" % index for index in range(1000))
+        resp = self.client.execute_command("wc -l", stdin_file=chunks)
+        self.assertEqual(resp.stdout.strip(), b"1000")
+
+    def test_flow_control(self):
+        # never ends, only bounded writes let the command stop reading it
+        chunks = itertools.repeat(b"x" * 65536)
+        resp = self.client.execute_command("head -c 10", stdin_file=chunks)
+        self.assertEqual(resp.stdout, b"x" * 10)
+
+    def test_source_error(self):
+        def chunks():
+            yield b"partial"
+            raise IOError("disk gone")
+        started = time.time()
+        # cat is still waiting for stdin, the reader has to be woken up
+        self.assertRaises(
+            IOError, self.client.execute_command, "cat",
+            stdin_file=chunks())
+        self.assertLess(time.time() - started, 10)
+
+    def test_stream_command(self):
+        with self.client.stream_command(
+                "tr a-z A-Z", stdin_file=iter([b"ab", b"c"])) as stream:
+            output = b"".join(data for _, data in stream)
+        self.assertEqual((output, stream.exit_status), (b"ABC", 0))
@@ -0,0 +1,140 @@
+from io import BytesIO
+import time
+import unittest
+
+from sshaolin.client import (
+    EOF, STDERR, STDOUT, TIMEOUT, ChannelSelector, CommandOperationTimeOut,
+    ShellResponseReader, SSHClient, iter_lines)
+from tests.server import SSHServer
+
+
+def handler(command):
+    if command.startswith("sleep "):
+        time.sleep(float(command.split()[1]))
+    return b"line 1\nline 2\nlast", b"warning\n", 5
+
+
+class TestStreamCommand(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer(handler)
+        cls.client = SSHClient(
+            "127.0.0.1", cls.server.port, "user", password="password",
+            timeout=10)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def test_chunks_and_exit_status(self):
+        with self.client.stream_command("run") as stream:
+            self.assertIsNone(stream.exit_status)
+            chunks = list(stream)
+        self.assertEqual(
+            b"".join(data for name, data in chunks if name == STDOUT),
+            b"line 1\nline 2\nlast")
+        self.assertEqual(
+            b"".join(data for name, data in chunks if name == STDERR),
+            b"warning\n")
+        self.assertEqual(stream.exit_status, 5)
+
+    def test_lines(self):
+        with self.client.stream_command("run", lines=True) as stream:
+            lines = list(stream)
+        self.assertEqual(sorted(lines), sorted([
+            (STDOUT, b"line 1\n"), (STDOUT, b"line 2\n"), (STDOUT, b"last"),
+            (STDERR, b"warning\n")]))
+
+    def test_idle_timeout(self):
+        stream = self.client.stream_command("sleep 2", timeout=0.3)
+        started = time.time()
+        self.assertRaises(CommandOperationTimeOut, list, stream)
+        self.assertLess(time.time() - started, 1.5)
+
+    def test_sinks(self):
+        stdout, stderr = BytesIO(), BytesIO()
+        resp = self.client.execute_command(
+            "run", stdout_sink=stdout, stderr_sink=stderr)
+        self.assertEqual(
+            (resp.stdout, resp.stderr, resp.exit_status), (None, None, 5))
+        self.assertEqual(stdout.getvalue(), b"line 1\nline 2\nlast")
+        self.assertEqual(stderr.getvalue(), b"warning\n")
+        resp = self.client.execute_command("run", stderr_sink=stderr)
+        self.assertEqual(
+            (resp.stdout, resp.stderr), (b"line 1\nline 2\nlast", None))
+
+
+class TestChannelSelector(unittest.TestCase):
+    def test_several_channels_from_one_thread(self):
+        server = SSHServer(handler)
+        self.addCleanup(server.close)
+        connection = SSHClient(
+            "127.0.0.1", server.port, "user", password="password",
+            timeout=10)._connect()
+        self.addCleanup(connection.close)
+        selector = ChannelSelector(read_size=4)
+        self.addCleanup(selector.close)
+        channels = {}
+        for command in ["one", "two", "sleep 0.2", "sleep 5"]:
+            chan = connection.get_transport().open_session()
+            chan.exec_command(command)
+            chan.sendall(b"\n\x04")
+            channels[chan] = command
+            selector.register(
+                chan, time.time() + 1 if command == "sleep 5" else None)
+        output = dict((command, b"") for command in channels.values())
+        ends = {}
+        while len(selector):
+            for chan, kind, data in selector.read():
+                if kind == STDOUT:
+                    self.assertLessEqual(len(data), 4)
+                    output[channels[chan]] += data
+                elif kind in (EOF, TIMEOUT):
+                    ends[channels[chan]] = kind
+        self.assertEqual(ends, {
+            "one": EOF, "two": EOF, "sleep 0.2": EOF, "sleep 5": TIMEOUT})
+        for command in ["one", "two", "sleep 0.2"]:
+            self.assertEqual(output[command], b"line 1\nline 2\nlast")
+        self.assertEqual(output["sleep 5"], b"")
+
+
+class TestIterLines(unittest.TestCase):
+    def test_lines_are_regrouped_per_stream(self):
+        chunks = [
+            (STDOUT, b"a\nb"), (STDERR, b"x"), (STDOUT, b"c\n"),
+            (STDERR, b"y\n"), (STDOUT, b"tail")]
+        self.assertEqual(list(iter_lines(chunks)), [
+            (STDOUT, b"a\n"), (STDOUT, b"bc\n"), (STDERR, b"xy\n"),
+            (STDOUT, b"tail")])
+
+    def test_long_lines_are_split(self):
+        chunks = [(STDOUT, b"abcd"), (STDOUT, b"ef\n")]
+        self.assertEqual(
+            list(iter_lines(chunks, max_line_length=3)),
+            [(STDOUT, b"abcd"), (STDOUT, b"ef\n")])
+
+
+class TestShellResponseReader(unittest.TestCase):
+    def test_sentinels_split_across_reads(self):
+        reader = ShellResponseReader(b"UUID")
+        for chunk in [b"junk UU", b"ID\nout", b"put\nUU", b"ID 3", b"\n$ "]:
+            self.assertFalse(reader.done)
+            reader.feed(chunk)
+        self.assertTrue(reader.done)
+        response = reader.response()
+        self.assertEqual(response.stdout, b"output")
+        self.assertEqual(response.exit_status, 3)
+
+    def test_waits_for_exit_status_line(self):
+        reader = ShellResponseReader(b"UUID")
+        reader.feed(b"UUID\nUUID")
+        self.assertFalse(reader.done)
+        reader.feed(b" 0\n")
+        self.assertEqual(reader.response().exit_status, 0)
+
+    def test_remainder_holds_the_next_frame(self):
+        reader = ShellResponseReader(b"UUID")
+        reader.feed(b"UUID\nout\nUUID skip\nNEXT\n")
+        self.assertTrue(reader.done)
+        self.assertEqual(reader.status, b"skip")
+        self.assertEqual(reader.remainder, b"NEXT\n")
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sshaolin.client import SSHClient
+from tests.server import SSHServer
+
+
+class TestLogTailer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer()
+        cls.client = SSHClient(
+            "127.0.0.1", cls.server.port, "user", password="password")
+        cls.sftp = cls.client.create_sftp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sftp.close()
+        cls.server.close()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, "app.log")
+
+    def write(self, data, path=None, mode="ab"):
+        with open(path or self.path, mode) as fp:
+            fp.write(data)
+
+    def poll(self, tailer):
+        got = {}
+        for path, data in tailer.poll():
+            got[path] = got.get(path, b"") + data
+        return got
+
+    def test_only_new_bytes(self):
+        self.write(b"old\n")
+        other = os.path.join(self.folder, "other.log")
+        tailer = self.sftp.create_tailer([self.path, other])
+        self.assertEqual(self.poll(tailer), {})
+        self.write(b"new\n")
+        self.write(b"first\n", other)
+        self.assertEqual(
+            self.poll(tailer), {self.path: b"new\n", other: b"first\n"})
+        self.assertEqual(self.poll(tailer), {})
+        self.assertEqual(tailer.offsets, {self.path: 8, other: 6})
+
+    def test_truncation(self):
+        self.write(b"a" * 100)
+        tailer = self.sftp.create_tailer([self.path], from_start=True)
+        self.assertEqual(self.poll(tailer), {self.path: b"a" * 100})
+        self.write(b"b" * 10, mode="wb")
+        self.assertEqual(self.poll(tailer), {self.path: b"b" * 10})
+
+    def test_rotation_drains_the_rotated_file(self):
+        self.write(b"one\n")
+        tailer = self.sftp.create_tailer([self.path], from_start=True)
+        self.poll(tailer)
+        self.write(b"two\n")
+        os.rename(self.path, self.path + ".1")
+        self.assertEqual(self.poll(tailer), {self.path: b"two\n"})
+        self.write(b"three, longer than the old file\n")
+        self.assertEqual(
+            self.poll(tailer),
+            {self.path: b"three, longer than the old file\n"})
+
+    def test_lines(self):
+        tailer = self.sftp.create_tailer([self.path], lines=True)
+        self.write(b"one\ntw")
+        self.assertEqual(self.poll(tailer), {self.path: b"one\n"})
+        self.write(b"o\n")
+        self.assertEqual(self.poll(tailer), {self.path: b"two\n"})
+
+    def test_resume_from_state_file(self):
+        state_file = os.path.join(self.folder, "state.json")
+        self.write(b"one\n")
+        follow = self.sftp.follow(
+            [self.path], interval=0, timeout=0, state_file=state_file,
+            from_start=True)
+        self.assertEqual(list(follow), [(self.path, b"one\n")])
+        self.write(b"two\n")
+        tailer = self.sftp.create_tailer([self.path], state_file=state_file)
+        self.assertEqual(self.poll(tailer), {self.path: b"two\n"})
@@ -0,0 +1,221 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sshaolin.transfer import (
+    TreeTransfer, fd_writer, file_sha256, is_bytes_like, iter_remote_chunks,
+    release_view, write_source)
+
+
+class LocalSFTP(object):
+    """Just enough of paramiko's SFTPClient on top of the local filesystem"""
+
+    def __init__(self):
+        self.calls = []
+
+    def mkdir(self, path):
+        self.calls.append(("mkdir", path))
+        os.mkdir(path)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def put(self, localpath, remotepath, confirm=True):
+        self.calls.append(("put", remotepath))
+        shutil.copyfile(localpath, remotepath)
+
+    def get(self, remotepath, localpath):
+        shutil.copyfile(remotepath, localpath)
+
+    def utime(self, path, times):
+        os.utime(path, times)
+
+    def remove(self, path):
+        self.calls.append(("remove", path))
+        os.remove(path)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def listdir_attr(self, path):
+        attrs = []
+        for name in os.listdir(path):
+            attr = os.lstat(os.path.join(path, name))
+            attrs.append(type("Attr", (object,), {
+                "filename": name, "st_mode": attr.st_mode,
+                "st_size": attr.st_size, "st_mtime": int(attr.st_mtime)}))
+        return attrs
+
+
+class MemorySFTPFile(object):
+    def __init__(self, data=b""):
+        self.data = data
+        self.writes = []
+        self.requested = []
+
+    def readv(self, chunks):
+        self.requested.append(chunks)
+        for offset, size in chunks:
+            yield self.data[offset:offset + size]
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+
+class TestStreaming(unittest.TestCase):
+    def test_reads_are_windowed(self):
+        fp = MemorySFTPFile(b"0123456789")
+        chunks = list(iter_remote_chunks(fp, 10, chunk_size=3, prefetch=2))
+        self.assertEqual(chunks, [b"012", b"345", b"678", b"9"])
+        self.assertEqual(fp.requested, [[(0, 3), (3, 3)], [(6, 3), (9, 1)]])
+
+    def test_write_sources(self):
+        tmp = tempfile.NamedTemporaryFile()
+        self.addCleanup(tmp.close)
+        tmp.write(b"headerpayload")
+        tmp.flush()
+        tmp.seek(6)
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b"piped")
+        os.close(write_fd)
+        self.addCleanup(os.close, read_fd)
+        for source, expected in [
+                (b"abcdefg", [b"abc", b"def", b"g"]),
+                (bytearray(b"abcd"), [b"abc", b"d"]),
+                (tmp, [b"pay", b"loa", b"d"]),
+                (read_fd, [b"pip", b"ed"]),
+                (iter([b"it", b"er"]), [b"it", b"er"])]:
+            fp = MemorySFTPFile()
+            self.assertEqual(
+                write_source(fp, source, chunk_size=3),
+                len(b"".join(expected)))
+            self.assertEqual(fp.writes, expected)
+
+    def test_views_without_release(self):
+        # python 2 memoryviews have no release
+        release_view(object())
+        self.assertTrue(is_bytes_like(b"data"))
+        self.assertTrue(is_bytes_like(bytearray(b"data")))
+        self.assertFalse(is_bytes_like(iter([b"data"])))
+
+    def test_fd_writer(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        fd_writer(write_fd)(b"data")
+        os.close(write_fd)
+        self.assertEqual(os.read(read_fd, 10), b"data")
+
+
+class TestTreeTransfer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.src = os.path.join(self.tmp, "src")
+        for rel in ["a", "b/c", "b/d/e", "f/g"]:
+            path = os.path.join(self.src, *rel.split("/"))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as fp:
+                fp.write(rel)
+        os.mkdir(os.path.join(self.src, "empty"))
+
+    def tree(self, root):
+        return sorted(
+            (os.path.relpath(path, root), files)
+            for path, _, files in os.walk(root))
+
+    def test_put_and_get_tree(self):
+        done = []
+        clients = [LocalSFTP() for _ in range(3)]
+        transfer = TreeTransfer(
+            clients, lambda *args: done.append(args))
+        remote = os.path.join(self.tmp, "remote")
+        result = transfer.put_tree(self.src, remote)
+        self.assertEqual(result.errors, {})
+        self.assertEqual(
+            sorted(result.files), ["a", "b/c", "b/d/e", "f/g"])
+        self.assertEqual(result.bytes_transferred, 12)
+        self.assertEqual(
+            sorted(done), [
+                ("a", 1, None), ("b/c", 3, None), ("b/d/e", 5, None),
+                ("f/g", 3, None)])
+        self.assertEqual(self.tree(remote), self.tree(self.src))
+
+        local = os.path.join(self.tmp, "local")
+        result = transfer.get_tree(remote, local)
+        self.assertEqual(result.errors, {})
+        self.assertEqual(self.tree(local), self.tree(self.src))
+
+    def test_directories_before_files_and_existing_dirs(self):
+        sftp = LocalSFTP()
+        remote = os.path.join(self.tmp, "remote")
+        os.makedirs(os.path.join(remote, "b"))
+        TreeTransfer([sftp]).put_tree(self.src, remote)
+        kinds = [kind for kind, _ in sftp.calls]
+        self.assertEqual(kinds, sorted(kinds))
+
+    def test_errors_are_collected(self):
+        remote = os.path.join(self.tmp, "remote")
+        with open(remote, "w"):
+            pass
+        result = TreeTransfer([LocalSFTP()]).put_tree(self.src, remote)
+        self.assertFalse(result.files)
+        self.assertIn("", result.errors)
+        self.assertIn("b/d/e", result.errors)
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.src = os.path.join(self.tmp, "src")
+        self.remote = os.path.join(self.tmp, "remote")
+        os.makedirs(os.path.join(self.src, "dir"))
+        for rel in ["a", "dir/b"]:
+            self.write(os.path.join(self.src, rel), rel)
+        self.sftp = LocalSFTP()
+        self.transfer = TreeTransfer([self.sftp, LocalSFTP()])
+
+    def write(self, path, data):
+        with open(path, "w") as fp:
+            fp.write(data)
+
+    def test_only_new_and_changed_files_are_sent(self):
+        report = self.transfer.sync(self.src, self.remote)
+        self.assertEqual(report.new, ["a", "dir/b"])
+        self.assertEqual(report.errors, {})
+        report = self.transfer.sync(self.src, self.remote)
+        self.assertEqual((report.new, report.unchanged), ([], 2))
+
+        self.write(os.path.join(self.src, "a"), "changed")
+        report = self.transfer.sync(self.src, self.remote)
+        self.assertEqual((report.new, report.changed), ([], ["a"]))
+        self.assertEqual(report.bytes_to_send, 7)
+        with open(os.path.join(self.remote, "a")) as fp:
+            self.assertEqual(fp.read(), "changed")
+
+    def test_delete_and_dry_run(self):
+        self.transfer.sync(self.src, self.remote)
+        os.makedirs(os.path.join(self.remote, "extra", "deeper"))
+        self.write(os.path.join(self.remote, "extra", "deeper", "c"), "c")
+        report = self.transfer.sync(
+            self.src, self.remote, delete=True, dry_run=True)
+        self.assertEqual(
+            report.deleted, ["extra/deeper/c", "extra/deeper", "extra"])
+        self.assertTrue(os.path.isdir(os.path.join(self.remote, "extra")))
+        report = self.transfer.sync(self.src, self.remote, delete=True)
+        self.assertEqual(report.errors, {})
+        self.assertFalse(os.path.exists(os.path.join(self.remote, "extra")))
+
+    def test_checksum_ignores_mtime(self):
+        self.transfer.sync(self.src, self.remote)
+        os.utime(os.path.join(self.src, "a"), (0, 0))
+        self.assertEqual(
+            self.transfer.sync(self.src, self.remote).changed, ["a"])
+        os.utime(os.path.join(self.src, "a"), (0, 0))
+        self.write(os.path.join(self.remote, "a"), "A")
+        report = self.transfer.sync(
+            self.src, self.remote, remote_hashes=lambda paths: dict(
+                (path, file_sha256(path)) for path in paths))
+        self.assertEqual((report.changed, report.unchanged), (["a"], 1))
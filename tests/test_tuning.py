@@ -0,0 +1,90 @@
+import socket
+import unittest
+
+from sshaolin import tuning
+from sshaolin.client import SSHClient
+from tests.server import SSHServer
+
+
+class TestProfiles(unittest.TestCase):
+    def test_resolve(self):
+        profile = tuning.resolve("wan", ciphers=["aes256-ctr"])
+        self.assertEqual(profile.ciphers, ("aes256-ctr",))
+        self.assertEqual(profile.digests, tuning.PROFILES["wan"].digests)
+        self.assertTrue(profile.compress)
+        self.assertEqual(tuning.resolve(compress=False).compress, False)
+        self.assertIsNone(tuning.resolve().compress)
+        self.assertRaises(ValueError, tuning.resolve, "fast")
+
+    def test_prefer(self):
+        self.assertEqual(
+            tuning.prefer(("a", "b", "c"), ("c", "unknown", "a")),
+            ("c", "a", "b"))
+
+    def test_auto_compression(self):
+        links = tuning.LinkEstimator(weight=1)
+        link = ("foo", 22)
+        self.assertFalse(links.compress(link))
+        links.record_rtt(link, 0.1)
+        self.assertTrue(links.compress(link))
+        links.record_transfer(link, 1024, 1)
+        self.assertTrue(links.compress(link))
+        links.record_transfer(link, 100 * 1024 * 1024, 1)
+        self.assertFalse(links.compress(link))
+        links.record_transfer(link, 2 * 1024 * 1024, 1)
+        self.assertTrue(links.compress(link))
+
+
+class TestTunedConnections(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SSHServer(lambda command: (b"ok", b"", 0))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def connect(self, **kwargs):
+        client = SSHClient(
+            "127.0.0.1", self.server.port, "user", password="password",
+            **kwargs)
+        ssh = client._connect()
+        self.addCleanup(ssh.close)
+        return ssh.get_transport()
+
+    def test_default_compresses_with_nodelay(self):
+        transport = self.connect()
+        self.assertEqual(transport.local_compression, "zlib@openssh.com")
+        self.assertTrue(transport.sock.getsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY))
+
+    def test_profile(self):
+        transport = self.connect(profile="lan-throughput")
+        self.assertEqual(transport.local_compression, "none")
+        self.assertEqual(transport.local_cipher, "aes128-ctr")
+        self.assertEqual(
+            transport.local_mac, "hmac-sha2-256-etm@openssh.com")
+        transport = self.connect(profile="wan")
+        self.assertEqual(transport.local_compression, "zlib@openssh.com")
+        self.assertEqual(
+            transport.default_window_size, tuning.PROFILES[
+                "wan"].window_size)
+
+    def test_explicit_preferences(self):
+        transport = self.connect(
+            profile="low-cpu", ciphers=["aes256-ctr"],
+            digests=["hmac-sha2-512"], kex=["diffie-hellman-group14-sha256"])
+        self.assertEqual(
+            (transport.local_cipher, transport.local_mac,
+             transport.get_security_options().kex[0]),
+            ("aes256-ctr", "hmac-sha2-512", "diffie-hellman-group14-sha256"))
+
+    def test_auto_compression_uses_measured_throughput(self):
+        self.addCleanup(tuning.links.clear)
+        link = ("127.0.0.1", self.server.port)
+        tuning.links.record_transfer(link, 10 * 1024 * 1024, 10)
+        transport = self.connect(compress="auto")
+        self.assertEqual(transport.local_compression, "zlib@openssh.com")
+        tuning.links.clear()
+        transport = self.connect(compress="auto")
+        self.assertEqual(transport.local_compression, "none")